@@ -1,10 +1,10 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_file, Response
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_file, Response, g, has_app_context, stream_with_context, get_template_attribute
 import sqlite3
 from pathlib import Path
 from datetime import datetime, timezone, timedelta
 import requests
 from werkzeug.security import generate_password_hash, check_password_hash
-from functools import wraps
+from functools import wraps, lru_cache
 import logging
 import hashlib
 
@@ -73,14 +73,15 @@ import threading
 import time
 import secrets
 import qrcode
+import qrcode.image.svg
 from io import BytesIO
-import base64
 import os
 import tempfile
 import urllib.parse
 import ipaddress
 import socket
 import zipfile
+import gzip
 import shutil
 from werkzeug.utils import secure_filename
 from werkzeug.middleware.proxy_fix import ProxyFix
@@ -91,7 +92,29 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email import encoders
 from backup_manager import BackupManager
-from tlc_client import TrailLifeConnectClient
+from tlc_client import TLCClientCache
+from tlc_logins import (save as save_tlc_login, load as load_tlc_login, delete as delete_tlc_login,
+                        prune as prune_tlc_logins)
+from db_pool import ConnectionPool, PooledConnection
+from settings_cache import SettingsCache
+from bootstrap import run_stages, is_bootstrapped
+from migrations import apply_migrations
+from live_roster import RosterCache, latest_seq as latest_roster_seq, prune_changes as prune_roster_changes
+from phone_search import search_key as phone_search_key, suffix_range as phone_suffix_range
+from checkout_codes import allocate_code as allocate_checkout_code, pool_stats as checkout_code_pool_stats, CodePoolExhausted
+from print_queue import (PrintQueue, enqueue as enqueue_print_job, job_status as print_job_status,
+                         make_backend as make_print_backend)
+from family_import import (COLUMNS as FAMILY_IMPORT_COLUMNS, ImportProgress, load_progress as load_import_progress,
+                           run_import as run_family_import)
+from ical_sync import (content_hash as ical_content_hash, last_good_run as last_ical_sync_run,
+                       parse_events as parse_ical_events, apply_events as apply_ical_events,
+                       record_run as record_ical_sync_run, recent_runs as recent_ical_sync_runs,
+                       sync_window as ical_sync_window)
+from job_runner import Job, JobRunner, every, next_cron_time
+from task_queue import (PermanentError, TaskQueue, enqueue as enqueue_task_row, prune as prune_tasks,
+                        report_progress as report_task_progress, task_status)
+from share_tokens import (SharePayloadCache, create_token as create_share_token,
+                          complete_tokens as complete_share_tokens, sweep_expired as sweep_expired_share_tokens)
 
 # Disable SSL warnings for whitelisted calendar domains
 # We disable SSL verification only for pre-approved domains in ALLOWED_ICAL_DOMAINS
@@ -146,12 +169,12 @@ ALLOWED_ICAL_DOMAINS = [
     'tutanota.com',
 ]
 
-# Optional label printing support
+# Optional label printing support (label_printer imports without Pillow, but can't render)
 try:
-    from label_printer import generate_unique_code, print_checkout_label
-    LABEL_PRINTING_AVAILABLE = True
+    from label_printer import HAS_PIL as LABEL_PRINTING_AVAILABLE, get_renderer as get_label_renderer
 except ImportError:
     LABEL_PRINTING_AVAILABLE = False
+if not LABEL_PRINTING_AVAILABLE:
     print("Warning: Label printing libraries not available. Install Pillow to enable this feature.")
 
 def normalize_address(address):
@@ -189,41 +212,94 @@ else:
         # Running locally without data directory
         DB_PATH = Path(__file__).parent / 'checkin.db'
 
+# One connection pool per database file per worker process
+_db_pools = {}
+_db_pools_lock = threading.Lock()
+
+def get_db_pool(db_path=None):
+    """Get (or create) the connection pool for the configured database"""
+    db_path = str(db_path or app.config.get('DATABASE', DB_PATH))
+    pool = _db_pools.get(db_path)
+    if pool is None:
+        with _db_pools_lock:
+            pool = _db_pools.get(db_path)
+            if pool is None:
+                pool = ConnectionPool(db_path, max_idle=4, timeout=30)
+                _db_pools[db_path] = pool
+    return pool
+
 def get_db():
-    db_path = app.config.get('DATABASE', DB_PATH)
-    conn = sqlite3.connect(db_path, timeout=30)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")
-    return conn
+    """Get a database connection.
 
-def ensure_tlc_synced_column():
-    """Ensure the tlc_synced column exists in the checkins table."""
+    Within an app/request context every caller shares one pooled connection,
+    which is returned to the pool on teardown. Outside a context a pooled
+    connection is borrowed and returned when the caller closes it.
+    """
+    pool = get_db_pool()
+    if has_app_context():
+        conn = g.get('_db_conn')
+        if conn is None or conn._pool is not pool:
+            if conn is not None:
+                conn.release()
+            conn = PooledConnection(pool, pool.acquire(), request_bound=True)
+            g._db_conn = conn
+        return conn
+    return PooledConnection(pool, pool.acquire())
+
+def close_db_pools():
+    """Close all pooled connections and empty the WAL (before restoring the database file)"""
+    if has_app_context():
+        conn = g.pop('_db_conn', None)
+        if conn is not None:
+            conn.release()
+    for pool in list(_db_pools.values()):
+        pool.close_all()
+    get_db_pool(DB_PATH).checkpoint()
+    settings_cache.clear()
+    roster_cache.clear()
+    share_payload_cache.clear()
+
+def mark_db_replaced():
+    """Make every worker reconnect once the database file has been replaced (see ConnectionPool.mark_replaced)"""
+    get_db_pool(DB_PATH).mark_replaced()
+
+# Per-worker snapshot of the settings table (see settings_cache.py)
+settings_cache = SettingsCache()
+
+def get_settings():
+    """Get all settings as a dict, served from the worker's cached snapshot"""
     conn = get_db()
     try:
-        conn.execute('SELECT tlc_synced FROM checkins LIMIT 1')
-    except sqlite3.OperationalError:
-        try:
-            conn.execute('ALTER TABLE checkins ADD COLUMN tlc_synced BOOLEAN DEFAULT 0')
-            conn.commit()
-        except Exception:
-            pass # Might have been added by another thread/process
+        return settings_cache.snapshot(conn, str(app.config.get('DATABASE', DB_PATH)))
+    except sqlite3.Error:
+        # Database isn't initialized yet
+        return {}
     finally:
         conn.close()
 
-def ensure_adult_phone_column():
-    """Ensure the phone column exists in the adults table."""
+def get_setting(key, default=None):
+    """Get a single setting value (None-valued rows are returned as None)"""
+    return get_settings().get(key, default)
+
+def checkin_time_window(date_str):
+    """Index-friendly bounds on checkin_time (stored in UTC) covering a local date.
+    
+    A local day spans parts of up to three UTC dates, so the window is one day
+    wider on each side; callers still apply the exact local-date filter.
+    """
+    day = datetime.strptime(date_str, '%Y-%m-%d').date()
+    return ((day - timedelta(days=1)).isoformat(), (day + timedelta(days=2)).isoformat())
+
+def migrate_db():
+    """Apply pending numbered schema migrations (see migrations.py)"""
     conn = get_db()
     try:
-        conn.execute('SELECT phone FROM adults LIMIT 1')
-    except sqlite3.OperationalError:
-        try:
-            conn.execute('ALTER TABLE adults ADD COLUMN phone TEXT')
-            conn.commit()
-            app.logger.info('Added phone column to adults table')
-        except Exception:
-            pass # Might have been added by another thread/process
+        applied = apply_migrations(conn)
     finally:
         conn.close()
+    if applied:
+        app.logger.info(f"Applied schema migrations: {applied}")
+    return applied
 
 def init_db():
     conn = sqlite3.connect(app.config.get('DATABASE', DB_PATH))
@@ -238,6 +314,13 @@ def init_db():
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'dev-key-for-local')  # override in prod with env var
 
+@app.teardown_appcontext
+def release_db(exception=None):
+    """Return the context's pooled connection to the pool"""
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        conn.release()
+
 # Automatic encryption migration on startup (v1.0.1+)
 def auto_migrate_encryption():
     """
@@ -307,13 +390,6 @@ def auto_migrate_encryption():
         # Don't raise - allow app to start even if migration fails
         # User can run manual migration or troubleshoot
 
-# Run auto-migration on app startup
-try:
-    with app.app_context():
-        auto_migrate_encryption()
-except Exception as e:
-    print(f"Warning: Auto-migration check failed: {str(e)}")
-
 def populate_name_hashes():
     """
     Populate name_hash and name_token_hashes columns for existing adults and kids records.
@@ -326,44 +402,9 @@ def populate_name_hashes():
     logger = logging.getLogger(__name__)
     
     try:
+        # The name_hash/name_token_hashes columns are added by migration 1 (migrations.py)
         conn = get_db()
         
-        # Add missing columns to adults table
-        try:
-            cursor = conn.execute("PRAGMA table_info(adults)")
-            columns = [row[1] for row in cursor.fetchall()]
-            
-            if 'name_hash' not in columns:
-                logger.info("Adding name_hash column to adults table...")
-                conn.execute("ALTER TABLE adults ADD COLUMN name_hash TEXT")
-                conn.commit()
-            
-            if 'name_token_hashes' not in columns:
-                logger.info("Adding name_token_hashes column to adults table...")
-                conn.execute("ALTER TABLE adults ADD COLUMN name_token_hashes TEXT")
-                conn.commit()
-        except Exception as e:
-            if "duplicate column" not in str(e):
-                logger.warning(f"Could not add columns to adults: {e}")
-        
-        # Add missing columns to kids table
-        try:
-            cursor = conn.execute("PRAGMA table_info(kids)")
-            columns = [row[1] for row in cursor.fetchall()]
-            
-            if 'name_hash' not in columns:
-                logger.info("Adding name_hash column to kids table...")
-                conn.execute("ALTER TABLE kids ADD COLUMN name_hash TEXT")
-                conn.commit()
-            
-            if 'name_token_hashes' not in columns:
-                logger.info("Adding name_token_hashes column to kids table...")
-                conn.execute("ALTER TABLE kids ADD COLUMN name_token_hashes TEXT")
-                conn.commit()
-        except Exception as e:
-            if "duplicate column" not in str(e):
-                logger.warning(f"Could not add columns to kids: {e}")
-        
         # Populate missing name_hashes in adults table
         adults_missing = conn.execute(
             "SELECT id, name FROM adults WHERE name_hash IS NULL OR name_hash = '' OR name_token_hashes IS NULL OR name_token_hashes = ''"
@@ -400,13 +441,6 @@ def populate_name_hashes():
         logger.warning(f"Could not populate name hashes: {str(e)}")
         # This is not fatal - happens on fresh installs before schema is created
 
-# Populate name hashes on app startup (for existing databases)
-try:
-    with app.app_context():
-        populate_name_hashes()
-except Exception as e:
-    print(f"Warning: Name hash population failed: {str(e)}")
-
 def migrate_plaintext_passwords():
     """Migrate plaintext passwords to hashed versions"""
     try:
@@ -424,46 +458,10 @@ def migrate_plaintext_passwords():
             conn.commit()
             print("INFO:app:Password migration: app_password hashed")
         
-        # Create login tracking tables if they don't exist
-        try:
-            conn.execute("SELECT 1 FROM login_attempts LIMIT 1")
-        except:
-            print("INFO:app:Creating login_attempts table...")
-            conn.execute("""
-                CREATE TABLE login_attempts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    ip_address TEXT NOT NULL,
-                    attempt_time TEXT NOT NULL,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            conn.execute("CREATE INDEX idx_login_attempts_ip_time ON login_attempts(ip_address, attempt_time)")
-            conn.commit()
-        
-        try:
-            conn.execute("SELECT 1 FROM login_lockout LIMIT 1")
-        except:
-            print("INFO:app:Creating login_lockout table...")
-            conn.execute("""
-                CREATE TABLE login_lockout (
-                    ip_address TEXT PRIMARY KEY,
-                    locked_until TEXT NOT NULL
-                )
-            """)
-            conn.execute("CREATE INDEX idx_login_lockout_ip ON login_lockout(ip_address)")
-            conn.commit()
-        
         conn.close()
     except Exception as e:
         print(f"WARNING:app:Password migration error: {str(e)}")
 
-# Migrate passwords on app startup
-try:
-    with app.app_context():
-        migrate_plaintext_passwords()
-except Exception as e:
-    print(f"Warning: Password migration failed: {str(e)}")
-
 # Trust proxy headers for HTTPS detection behind reverse proxy
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_port=1)
 
@@ -480,25 +478,13 @@ UPLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
 @app.context_processor
 def inject_version():
     try:
-        conn = get_db()
-        
         # Get footer settings
-        footer_enabled_row = conn.execute("SELECT value FROM settings WHERE key = 'footer_enabled'").fetchone()
-        footer_enabled = footer_enabled_row[0] == 'True' if footer_enabled_row else True
-        
-        footer_text_row = conn.execute("SELECT value FROM settings WHERE key = 'footer_text'").fetchone()
-        footer_text = footer_text_row[0] if footer_text_row else ''
-        
-        footer_show_github_row = conn.execute("SELECT value FROM settings WHERE key = 'footer_show_github'").fetchone()
-        footer_show_github = footer_show_github_row[0] == 'True' if footer_show_github_row else True
-        
-        footer_show_version_row = conn.execute("SELECT value FROM settings WHERE key = 'footer_show_version'").fetchone()
-        footer_show_version = footer_show_version_row[0] == 'True' if footer_show_version_row else True
-        
-        footer_show_admin_link_row = conn.execute("SELECT value FROM settings WHERE key = 'footer_show_admin_link'").fetchone()
-        footer_show_admin_link = footer_show_admin_link_row[0] == 'True' if footer_show_admin_link_row else True
-        
-        conn.close()
+        settings = get_settings()
+        footer_enabled = settings['footer_enabled'] == 'True' if 'footer_enabled' in settings else True
+        footer_text = settings.get('footer_text', '')
+        footer_show_github = settings['footer_show_github'] == 'True' if 'footer_show_github' in settings else True
+        footer_show_version = settings['footer_show_version'] == 'True' if 'footer_show_version' in settings else True
+        footer_show_admin_link = settings['footer_show_admin_link'] == 'True' if 'footer_show_admin_link' in settings else True
         
         return {
             'app_version': get_version_string(),
@@ -524,40 +510,154 @@ def inject_version():
 # Get timezone from database, default to America/Chicago
 def get_timezone():
     try:
-        conn = get_db()
-        row = conn.execute("SELECT value FROM settings WHERE key = 'timezone'").fetchone()
-        conn.close()
-        if row:
-            return pytz.timezone(row[0])
+        tz_name = get_setting('timezone')
+        if tz_name:
+            return pytz.timezone(tz_name)
     except:
         pass
     return pytz.timezone('America/Chicago')
 
 local_tz = get_timezone()
 
+def format_checkin_time(value):
+    """Format a stored (UTC) checkin_time for roster display"""
+    try:
+        dt = datetime.fromisoformat(value)
+        if dt.tzinfo is None:
+            dt = pytz.UTC.localize(dt)
+        return dt.astimezone(local_tz).strftime('%b %d %I:%M %p')
+    except (ValueError, TypeError):
+        return 'N/A'
+
+# Per-worker share page payloads, invalidated through share_tokens.version (see share_tokens.py)
+share_payload_cache = SharePayloadCache()
+
+def render_label_images(labels, label_size):
+    """Render label dicts (as built by checkin_selected) to images for the print queue"""
+    return get_label_renderer(label_size).render_batch(labels)
+
+# Server-side label printing (see print_queue.py); the worker thread starts with the other background services
+print_queue = PrintQueue(get_db, lambda: make_print_backend(get_settings()), render_label_images)
+
+# Slow external I/O (email, TLC, iCal, backups) runs on the task queue (see task_queue.py);
+# handlers are registered with @task_handler next to the code they run
+task_handlers = {}
+task_queue = TaskQueue(get_db, task_handlers)
+
+# Tasks a browser session keeps polling for
+MAX_TRACKED_TASKS = 10
+
+def task_handler(kind):
+    """Register a function as the handler for a task kind (run inside an app context)"""
+    def register(func):
+        @wraps(func)
+        def run(**kwargs):
+            with app.app_context():
+                return func(**kwargs)
+        task_handlers[kind] = run
+        return func
+    return register
+
+def enqueue_task(kind, label, max_attempts=3, **payload):
+    """Queue a task and track it in the session, so the next page shows its progress and outcome"""
+    conn = get_db()
+    task_id = enqueue_task_row(conn, kind, label, payload, max_attempts)
+    conn.commit()
+    conn.close()
+    task_queue.notify()
+    session['tasks'] = (session.get('tasks', []) + [task_id])[-MAX_TRACKED_TASKS:]
+    return task_id
+
+@app.context_processor
+def inject_pending_tasks():
+    return {'pending_tasks': session.get('tasks', [])}
+
+# Per-worker logged-in TLC clients, reused by pages and background tasks (see tlc_client.py)
+tlc_clients = TLCClientCache()
+
+def tlc_task_login():
+    """Store the session's TLC credentials for background tasks; returns the login id to queue instead of them"""
+    conn = get_db()
+    try:
+        login_id = session.get('tlc_login_id')
+        credentials = (session['tlc_email'], session['tlc_password'])
+        if login_id is None or load_tlc_login(conn, app.secret_key, login_id) != credentials:
+            login_id = save_tlc_login(conn, app.secret_key, *credentials)
+            conn.commit()
+            session['tlc_login_id'] = login_id
+    finally:
+        conn.close()
+    return login_id
+
+def tlc_task_client(tlc_login_id):
+    """Logged-in TLC client for a task's stored login (see tlc_logins.py), or None if login fails"""
+    conn = get_db()
+    credentials = load_tlc_login(conn, app.secret_key, tlc_login_id)
+    conn.close()
+    if credentials is None:
+        raise PermanentError('Trail Life Connect login expired. Please log in again.')
+    return tlc_clients.get(*credentials)
+
+def forget_tlc_login():
+    """Drop the session's TLC credentials and any copy stored for tasks"""
+    session.pop('tlc_email', None)
+    session.pop('tlc_password', None)
+    login_id = session.pop('tlc_login_id', None)
+    if login_id is not None:
+        conn = get_db()
+        delete_tlc_login(conn, login_id)
+        conn.commit()
+        conn.close()
+
+# Per-worker live rosters, updated from the roster_changes log (see live_roster.py)
+roster_cache = RosterCache(format_checkin_time)
+
+def get_live_roster(conn, event_id):
+    """Get the open check-ins for an event, sorted by last name (do not mutate the result)"""
+    return roster_cache.roster(conn, str(app.config.get('DATABASE', DB_PATH)), event_id)
+
+def get_roster_deltas(conn, event_id, since, view):
+    """
+    Get roster changes after a change sequence number, rendered for a page
+
+    Args:
+        conn: Open database connection
+        event_id: Event being watched
+        since: Last change sequence number the page has applied
+        view: 'index' or 'kiosk' - which page's row markup to render
+
+    Returns:
+        (seq, changes) where each change has op, checkin_id and, for upserts,
+        the row html and its position in the sorted roster
+    """
+    seq, deltas = roster_cache.deltas(conn, str(app.config.get('DATABASE', DB_PATH)), event_id, since)
+    if not deltas:
+        return seq, []
+    if view == 'kiosk':
+        kiosk_row = get_template_attribute('roster_rows.html', 'kiosk_row')
+        render_row = lambda entry: kiosk_row(entry, event_id)
+    else:
+        index_row = get_template_attribute('roster_rows.html', 'index_row')
+        branding = get_branding_settings()
+        render_row = lambda entry: index_row(entry, event_id, branding)
+
+    changes = []
+    for delta in deltas:
+        change = {'op': delta['op'], 'checkin_id': delta['checkin_id']}
+        if delta['op'] == 'upsert':
+            change['html'] = str(render_row(delta['entry']))
+            change['position'] = delta['position']
+        changes.append(change)
+    return seq, changes
+
 # Developer password from environment variable for security
 # Falls back to None if not set (disables developer override features)
 DEVELOPER_PASSWORD = os.getenv('DEVELOPER_PASSWORD', None)
 
-# Initialize scheduled backup
-try:
-    from apscheduler.schedulers.background import BackgroundScheduler
-    from apscheduler.triggers.cron import CronTrigger
-    
-    scheduler = BackgroundScheduler(daemon=True)
-    scheduler.start()
-except ImportError:
-    scheduler = None
-    app.logger.warning("APScheduler not installed. Scheduled backups disabled.")
-
 def get_backup_encryption_password():
     """Get backup encryption password from settings"""
     try:
-        conn = get_db()
-        cur = conn.execute("SELECT value FROM settings WHERE key = 'backup_encryption_password'")
-        row = cur.fetchone()
-        conn.close()
-        return row['value'] if row and row['value'] else None
+        return get_setting('backup_encryption_password') or None
     except:
         return None
 
@@ -585,11 +685,7 @@ def inject_branding():
     demo_mode = os.getenv('DEMO_MODE', 'false').lower() == 'true'
     demo_banner = None
     if demo_mode:
-        conn = get_db()
-        cur = conn.execute("SELECT value FROM settings WHERE key = 'demo_banner'")
-        row = cur.fetchone()
-        demo_banner = row['value'] if row else 'This is a demonstration instance. Data resets periodically.'
-        conn.close()
+        demo_banner = get_setting('demo_banner', 'This is a demonstration instance. Data resets periodically.')
     
     return {
         'branding': get_branding_settings(),
@@ -597,6 +693,18 @@ def inject_branding():
         'demo_banner': demo_banner
     }
 
+@app.before_request
+def ensure_started():
+    """Bootstrap and start background services on the first request in this process"""
+    if not _background_started:
+        # Standalone runs (flask run, gunicorn without gunicorn.conf.py) bootstrap here;
+        # workers forked from a bootstrapped gunicorn master skip it
+        try:
+            bootstrap()
+        except Exception as e:
+            print(f"Warning: Startup bootstrap failed: {str(e)}")
+        start_background_services()
+
 @app.before_request
 def check_setup():
     """Check if initial setup is needed and redirect if necessary"""
@@ -610,12 +718,7 @@ def check_setup():
     
     # Check if setup is complete
     try:
-        conn = get_db()
-        cur = conn.execute("SELECT value FROM settings WHERE key = 'is_setup_complete'")
-        row = cur.fetchone()
-        conn.close()
-        
-        is_complete = row['value'] if row else 'false'
+        is_complete = get_setting('is_setup_complete', 'false')
         
         # Redirect to setup if not complete
         if is_complete != 'true':
@@ -629,15 +732,45 @@ def ensure_db():
     if not DB_PATH.exists():
         init_db()
     # Run migrations to ensure schema is up to date
-    ensure_adult_phone_column()
+    migrate_db()
+
+def prune_roster_log():
+    """Drop roster change log rows no live roster can still need (at startup and by the job runner)"""
+    conn = get_db()
+    try:
+        removed = prune_roster_changes(conn)
+    finally:
+        conn.close()
+    if removed:
+        app.logger.info(f"Pruned {removed} roster change log rows")
+    return f"Removed {removed} roster change log rows"
+
+def bootstrap(force=False):
+    """Run one-time startup tasks (migrations, schema, hash backfill) under a cross-process lock.
+    
+    Called from the gunicorn master's on_starting hook so workers boot without touching
+    the database; skipped in processes that already bootstrapped unless force=True.
+    Returns the per-stage timing report, or None if skipped.
+    """
+    if is_bootstrapped() and not force:
+        return None
+    
+    stages = [
+        ('encryption_migration', auto_migrate_encryption),
+        ('schema', ensure_db),
+        ('name_hashes', populate_name_hashes),
+        ('password_migration', migrate_plaintext_passwords),
+        ('roster_log_prune', prune_roster_log),
+    ]
+    lock_path = f"{app.config.get('DATABASE', DB_PATH)}.bootstrap.lock"
+    with app.app_context():
+        report = run_stages(stages, lock_path)
+    app.config['BOOTSTRAP_REPORT'] = report
+    return report
 
 def get_app_password():
     """Get the app password hash from settings, or return None"""
-    conn = get_db()
-    cur = conn.execute("SELECT value FROM settings WHERE key = 'app_password'")
-    row = cur.fetchone()
-    conn.close()
-    return row['value'] if row else None
+    return get_setting('app_password')
 
 def set_app_password(password):
     """Set the app password hash in settings (passwords should already be validated/hashed)"""
@@ -738,12 +871,9 @@ def validate_password_strength(password):
 
 def get_override_password():
     """Get the admin override checkout password from settings, or return app password as default"""
-    conn = get_db()
-    cur = conn.execute("SELECT value FROM settings WHERE key = 'admin_override_password'")
-    row = cur.fetchone()
-    conn.close()
+    settings = get_settings()
     # If no override password set, fall back to app password for backward compatibility
-    return row['value'] if row else get_app_password()
+    return settings['admin_override_password'] if 'admin_override_password' in settings else settings.get('app_password')
 
 def set_override_password(password):
     """Set the admin override checkout password in settings"""
@@ -764,11 +894,7 @@ def allowed_file(filename, allowed_extensions=None):
 
 def get_logo_filename():
     """Get the current logo filename from settings"""
-    conn = get_db()
-    cur = conn.execute("SELECT value FROM settings WHERE key = 'logo_filename'")
-    row = cur.fetchone()
-    conn.close()
-    return row['value'] if row else None
+    return get_setting('logo_filename')
 
 def set_logo_filename(filename):
     """Set the logo filename in settings"""
@@ -782,11 +908,7 @@ def set_logo_filename(filename):
 
 def get_favicon_filename():
     """Get the current favicon filename from settings"""
-    conn = get_db()
-    cur = conn.execute("SELECT value FROM settings WHERE key = 'favicon_filename'")
-    row = cur.fetchone()
-    conn.close()
-    return row['value'] if row else None
+    return get_setting('favicon_filename')
 
 def set_favicon_filename(filename):
     """Set the favicon filename in settings"""
@@ -806,9 +928,6 @@ def generate_recovery_codes():
     conn = get_db()
     
     try:
-        # Set timeout to allow waiting for locked database (5 seconds)
-        conn.execute("PRAGMA busy_timeout = 5000")
-        
         # Clear old unused codes first
         conn.execute("DELETE FROM recovery_codes WHERE used = 0")
         
@@ -884,12 +1003,7 @@ def get_recovery_codes_count():
 
 def get_recovery_email():
     """Get the recovery email address from settings"""
-    conn = get_db()
-    try:
-        row = conn.execute("SELECT value FROM settings WHERE key = 'recovery_email'").fetchone()
-        return row['value'] if row else None
-    finally:
-        conn.close()
+    return get_setting('recovery_email')
 
 def set_recovery_email(email):
     """Set the recovery email address in settings"""
@@ -905,8 +1019,7 @@ def set_recovery_email(email):
 
 def get_branding_settings():
     """Get all branding/customization settings for templates"""
-    conn = get_db()
-    settings = {}
+    stored = get_settings()
     defaults = {
         'organization_name': 'Check-In System',
         'organization_type': 'other',
@@ -918,13 +1031,7 @@ def get_branding_settings():
         'favicon_filename': None,
     }
     
-    for key, default in defaults.items():
-        cur = conn.execute("SELECT value FROM settings WHERE key = ?", (key,))
-        row = cur.fetchone()
-        settings[key] = row['value'] if row else default
-    
-    conn.close()
-    return settings
+    return {key: stored.get(key, default) for key, default in defaults.items()}
 
 def set_branding_setting(key, value):
     """Update a branding setting"""
@@ -935,17 +1042,9 @@ def set_branding_setting(key, value):
 
 def get_smtp_settings():
     """Get all SMTP settings from database"""
-    conn = get_db()
-    settings = {}
+    stored = get_settings()
     keys = ['smtp_server', 'smtp_port', 'smtp_from', 'smtp_username', 'smtp_password', 'smtp_use_tls']
-    
-    for key in keys:
-        cur = conn.execute("SELECT value FROM settings WHERE key = ?", (key,))
-        row = cur.fetchone()
-        settings[key] = row['value'] if row else None
-    
-    conn.close()
-    return settings
+    return {key: stored.get(key) for key in keys}
 
 def set_smtp_settings(smtp_dict):
     """Save SMTP settings to database"""
@@ -974,11 +1073,7 @@ def send_email(to_address, subject, html_body, plain_text_body=None, attachment_
         smtp_settings = get_smtp_settings()
         
         # Validate SMTP settings are configured
-        if not all([smtp_settings.get('smtp_server'), 
-                    smtp_settings.get('smtp_port'),
-                    smtp_settings.get('smtp_from'),
-                    smtp_settings.get('smtp_username'),
-                    smtp_settings.get('smtp_password')]):
+        if not all(smtp_settings.get(key) for key in SMTP_REQUIRED_SETTINGS):
             return False, "SMTP settings not configured. Please configure SMTP in admin settings."
         
         # Create message - use mixed if we have an attachment, alternative otherwise
@@ -1039,20 +1134,79 @@ def send_email(to_address, subject, html_body, plain_text_body=None, attachment_
     except Exception as e:
         return False, f"Failed to send email: {str(e)}"
 
-def get_event_date_range_months():
-    """Get the number of months (past and future) to show events for. Default is 1 month."""
+# Settings send_email can't do without
+SMTP_REQUIRED_SETTINGS = ['smtp_server', 'smtp_port', 'smtp_from', 'smtp_username', 'smtp_password']
+
+def require_smtp_settings():
+    """Fail a task outright, rather than retrying, while SMTP isn't configured"""
+    smtp_settings = get_smtp_settings()
+    if not all(smtp_settings.get(key) for key in SMTP_REQUIRED_SETTINGS):
+        raise PermanentError("SMTP settings not configured. Please configure SMTP in admin settings.")
+
+@task_handler('password_reset_email')
+def send_password_reset_email():
+    """Generate a password reset code and email it to the recovery address (run on the task queue)"""
+    require_smtp_settings()
+    recovery_email = get_recovery_email()
+    if not recovery_email:
+        raise PermanentError('Email recovery is not configured')
+
+    # Store the code's hash with its expiration (10 minutes); a retry replaces it
+    reset_code = secrets.token_urlsafe(32)
+    reset_code_hash = hashlib.sha256(reset_code.encode()).hexdigest()
+    expires = datetime.now(timezone.utc) + timedelta(minutes=10)
     conn = get_db()
-    cur = conn.execute("SELECT value FROM settings WHERE key = 'event_date_range_months'")
-    row = cur.fetchone()
+    conn.execute(
+        "INSERT OR REPLACE INTO settings (key, value) VALUES ('password_reset_code', ?)",
+        (f"{reset_code_hash}|{expires.isoformat()}",)
+    )
+    conn.commit()
     conn.close()
-    
-    if row and row['value']:
+
+    success, message = send_email(
+        recovery_email,
+        'Password Recovery - Youth Secure Check-in',
+        f'''
+        <p>Someone requested a password reset for your Youth Secure Check-in account.</p>
+        <p><strong>Reset Code:</strong></p>
+        <p style="font-family: monospace; font-size: 14px; background: #f5f5f5; padding: 10px; border-radius: 5px;">
+            {reset_code}
+        </p>
+        <p>This code expires in 10 minutes. If you didn't request this, ignore this email.</p>
+        ''',
+        f'Reset code: {reset_code}'
+    )
+    if not success:
+        raise RuntimeError(message)
+    return 'Recovery code sent'
+
+@task_handler('email')
+def send_email_task(to_address, subject, html_body, plain_text_body=None):
+    """Send an email from the task queue (raises on failure so the queue retries)"""
+    require_smtp_settings()
+    success, message = send_email(to_address, subject, html_body, plain_text_body)
+    if not success:
+        raise RuntimeError(message)
+    return message
+
+def get_event_date_range_months():
+    """Get the number of months (past and future) to show events for. Default is 1 month."""
+    value = get_setting('event_date_range_months')
+    if value:
         try:
-            return int(row['value'])
+            return int(value)
         except (ValueError, TypeError):
             return 1
     return 1
 
+def get_require_checkout_code():
+    """Whether checkout requires a code - derived from checkout_method if not explicitly set"""
+    settings = get_settings()
+    if 'require_checkout_code' in settings:
+        return settings['require_checkout_code'] == 'true'
+    # Fallback: if a checkout method is configured, codes are implicitly required
+    return settings.get('checkout_method') in ('random_codes', 'phone_codes')
+
 def parse_concat_list(concat_str, separator=':'):
     """Parse GROUP_CONCAT result into a list of dicts.
     
@@ -1090,32 +1244,65 @@ def generate_share_token():
     """
     return secrets.token_urlsafe(6)
 
-def create_qr_code(url):
-    """Generate a QR code image as base64 string"""
+QR_MIMETYPES = {'svg': 'image/svg+xml', 'png': 'image/png'}
+
+@lru_cache(maxsize=256)
+def render_qr_code(data, fmt='svg'):
+    """
+    Render a QR code image (cached - the same link always gives the same image)
+
+    Args:
+        data: Text to encode (a share link)
+        fmt: 'svg' (small and fast, the default) or 'png'
+
+    Returns:
+        Image bytes
+    """
     qr = qrcode.QRCode(version=1, box_size=10, border=4)
-    qr.add_data(url)
+    qr.add_data(data)
     qr.make(fit=True)
+    if fmt == 'svg':
+        return qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).to_string()
     img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Convert to base64 for embedding in HTML
     buffer = BytesIO()
     img.save(buffer, format='PNG')
-    buffer.seek(0)
-    img_base64 = base64.b64encode(buffer.getvalue()).decode()
-    return f"data:image/png;base64,{img_base64}"
+    return buffer.getvalue()
 
 def cleanup_expired_tokens():
-    """Remove expired share tokens from database"""
+    """Remove expired and used share tokens from database"""
     conn = get_db()
-    now = datetime.utcnow().isoformat()
-    conn.execute("DELETE FROM share_tokens WHERE expires_at < ? OR used = 1", (now,))
-    conn.commit()
-    conn.close()
+    try:
+        return sweep_expired_share_tokens(conn, datetime.utcnow().isoformat())
+    finally:
+        conn.close()
+
+# Seconds between share token sweeps (expired links stop working on their own -
+# the share page checks expires_at - so this only bounds table growth)
+SHARE_TOKEN_SWEEP_INTERVAL = 600
+
+def sweep_share_tokens_job():
+    """Delete expired share tokens (run by the job runner)"""
+    removed = cleanup_expired_tokens()
+    if removed:
+        logger.info(f"Removed {removed} expired share tokens")
+    return f"Removed {removed} share tokens"
 
-def safe_http_get(url, timeout=10, max_size=10*1024*1024):
+def prune_tasks_job():
+    """Delete finished background tasks after a week, and expired TLC logins (run by the job runner)"""
+    conn = get_db()
+    try:
+        return f"Removed {prune_tasks(conn)} finished tasks and {prune_tlc_logins(conn)} expired TLC logins"
+    finally:
+        conn.close()
+
+def safe_http_get(url, timeout=10, max_size=10*1024*1024, headers=None):
     """
     Perform a safe HTTP GET request with SSRF protection.
     Validates that the domain is in ALLOWED_ICAL_DOMAINS.
+
+    Returns:
+        The response, with its body (at most max_size bytes) read into
+        response.body - empty for a 304 Not Modified
     """
     parsed = urllib.parse.urlparse(url)
     domain = parsed.netloc.lower()
@@ -1132,117 +1319,146 @@ def safe_http_get(url, timeout=10, max_size=10*1024*1024):
         # For now, strict whitelist
         raise ValueError(f"Domain {domain} is not in the allowed list")
         
-    response = requests.get(url, timeout=timeout, stream=True)
+    response = requests.get(url, timeout=timeout, stream=True, headers=headers)
     response.raise_for_status()
     
-    content = b''
-    for chunk in response.iter_content(chunk_size=8192):
-        content += chunk
-        if len(content) > max_size:
-            raise ValueError("Response too large")
-            
-    return content
+    content = bytearray()
+    if response.status_code != 304:
+        for chunk in response.iter_content(chunk_size=65536):
+            content += chunk
+            if len(content) > max_size:
+                raise ValueError("Response too large")
+    response.body = bytes(content)
+    return response
 
 def sync_ical_events():
-    """Sync events from iCal URL - can be called manually or automatically"""
+    """Sync events from iCal URL - can be called manually or automatically
+
+    Conditional and incremental (see ical_sync.py); every run is recorded in ical_sync_runs."""
+    started = time.monotonic()
+    run = {'url': '', 'started_at': datetime.utcnow().isoformat(), 'outcome': 'error'}
     try:
         with app.app_context():
-            conn = get_db()
-            cur = conn.execute("SELECT value FROM settings WHERE key = 'ical_url'")
-            ical_row = cur.fetchone()
-            if not ical_row or not ical_row['value']:
-                conn.close()
+            ical_url = get_setting('ical_url')
+            if not ical_url:
                 return False, "No iCal URL set"
-            ical_url = ical_row['value']
-            conn.close()
-
-            # Use safe HTTP request with SSRF protection
-            content = safe_http_get(ical_url, timeout=10, max_size=10*1024*1024)
-            cal = Calendar.from_ical(content.decode('utf-8'))
+            run['url'] = ical_url
 
             conn = get_db()
-            # Track events from calendar to identify which ones to keep
-            calendar_events = []
-            event_count = 0
-            
-            for component in cal.walk():
-                if component.name == "VEVENT":
-                    name = str(component.get('summary', 'Event'))
-                    start_dt = component.get('dtstart')
-                    end_dt = component.get('dtend')
-                    start_time = None
-                    end_time = None
-                    if start_dt:
-                        dt = start_dt.dt
-                        if hasattr(dt, 'tzinfo') and dt.tzinfo:
-                            dt = dt.astimezone(local_tz)
-                        else:
-                            dt = local_tz.localize(dt)
-                        start_time = dt.isoformat()
-                    if end_dt:
-                        dt = end_dt.dt
-                        if hasattr(dt, 'tzinfo') and dt.tzinfo:
-                            dt = dt.astimezone(local_tz)
-                        else:
-                            dt = local_tz.localize(dt)
-                        end_time = dt.isoformat()
-                    description = str(component.get('description', ''))
-                    
-                    # Check if event already exists (match by name and start_time)
-                    existing = conn.execute(
-                        "SELECT id FROM events WHERE name = ? AND start_time = ?",
-                        (name, start_time)
-                    ).fetchone()
-                    
-                    if existing:
-                        # Update existing event
-                        conn.execute(
-                            "UPDATE events SET end_time = ?, description = ? WHERE id = ?",
-                            (end_time, description, existing['id'])
-                        )
-                        calendar_events.append(existing['id'])
+            try:
+                previous = last_ical_sync_run(conn, ical_url)
+                window = ical_sync_window(get_event_date_range_months())
+                run.update(window_start=window[0].isoformat(), window_end=window[1].isoformat())
+                # A 304 or an identical body only means nothing to do if the
+                # events were last expanded for this same window
+                same_window = previous is not None and \
+                    (previous['window_start'], previous['window_end']) == (run['window_start'], run['window_end'])
+                headers = {}
+                if same_window and previous['etag']:
+                    headers['If-None-Match'] = previous['etag']
+                if same_window and previous['last_modified']:
+                    headers['If-Modified-Since'] = previous['last_modified']
+
+                # Use safe HTTP request with SSRF protection
+                response = safe_http_get(ical_url, timeout=10, max_size=10*1024*1024, headers=headers)
+                run.update(http_status=response.status_code, fetched_bytes=len(response.body),
+                           etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'))
+
+                if response.status_code == 304:
+                    run.update(outcome='not_modified', etag=run['etag'] or previous['etag'],
+                               last_modified=run['last_modified'] or previous['last_modified'],
+                               content_hash=previous['content_hash'])
+                    message = "Calendar not modified"
+                else:
+                    run['content_hash'] = ical_content_hash(response.body)
+                    if same_window and previous['content_hash'] == run['content_hash']:
+                        run['outcome'] = 'unchanged'
+                        message = "Calendar unchanged"
                     else:
-                        # Insert new event
-                        cursor = conn.execute(
-                            "INSERT INTO events (name, start_time, end_time, description) VALUES (?, ?, ?, ?)",
-                            (name, start_time, end_time, description)
-                        )
-                        calendar_events.append(cursor.lastrowid)
-                    event_count += 1
-            
-            # Delete events that are no longer in the calendar (but only old ones with no active check-ins)
-            if calendar_events:
-                placeholders = ','.join('?' * len(calendar_events))
-                conn.execute(f"""
-                    DELETE FROM events 
-                    WHERE id NOT IN ({placeholders})
-                    AND start_time < datetime('now', '-7 days')
-                    AND id NOT IN (SELECT DISTINCT event_id FROM checkins WHERE checkout_time IS NULL)
-                """, calendar_events)
-            
-            conn.commit()
-
-            # Update last sync time
-            conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('last_ical_sync', ?)",
-                        (datetime.utcnow().isoformat(),))
-            conn.commit()
-            conn.close()
-            return True, f"Synced {event_count} events"
+                        events, recurring_uids = parse_ical_events(Calendar.from_ical(response.body.decode('utf-8')),
+                                                                   local_tz, window)
+                        changes = apply_ical_events(conn, events, recurring_uids, window)
+                        run.update(changes, outcome='synced', parsed_events=len(events))
+                        message = (f"Synced {len(events)} events ({changes['inserted']} added, "
+                                   f"{changes['updated']} updated, {changes['deleted']} removed)")
+
+                run['duration_ms'] = int((time.monotonic() - started) * 1000)
+                run['message'] = message
+                record_ical_sync_run(conn, run)
+                # Update last sync time
+                conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('last_ical_sync', ?)",
+                            (datetime.utcnow().isoformat(),))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+            app.logger.info(f"iCal sync: {message} in {run['duration_ms']} ms ({run['fetched_bytes']} bytes fetched)")
+            return True, message
     except Exception as e:
+        if run['url']:
+            try:
+                with app.app_context():
+                    conn = get_db()
+                    run.update(outcome='error', duration_ms=int((time.monotonic() - started) * 1000), message=str(e))
+                    record_ical_sync_run(conn, run)
+                    conn.commit()
+                    conn.close()
+            except Exception:
+                pass
         return False, f"Error syncing: {str(e)}"
 
-def auto_sync_ical():
-    """Background thread to automatically sync iCal every hour"""
-    while True:
-        time.sleep(3600)  # Wait 1 hour
-        try:
-            sync_ical_events()
-        except:
-            pass  # Silently fail, will try again next hour
+# Seconds between iCal syncs
+ICAL_SYNC_INTERVAL = 3600
+
+@task_handler('ical_sync')
+def sync_ical_job():
+    """Sync events from the iCal URL, if one is set (run by the job runner)"""
+    if not get_setting('ical_url'):
+        return "No iCal URL set"
+    success, message = sync_ical_events()
+    if not success:
+        raise RuntimeError(message)
+    return message
+
+def next_backup_time(now):
+    """When the next scheduled local backup is due (None until a schedule is saved)"""
+    settings = get_settings()
+    frequency = settings.get('backup_frequency')
+    if frequency not in ('hourly', 'daily', 'weekly', 'monthly'):
+        return None
+    try:
+        hour = int(settings.get('backup_hour', '2'))
+    except ValueError:
+        hour = 2
+    return next_cron_time(now, get_timezone(), frequency, hour)
+
+# Scheduled jobs run by one elected worker (see job_runner.py); every worker runs the thread
+job_runner = JobRunner(get_db)
+job_runner.add(Job('ical_sync', sync_ical_job, every(ICAL_SYNC_INTERVAL)))
+job_runner.add(Job('share_token_sweep', sweep_share_tokens_job, every(SHARE_TOKEN_SWEEP_INTERVAL)))
+job_runner.add(Job('local_backup', lambda: perform_scheduled_local_backup(), next_backup_time))
+job_runner.add(Job('task_prune', prune_tasks_job, every(86400)))
+job_runner.add(Job('roster_log_prune', prune_roster_log, every(3600)))
+
+# Background services start on a worker's first request rather than at import,
+# so the gunicorn master (which imports the app to bootstrap) never runs them
+_background_started = False
+_background_lock = threading.Lock()
+
+def start_background_services():
+    """Start the job runner, print queue and task queue once per process"""
+    global _background_started
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+    
+    job_runner.start()
+    print_queue.start()
+    task_queue.start()
 
-# Start background sync thread
-sync_thread = threading.Thread(target=auto_sync_ical, daemon=True)
-sync_thread.start()
 
 # Security Headers
 @app.after_request
@@ -1269,9 +1485,7 @@ def setup():
     """First-time setup wizard"""
     # Check if setup is already complete
     conn = get_db()
-    cur = conn.execute("SELECT value FROM settings WHERE key = 'is_setup_complete'")
-    row = cur.fetchone()
-    is_complete = row['value'] if row else 'false'
+    is_complete = get_setting('is_setup_complete', 'false')
     
     if is_complete == 'true':
         # Setup already done, redirect to login
@@ -1472,41 +1686,13 @@ def forgot_password():
                 return render_template('forgot_password.html')
             
             if email_input.lower() == recovery_email.lower():
-                # Generate temporary reset code
-                reset_code = secrets.token_urlsafe(32)
-                reset_code_hash = hashlib.sha256(reset_code.encode()).hexdigest()
-                
-                # Store in settings with expiration (10 minutes)
-                conn = get_db()
-                conn.execute(
-                    "INSERT OR REPLACE INTO settings (key, value) VALUES ('password_reset_code', ?)",
-                    (f"{reset_code_hash}|{datetime.now(timezone.utc).isoformat()}",)
-                )
-                conn.commit()
-                conn.close()
-                
-                # Send email with reset code
-                success, message = send_email(
-                    recovery_email,
-                    'Password Recovery - Youth Secure Check-in',
-                    f'''
-                    <p>Someone requested a password reset for your Youth Secure Check-in account.</p>
-                    <p><strong>Reset Code:</strong></p>
-                    <p style="font-family: monospace; font-size: 14px; background: #f5f5f5; padding: 10px; border-radius: 5px;">
-                        {reset_code}
-                    </p>
-                    <p>This code expires in 10 minutes. If you didn't request this, ignore this email.</p>
-                    ''',
-                    f'Reset code: {reset_code}'
-                )
+                # The code is generated by the task itself so it never sits in the
+                # task queue (the verify page shows whether the email went out)
+                enqueue_task('password_reset_email', 'Sending your recovery code', max_attempts=2)
                 
-                if success:
-                    session['email_verification_pending'] = True
-                    session['reset_email'] = email_input
-                    flash('A recovery code has been sent to your email.', 'success')
-                    return redirect(url_for('verify_reset_code'))
-                else:
-                    flash(f'Error sending email: {message}', 'danger')
+                session['email_verification_pending'] = True
+                session['reset_email'] = email_input
+                return redirect(url_for('verify_reset_code'))
             else:
                 # Don't reveal if email is correct or not (security best practice)
                 flash('If that email is registered, a recovery code has been sent.', 'info')
@@ -1529,19 +1715,15 @@ def verify_reset_code():
             return render_template('verify_reset_code.html')
         
         # Get the stored reset code hash and expiration
-        conn = get_db()
-        cursor = conn.execute("SELECT value FROM settings WHERE key = 'password_reset_code'")
-        result = cursor.fetchone()
-        conn.close()
+        stored_value = get_setting('password_reset_code')
         
-        if not result:
+        if not stored_value:
             flash('No reset code found. Please request a new one.', 'danger')
             session.pop('email_verification_pending', None)
             session.pop('reset_email', None)
             return redirect(url_for('forgot_password'))
         
         # Extract hash and expiration time
-        stored_value = result[0]
         parts = stored_value.split('|')
         if len(parts) != 2:
             flash('Invalid reset code data. Please request a new one.', 'danger')
@@ -1641,6 +1823,26 @@ def show_recovery_codes():
                           initial_setup=initial_setup,
                           unused_count=unused_count)
 
+# Events within the date range setting either side of now (see event_range_params)
+EVENTS_IN_RANGE_QUERY = """
+    SELECT id, name, start_time FROM events
+    WHERE start_time >= datetime('now', ?) AND start_time <= datetime('now', ?)
+    ORDER BY start_time DESC
+"""
+
+# The in-range event nearest to now, for pages opened without an event
+DEFAULT_EVENT_QUERY = """
+    SELECT id, name FROM events
+    WHERE start_time >= datetime('now', ?) AND start_time <= datetime('now', ?)
+    ORDER BY ABS(strftime('%s', start_time) - strftime('%s', 'now')) ASC
+    LIMIT 1
+"""
+
+def event_range_params():
+    """SQLite datetime modifiers for the event date range setting (months before, months after)"""
+    months = get_event_date_range_months()
+    return (f'-{months} month', f'+{months} month')
+
 @app.route('/')
 @require_auth
 def index():
@@ -1648,13 +1850,7 @@ def index():
     if not event_id:
         # Redirect to select event
         conn = get_db()
-        months = get_event_date_range_months()
-        cur = conn.execute(f"""
-            SELECT id, name FROM events
-            WHERE start_time >= datetime('now', '-{months} month') AND start_time <= datetime('now', '+{months} month')
-            ORDER BY ABS(strftime('%s', start_time) - strftime('%s', 'now')) ASC
-            LIMIT 1
-        """)
+        cur = conn.execute(DEFAULT_EVENT_QUERY, event_range_params())
         default_event = cur.fetchone()
         conn.close()
         if default_event:
@@ -1664,49 +1860,70 @@ def index():
             return redirect(url_for('admin_index'))
 
     conn = get_db()
-    cur = conn.execute("""
-        SELECT c.id, k.id as kid_id, c.checkin_time, c.checkout_time, k.name as kid_name, k.notes as kid_notes,
-               f.authorized_adults, f.phone, f.troop, a.name as adult_name
-        FROM checkins c
-        JOIN kids k ON c.kid_id = k.id
-        JOIN families f ON k.family_id = f.id
-        JOIN adults a ON c.adult_id = a.id
-        WHERE c.checkout_time IS NULL AND c.event_id = ?
-        ORDER BY SUBSTR(k.name, INSTR(k.name, ' ') + 1) COLLATE NOCASE ASC, k.name COLLATE NOCASE ASC, c.checkin_time DESC
-    """, (event_id,))
-    checked_in = cur.fetchall()
+    # Read the change marker first: the page's live feed resumes from here
+    roster_seq = latest_roster_seq(conn, event_id)
+    checked_in = get_live_roster(conn, event_id)
 
-    # Convert to dicts and format times
-    checked_in = [dict(r) for r in checked_in]
-    for checkin in checked_in:
-        try:
-            dt = datetime.fromisoformat(checkin['checkin_time'])
-            if dt.tzinfo is None:
-                dt = pytz.UTC.localize(dt)
-            dt = dt.astimezone(local_tz)
-            checkin['formatted_time'] = dt.strftime('%b %d %I:%M %p')
-        except (ValueError, TypeError):
-            checkin['formatted_time'] = 'N/A'
-
-    months = get_event_date_range_months()
-    cur2 = conn.execute(f"SELECT id, name, start_time FROM events WHERE start_time >= datetime('now', '-{months} month') AND start_time <= datetime('now', '+{months} month') ORDER BY start_time DESC")
+    cur2 = conn.execute(EVENTS_IN_RANGE_QUERY, event_range_params())
     events = cur2.fetchall()
     
     # Get require_codes setting - derive from checkout_method if not explicitly set
-    setting = conn.execute("SELECT value FROM settings WHERE key = 'require_checkout_code'").fetchone()
-    if setting:
-        require_codes = setting[0] == 'true'
-    else:
-        # Fallback: if a checkout method is configured, codes are implicitly required
-        method_row = conn.execute("SELECT value FROM settings WHERE key = 'checkout_method'").fetchone()
-        require_codes = method_row[0] in ('random_codes', 'phone_codes') if method_row else False
+    require_codes = get_require_checkout_code()
     
     conn.close()
 
     # Check if TLC is configured (for UI button)
     tlc_configured = 'tlc_email' in session and 'tlc_password' in session
 
-    return render_template('index.html', checked_in=checked_in, events=events, current_event_id=int(event_id), require_codes=require_codes, tlc_configured=tlc_configured)
+    return render_template('index.html', checked_in=checked_in, events=events, current_event_id=int(event_id), require_codes=require_codes, tlc_configured=tlc_configured, roster_seq=roster_seq)
+
+# Open check-ins holding a random checkout code
+CHECKOUT_CODE_QUERY = """
+    SELECT c.id as checkin_id, c.kid_id, c.event_id, c.checkout_code, c.checkout_time,
+           k.name as kid_name, k.family_id, f.phone as family_phone
+    FROM checkins c
+    JOIN kids k ON k.id = c.kid_id
+    JOIN families f ON f.id = k.family_id
+    WHERE c.checkout_code = ? AND c.checkout_time IS NULL
+"""
+
+# Open check-ins for an event by phone code: the stored code, or any family
+# phone ending in the digits (params: event, code, then the suffix range twice)
+PHONE_CHECKOUT_QUERY = """
+    SELECT c.id as checkin_id, c.kid_id, c.event_id, c.checkout_time,
+           k.name as kid_name, k.family_id, f.phone as family_phone
+    FROM checkins c
+    JOIN kids k ON k.id = c.kid_id
+    JOIN families f ON f.id = k.family_id
+    WHERE c.checkout_time IS NULL
+      AND c.event_id = ?
+      AND (
+          c.checkout_code = ?
+          OR k.family_id IN (
+              SELECT id FROM families WHERE phone_digits_rev >= ? AND phone_digits_rev < ?
+              UNION
+              SELECT family_id FROM adults WHERE phone_digits_rev >= ? AND phone_digits_rev < ?
+          )
+      )
+"""
+
+# Families with a family or adult phone ending in the digits (params: the suffix range three times)
+PHONE_FAMILY_QUERY = """
+    SELECT f.id, f.phone, f.troop, f.default_adult_id,
+           (SELECT GROUP_CONCAT(a.id || ':' || a.name || ':' || COALESCE(a.phone, ''))
+            FROM adults a WHERE a.family_id = f.id) as adults,
+           (SELECT GROUP_CONCAT(k.id || ':' || k.name || ':' || COALESCE(k.notes, ''))
+            FROM kids k WHERE k.family_id = f.id) as kids,
+           (SELECT a.id FROM adults a WHERE a.family_id = f.id
+            AND a.phone_digits_rev >= ? AND a.phone_digits_rev < ?
+            LIMIT 1) as matched_adult_id
+    FROM families f
+    WHERE f.id IN (
+        SELECT id FROM families WHERE phone_digits_rev >= ? AND phone_digits_rev < ?
+        UNION
+        SELECT family_id FROM adults WHERE phone_digits_rev >= ? AND phone_digits_rev < ?
+    )
+"""
 
 @app.route('/checkin_last4', methods=['POST'])
 @require_auth
@@ -1723,20 +1940,12 @@ def checkin_last4():
     conn = get_db()
     
     # Get checkout method setting
-    checkout_method_row = conn.execute("SELECT value FROM settings WHERE key = 'checkout_method'").fetchone()
-    checkout_method = checkout_method_row[0] if checkout_method_row else 'random_codes'
+    checkout_method = get_setting('checkout_method', 'random_codes')
     
     # RANDOM CODES MODE: Only accept checkout codes, strict matching
     if checkout_method == 'random_codes':
         if len(phone_digits) >= 4:
-            checkout_match = conn.execute("""
-                SELECT c.id as checkin_id, c.kid_id, c.event_id, c.checkout_code, c.checkout_time,
-                       k.name as kid_name, k.family_id, f.phone as family_phone
-                FROM checkins c
-                JOIN kids k ON k.id = c.kid_id
-                JOIN families f ON f.id = k.family_id
-                WHERE c.checkout_code = ? AND c.checkout_time IS NULL
-            """, (phone_digits,)).fetchall()
+            checkout_match = conn.execute(CHECKOUT_CODE_QUERY, (phone_digits,)).fetchall()
             
             if checkout_match:
                 # This is a valid checkout code
@@ -1774,24 +1983,9 @@ def checkin_last4():
     elif checkout_method == 'phone_codes':
         # Try to find checked-in kids with this phone code first
         if phone_digits.isdigit() and len(phone_digits) == 4:
-            phone_checkout_match = conn.execute("""
-                SELECT c.id as checkin_id, c.kid_id, c.event_id, c.checkout_time,
-                       k.name as kid_name, k.family_id, f.phone as family_phone
-                FROM checkins c
-                JOIN kids k ON k.id = c.kid_id
-                JOIN families f ON f.id = k.family_id
-                WHERE c.checkout_time IS NULL
-                  AND c.event_id = ?
-                  AND (
-                      c.checkout_code = ?
-                      OR REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(f.phone, '-', ''), ' ', ''), '(', ''), ')', ''), '.', '') LIKE ?
-                      OR EXISTS (
-                          SELECT 1 FROM adults a 
-                          WHERE a.family_id = f.id 
-                          AND REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(a.phone, '-', ''), ' ', ''), '(', ''), ')', ''), '.', '') LIKE ?
-                      )
-                  )
-            """, (event_id, phone_digits, '%' + phone_digits, '%' + phone_digits)).fetchall()
+            phone_checkout_match = conn.execute(
+                PHONE_CHECKOUT_QUERY, (event_id, phone_digits) + phone_suffix_range(phone_digits) * 2
+            ).fetchall()
             
             if phone_checkout_match:
                 kids_to_checkout = []
@@ -1828,25 +2022,9 @@ def checkin_last4():
         return jsonify({'error': 'Invalid phone number'}), 400
     
     # Search for phone in both families table and adults table
-    # Using REPLACE to remove common phone formatting characters
-    # Match only if the phone ENDS with the entered digits (last 4)
-    cur = conn.execute("""
-        SELECT DISTINCT f.id, f.phone, f.troop, f.default_adult_id,
-               (SELECT GROUP_CONCAT(a.id || ':' || a.name || ':' || COALESCE(a.phone, ''))
-                FROM adults a WHERE a.family_id = f.id) as adults,
-               (SELECT GROUP_CONCAT(k.id || ':' || k.name || ':' || COALESCE(k.notes, ''))
-                FROM kids k WHERE k.family_id = f.id) as kids,
-               (SELECT a.id FROM adults a WHERE a.family_id = f.id 
-                AND (REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(a.phone, '-', ''), ' ', ''), '(', ''), ')', ''), '.', '') LIKE ?
-                     OR REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(a.phone, '-', ''), ' ', ''), '(', ''), ')', ''), '.', '') = ?)
-                LIMIT 1) as matched_adult_id
-        FROM families f
-        LEFT JOIN adults a ON a.family_id = f.id
-        WHERE REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(f.phone, '-', ''), ' ', ''), '(', ''), ')', ''), '.', '') LIKE ?
-           OR REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(f.phone, '-', ''), ' ', ''), '(', ''), ')', ''), '.', '') = ?
-           OR REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(a.phone, '-', ''), ' ', ''), '(', ''), ')', ''), '.', '') LIKE ?
-           OR REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(a.phone, '-', ''), ' ', ''), '(', ''), ')', ''), '.', '') = ?
-    """, ('%' + phone_digits, phone_digits, '%' + phone_digits, phone_digits, '%' + phone_digits, phone_digits))
+    # Match only if the phone ENDS with the entered digits (last 4), via the
+    # indexed reversed-digits column (see phone_search.py)
+    cur = conn.execute(PHONE_FAMILY_QUERY, phone_suffix_range(phone_digits) * 3)
     families = cur.fetchall()
     
     if not families:
@@ -1918,11 +2096,23 @@ def checkin_last4():
     return jsonify(family_data)
 
 
+# Families with a kid or adult holding any of the name token hashes ({placeholders})
+SEARCH_NAME_QUERY = """
+    SELECT f.id, f.phone, f.troop, f.default_adult_id,
+           (SELECT GROUP_CONCAT(a.id || ':' || a.name)
+            FROM adults a WHERE a.family_id = f.id) as adults,
+           (SELECT GROUP_CONCAT(k.id || ':' || k.name || ':' || COALESCE(k.notes, ''))
+            FROM kids k WHERE k.family_id = f.id) as kids
+    FROM families f
+    WHERE f.id IN (SELECT family_id FROM name_tokens WHERE token_hash IN ({placeholders}))
+    LIMIT 100
+"""
+
 @app.route('/search_name', methods=['POST'])
 @require_auth
 def search_name():
     """Search families by kid or adult name using tokenized hashes (supports partial names).
-    Gracefully falls back to name_hash if token hashes not available yet."""
+    One indexed lookup in the name_tokens table regardless of roster size."""
     name = request.form.get('name', '').strip()
     if not name:
         return jsonify({'error': 'Name required'}), 400
@@ -1935,88 +2125,11 @@ def search_name():
     from encryption import FieldEncryption
     
     conn = get_db()
-    families = []
-    
-    # Check if name_token_hashes column exists
-    try:
-        cursor = conn.execute("PRAGMA table_info(kids)")
-        columns = [row[1] for row in cursor.fetchall()]
-        has_token_hashes = 'name_token_hashes' in columns
-    except:
-        has_token_hashes = False
-    
-    if has_token_hashes:
-        # Use tokenized search for partial name matching
-        token_hashes = FieldEncryption.hash_name_tokens(name)
-        
-        # Get all families with kids/adults
-        all_families = conn.execute("""
-            SELECT DISTINCT f.id, f.phone, f.troop, f.default_adult_id,
-                   (SELECT GROUP_CONCAT(a.id || ':' || a.name)
-                    FROM adults a WHERE a.family_id = f.id) as adults,
-                   (SELECT GROUP_CONCAT(k.id || ':' || k.name || ':' || COALESCE(k.notes, ''))
-                    FROM kids k WHERE k.family_id = f.id) as kids
-            FROM families f
-            WHERE EXISTS (SELECT 1 FROM kids k WHERE k.family_id = f.id)
-               OR EXISTS (SELECT 1 FROM adults a WHERE a.family_id = f.id)
-            LIMIT 100
-        """).fetchall()
-        
-        # Filter in Python - check if any token hash matches
-        for family in all_families:
-            match = False
-            
-            # Check kids
-            kids_with_hashes = conn.execute(
-                "SELECT name_token_hashes FROM kids WHERE family_id = ?", (family['id'],)
-            ).fetchall()
-            for kid_row in kids_with_hashes:
-                if kid_row and kid_row[0]:
-                    try:
-                        stored_hashes = json.loads(kid_row[0])
-                        if any(h in stored_hashes for h in token_hashes):
-                            match = True
-                            break
-                    except:
-                        pass
-            
-            if match:
-                families.append(family)
-                continue
-            
-            # Check adults
-            adults_with_hashes = conn.execute(
-                "SELECT name_token_hashes FROM adults WHERE family_id = ?", (family['id'],)
-            ).fetchall()
-            for adult_row in adults_with_hashes:
-                if adult_row and adult_row[0]:
-                    try:
-                        stored_hashes = json.loads(adult_row[0])
-                        if any(h in stored_hashes for h in token_hashes):
-                            match = True
-                            break
-                    except:
-                        pass
-            
-            if match:
-                families.append(family)
     
-    else:
-        # Fallback: Use name_hash for exact matching if token hashes not available
-        search_hash = FieldEncryption.hash_for_search(name)
-        
-        cur = conn.execute("""
-            SELECT f.id, f.phone, f.troop, f.default_adult_id,
-                   (SELECT GROUP_CONCAT(a.id || ':' || a.name)
-                    FROM adults a WHERE a.family_id = f.id) as adults,
-                   (SELECT GROUP_CONCAT(k.id || ':' || k.name || ':' || COALESCE(k.notes, ''))
-                    FROM kids k WHERE k.family_id = f.id) as kids
-            FROM families f
-            WHERE EXISTS (SELECT 1 FROM kids k WHERE k.family_id = f.id AND k.name_hash = ?)
-               OR EXISTS (SELECT 1 FROM adults a WHERE a.family_id = f.id AND a.name_hash = ?)
-            LIMIT 20
-        """, (search_hash, search_hash))
-        families = cur.fetchall()
+    # A family matches if any kid's or adult's stored token hashes contain a token of the search
+    token_hashes = FieldEncryption.hash_name_tokens(name)
+    placeholders = ','.join('?' * len(token_hashes))
+    families = conn.execute(SEARCH_NAME_QUERY.format(placeholders=placeholders), token_hashes).fetchall()
 
     if not families:
         conn.close()
@@ -2176,17 +2289,21 @@ def admin_restore_db():
         if DB_PATH.exists():
             shutil.copy2(str(DB_PATH), str(app_root / current_backup_name))
         
-        # Replace database
+        # Replace database (drop pooled connections to the old file first)
+        close_db_pools()
         shutil.copy2(str(db_file), str(DB_PATH))
+        mark_db_replaced()
+        # Backups from older releases may predate newer migrations
+        migrate_db()
         
         # Restore data directory if present in backup
         data_backup = extract_dir / 'data'
         if data_backup.exists():
             data_dir = app_root / 'data'
-            # Clear existing data dir contents (except the DB we just restored)
+            # Clear existing data dir contents (except the DB we just restored and its WAL/restore marker)
             if data_dir.exists():
                 for item in data_dir.iterdir():
-                    if item.name != 'checkin.db':
+                    if not item.name.startswith('checkin.db'):
                         if item.is_file():
                             item.unlink()
                         elif item.is_dir():
@@ -2196,7 +2313,7 @@ def admin_restore_db():
             
             # Copy restored data
             for item in data_backup.iterdir():
-                if item.name != 'checkin.db':  # Skip DB, already restored
+                if not item.name.startswith('checkin.db'):  # Skip DB, already restored
                     dest = data_dir / item.name
                     if item.is_file():
                         shutil.copy2(item, dest)
@@ -2226,6 +2343,15 @@ def admin_restore_db():
         flash(f'Restore failed: {str(e)}', 'error')
         return redirect(url_for('admin_utilities'))
 
+# The checkout code a family's open check-ins for an event already share
+FAMILY_CHECKOUT_CODE_QUERY = """
+    SELECT DISTINCT c.checkout_code
+    FROM checkins c
+    JOIN kids k ON k.id = c.kid_id
+    WHERE k.family_id = ? AND c.event_id = ? AND c.checkout_time IS NULL AND c.checkout_code IS NOT NULL
+    LIMIT 1
+"""
+
 @app.route('/checkin_selected', methods=['POST'])
 @require_auth
 def checkin_selected():
@@ -2243,103 +2369,119 @@ def checkin_selected():
     now = datetime.utcnow().isoformat()
     
     # Get checkout method setting
-    checkout_method_row = conn.execute("SELECT value FROM settings WHERE key = 'checkout_method'").fetchone()
-    checkout_method = checkout_method_row[0] if checkout_method_row else 'random_codes'
+    checkout_method = get_setting('checkout_method', 'random_codes')
     
     # Get code delivery method (only used for random_codes)
     code_delivery_method = 'qr'  # Default
     if checkout_method == 'random_codes':
-        code_delivery_setting = conn.execute("SELECT value FROM settings WHERE key = 'checkout_code_method'").fetchone()
-        code_delivery_method = code_delivery_setting[0] if code_delivery_setting else 'qr'
+        code_delivery_method = get_setting('checkout_code_method', 'qr')
     
     # Get label printer settings if printing is needed
     label_size = '30336'  # Default
     if checkout_method == 'random_codes' and code_delivery_method in ['label', 'both'] and LABEL_PRINTING_AVAILABLE:
-        printer_type = conn.execute("SELECT value FROM settings WHERE key = 'label_printer_type'").fetchone()
-        label_size_setting = conn.execute("SELECT value FROM settings WHERE key = 'label_size'").fetchone()
-        printer_type = printer_type[0] if printer_type else 'dymo'
-        label_size = label_size_setting[0] if label_size_setting else '30336'
+        printer_type = get_setting('label_printer_type', 'dymo')
+        label_size = get_setting('label_size', '30336')
         
         # Get event info for label
         event_row = conn.execute("SELECT name, start_time FROM events WHERE id = ?", (event_id,)).fetchone()
         event_name = event_row[0] if event_row else "Event"
         event_date = event_row[1][:10] if event_row else datetime.now().strftime('%Y-%m-%d')
     
-    checked_in_count = 0
     labels_to_print = []  # Collect label data for client-side printing
     checked_in_data = []  # Collect check-in data for UI update
-    kid_names_for_label = []  # Collect names for combined label
-    
-    # Get family info for the response
-    family_row = conn.execute("""
-        SELECT f.phone, f.troop, f.authorized_adults,
-               a.name as adult_name
-        FROM families f
-        JOIN adults a ON a.id = ?
-        WHERE f.id = ?
-    """, (adult_id, family_id)).fetchone()
-    
-    adult_name = family_row['adult_name'] if family_row else 'Unknown'
-    phone = family_row['phone'] if family_row else ''
-    authorized_adults = family_row['authorized_adults'] if family_row else ''
-    
-    # Determine checkout code based on method
-    family_checkout_code = None
-    if checkout_method == 'random_codes':
-        # Generate or reuse random 5-digit code
-        if True:  # require_codes
+    # Each kid once, in the order selected
+    try:
+        kid_ids = [int(kid_id) for kid_id in dict.fromkeys(kid_ids)]
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid kid_ids'}), 400
+    placeholders = ','.join('?' * len(kid_ids))
+
+    # The whole family is checked in under one write lock: no other kiosk can
+    # check in the same kid or take the same checkout code until we commit
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Get family info for the response
+        family_row = conn.execute("""
+            SELECT f.phone, f.troop, f.authorized_adults,
+                   a.name as adult_name
+            FROM families f
+            JOIN adults a ON a.id = ?
+            WHERE f.id = ?
+        """, (adult_id, family_id)).fetchone()
+
+        adult_name = family_row['adult_name'] if family_row else 'Unknown'
+        phone = family_row['phone'] if family_row else ''
+        authorized_adults = family_row['authorized_adults'] if family_row else ''
+
+        # Skip kids already checked in to this event
+        already_checked_in = {row[0] for row in conn.execute(f"""
+            SELECT kid_id FROM checkins
+            WHERE event_id = ? AND checkout_time IS NULL AND kid_id IN ({placeholders})
+        """, [event_id] + kid_ids)}
+        new_kid_ids = [kid_id for kid_id in kid_ids if kid_id not in already_checked_in]
+
+        # Determine checkout code based on method
+        # (only when someone is actually checked in, so repeat submits don't use up codes)
+        family_checkout_code = None
+        if checkout_method == 'random_codes' and new_kid_ids:
             # Look for existing checkout code for this family/event combination
-            existing_code = conn.execute("""
-                SELECT DISTINCT c.checkout_code 
-                FROM checkins c
-                JOIN kids k ON k.id = c.kid_id
-                WHERE k.family_id = ? AND c.event_id = ? AND c.checkout_time IS NULL AND c.checkout_code IS NOT NULL
-                LIMIT 1
-            """, (family_id, event_id)).fetchone()
-            
+            existing_code = conn.execute(FAMILY_CHECKOUT_CODE_QUERY, (family_id, event_id)).fetchone()
+
             if existing_code and existing_code[0]:
                 # Reuse existing code for siblings checked in separately
                 family_checkout_code = existing_code[0]
             else:
-                # Generate new random code
+                # Draw a code no open check-in holds (claimed inside this transaction)
                 try:
-                    family_checkout_code = generate_unique_code(int(event_id), str(DB_PATH))
-                except Exception as e:
-                    print(f"Error generating checkout code: {e}")
-                    family_checkout_code = None
-    elif checkout_method == 'phone_codes':
-        # Use last 4 digits of the phone digits used to find the family
-        # This allows secondary phones to work for checkout
-        if phone_digits:
-            family_checkout_code = phone_digits[-4:]
-    
-    for kid_id in kid_ids:
-        # Check if already checked in to this event
-        cur = conn.execute("SELECT id FROM checkins WHERE kid_id = ? AND event_id = ? AND checkout_time IS NULL", (kid_id, event_id))
-        if cur.fetchone():
-            continue
-        
-        # Insert check-in with the checkout code (if applicable)
-        cursor = conn.execute("INSERT INTO checkins (kid_id, adult_id, event_id, checkin_time, checkout_code) VALUES (?, ?, ?, ?, ?)", 
-                    (kid_id, adult_id, event_id, now, family_checkout_code))
-        checkin_id = cursor.lastrowid
-        checked_in_count += 1
-        
-        # Get kid data for response
-        kid_row = conn.execute("SELECT name, notes FROM kids WHERE id = ?", (kid_id,)).fetchone()
+                    family_checkout_code = allocate_checkout_code(conn, int(event_id))
+                except CodePoolExhausted:
+                    conn.rollback()
+                    return jsonify({'success': False, 'message': 'No checkout codes left for this event. Check out some families and try again.'}), 409
+        elif checkout_method == 'phone_codes':
+            # Use last 4 digits of the phone digits used to find the family
+            # This allows secondary phones to work for checkout
+            if phone_digits:
+                family_checkout_code = phone_digits[-4:]
+
+        # Insert check-ins with the checkout code (if applicable)
+        conn.executemany(
+            "INSERT INTO checkins (kid_id, adult_id, event_id, checkin_time, checkout_code) VALUES (?, ?, ?, ?, ?)",
+            [(kid_id, adult_id, event_id, now, family_checkout_code) for kid_id in new_kid_ids]
+        )
+        checkin_ids = {}
+        kids = {}
+        if new_kid_ids:
+            new_placeholders = ','.join('?' * len(new_kid_ids))
+            checkin_ids = {row['kid_id']: row['id'] for row in conn.execute(f"""
+                SELECT id, kid_id FROM checkins
+                WHERE event_id = ? AND checkin_time = ? AND checkout_time IS NULL AND kid_id IN ({new_placeholders})
+            """, [event_id, now] + new_kid_ids)}
+            kids = {row['id']: row for row in conn.execute(
+                f"SELECT id, name, notes FROM kids WHERE id IN ({new_placeholders})", new_kid_ids
+            )}
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    checked_in_count = len(new_kid_ids)
+
+    # Convert UTC to CST for display
+    utc_time = datetime.fromisoformat(now).replace(tzinfo=pytz.UTC)
+    cst_time = utc_time.astimezone(pytz.timezone('America/Chicago'))
+    checkin_time = cst_time.strftime('%I:%M %p')
+    formatted_time = cst_time.strftime('%b %d %I:%M %p')
+
+    kid_names_for_label = []  # Collect names for combined label
+    for kid_id in new_kid_ids:
+        kid_row = kids.get(kid_id)
         kid_name = kid_row['name'] if kid_row else "Unknown"
         kid_notes = kid_row['notes'] if kid_row else ''
-        
-        # Convert UTC to CST for display
-        utc_time = datetime.fromisoformat(now).replace(tzinfo=pytz.UTC)
-        cst_time = utc_time.astimezone(pytz.timezone('America/Chicago'))
-        checkin_time = cst_time.strftime('%I:%M %p')
-        formatted_time = cst_time.strftime('%b %d %I:%M %p')
-        
+
         # Add to checked-in data for UI update
         checked_in_data.append({
-            'id': checkin_id,
-            'kid_id': int(kid_id),
+            'id': checkin_ids.get(kid_id),
+            'kid_id': kid_id,
             'kid_name': kid_name,
             'kid_notes': kid_notes,
             'adult_name': adult_name,
@@ -2347,21 +2489,16 @@ def checkin_selected():
             'authorized_adults': authorized_adults,
             'formatted_time': formatted_time
         })
-        
+
         # Collect kid names for combined label
         kid_names_for_label.append(kid_name)
-    
+
     # Create a single combined label if multiple kids checked in together (random codes only)
     if family_checkout_code and checkout_method == 'random_codes' and code_delivery_method in ['label', 'both'] and len(kid_names_for_label) > 0:
         try:
             # Combine all kid names for the label (comma separated)
             combined_names = ', '.join(kid_names_for_label)
-            
-            # Convert UTC to CST for display
-            utc_time = datetime.fromisoformat(now).replace(tzinfo=pytz.UTC)
-            cst_time = utc_time.astimezone(pytz.timezone('America/Chicago'))
-            checkin_time = cst_time.strftime('%I:%M %p')
-            
+
             # Add single label with all names
             labels_to_print.append({
                 'kid_name': combined_names,
@@ -2372,9 +2509,15 @@ def checkin_selected():
             })
         except Exception as e:
             print(f"Error preparing label data: {e}")
-    
-    conn.commit()
-    
+
+    # In server print mode the labels go to the print queue instead of the browser
+    print_job_id = None
+    if labels_to_print and get_setting('label_print_location', 'browser') == 'server':
+        print_job_id = enqueue_print_job(conn, labels_to_print, label_size)
+        conn.commit()
+        print_queue.notify()
+        labels_to_print = []
+
     # Generate share token and QR code ONLY if random codes AND QR method
     share_token = None
     qr_code_data = None
@@ -2382,17 +2525,12 @@ def checkin_selected():
     if checkout_method == 'random_codes' and code_delivery_method in ['qr', 'both'] and checked_in_data and len(checked_in_data) > 0 and any(c['id'] for c in checked_in_data):
         share_token = generate_share_token()
         expires_at = (datetime.utcnow() + timedelta(hours=24)).isoformat()
-        checkin_ids = ','.join([str(c['id']) for c in checked_in_data])
-        
-        conn.execute("""
-            INSERT INTO share_tokens (token, family_id, event_id, checkin_ids, created_at, expires_at, used)
-            VALUES (?, ?, ?, ?, ?, ?, 0)
-        """, (share_token, family_id, event_id, checkin_ids, now, expires_at))
+        create_share_token(conn, share_token, family_id, event_id,
+                           [c['id'] for c in checked_in_data], now, expires_at)
         conn.commit()
         
-        # Generate QR code URL
-        share_url = url_for('share_codes', token=share_token, _external=True)
-        qr_code_data = create_qr_code(share_url)
+        # The page fetches the (cacheable) QR image itself
+        qr_code_data = url_for('share_qr', token=share_token, fmt='svg')
     
     conn.close()
     
@@ -2406,9 +2544,41 @@ def checkin_selected():
         'share_token': share_token,
         'qr_code': qr_code_data,
         'short_url': short_url,
-        'checkout_code': family_checkout_code
+        'checkout_code': family_checkout_code,
+        'print_job_id': print_job_id
     })
 
+@app.route('/print_jobs/<int:job_id>')
+@require_auth
+def print_job(job_id):
+    """Status of a server-side print job"""
+    conn = get_db()
+    status = print_job_status(conn, job_id)
+    conn.close()
+    if status is None:
+        return jsonify({'error': 'Print job not found'}), 404
+    return jsonify(status)
+
+@app.route('/tasks/<int:task_id>')
+def task(task_id):
+    """Status of a background task (for admins, or the visitor who queued it)"""
+    tracked = session.get('tasks', [])
+    if not check_authenticated() and task_id not in tracked:
+        return jsonify({'error': 'Task not found'}), 404
+    conn = get_db()
+    status = task_status(conn, task_id)
+    conn.close()
+    if status is None or status['status'] in ('done', 'failed'):
+        # Shown once; stop tracking it
+        if task_id in tracked:
+            session['tasks'] = [t for t in tracked if t != task_id]
+    if status is None:
+        return jsonify({'error': 'Task not found'}), 404
+    return jsonify(status)
+
+# A kid's open check-in for an event
+OPEN_CHECKIN_QUERY = "SELECT id FROM checkins WHERE kid_id = ? AND event_id = ? AND checkout_time IS NULL"
+
 @app.route('/checkout/<int:kid_id>', methods=['POST'])
 @require_auth
 def checkout(kid_id):
@@ -2429,13 +2599,7 @@ def checkout(kid_id):
     conn = get_db()
     
     # Check if codes are required - derive from checkout_method if not explicitly set
-    setting = conn.execute("SELECT value FROM settings WHERE key = 'require_checkout_code'").fetchone()
-    if setting:
-        require_codes = setting[0] == 'true'
-    else:
-        # Fallback: if a checkout method is configured, codes are implicitly required
-        method_row = conn.execute("SELECT value FROM settings WHERE key = 'checkout_method'").fetchone()
-        require_codes = method_row[0] in ('random_codes', 'phone_codes') if method_row else False
+    require_codes = get_require_checkout_code()
     
     # If codes are required, verify the code or admin override password
     if require_codes:
@@ -2467,25 +2631,21 @@ def checkout(kid_id):
             if actual_code == checkout_code:
                 code_valid = True
             else:
-                method_row = conn.execute("SELECT value FROM settings WHERE key = 'checkout_method'").fetchone()
-                checkout_method = method_row[0] if method_row else 'random_codes'
+                checkout_method = get_setting('checkout_method', 'random_codes')
                 clean_checkout_code = ''.join(c for c in checkout_code if c.isdigit())
                 if checkout_method == 'phone_codes' and len(clean_checkout_code) >= 4:
+                    suffix = phone_suffix_range(clean_checkout_code)
                     phone_match = conn.execute("""
                         SELECT 1 FROM families f
                         WHERE f.id = ? AND (
-                            REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(f.phone, '-', ''), ' ', ''), '(', ''), ')', ''), '.', '') LIKE ?
-                            OR REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(f.phone, '-', ''), ' ', ''), '(', ''), ')', ''), '.', '') = ?
+                            (f.phone_digits_rev >= ? AND f.phone_digits_rev < ?)
                             OR EXISTS (
                                 SELECT 1 FROM adults a 
                                 WHERE a.family_id = f.id 
-                                AND (
-                                    REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(a.phone, '-', ''), ' ', ''), '(', ''), ')', ''), '.', '') LIKE ?
-                                    OR REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(a.phone, '-', ''), ' ', ''), '(', ''), ')', ''), '.', '') = ?
-                                )
+                                AND a.phone_digits_rev >= ? AND a.phone_digits_rev < ?
                             )
                         )
-                    """, (family_id, '%' + clean_checkout_code, clean_checkout_code, '%' + clean_checkout_code, clean_checkout_code)).fetchone()
+                    """, (family_id,) + suffix * 2).fetchone()
                     if phone_match:
                         code_valid = True
             
@@ -2500,10 +2660,7 @@ def checkout(kid_id):
     
     for current_kid_id in all_kid_ids:
         # Get the checkin_id
-        checkin_row = conn.execute("""
-            SELECT id FROM checkins 
-            WHERE kid_id = ? AND event_id = ? AND checkout_time IS NULL
-        """, (current_kid_id, event_id)).fetchone()
+        checkin_row = conn.execute(OPEN_CHECKIN_QUERY, (current_kid_id, event_id)).fetchone()
         
         if checkin_row:
             checkin_ids.append(checkin_row['id'])
@@ -2511,32 +2668,8 @@ def checkout(kid_id):
                         (now, current_kid_id, event_id))
             checked_out_count += 1
     
-    # Mark share token as used if all kids are checked out
-    if checkin_ids:
-        # Find tokens containing any of these checkins
-        tokens = conn.execute("""
-            SELECT id, checkin_ids FROM share_tokens 
-            WHERE used = 0
-        """).fetchall()
-        
-        for token in tokens:
-            token_checkin_ids = token['checkin_ids'].split(',')
-            # Check if any of our checked out kids are in this token
-            has_overlap = any(str(cid) in token_checkin_ids for cid in checkin_ids)
-            if has_overlap:
-                # Check if all checkins in this token are now checked out
-                all_checked_out = True
-                for cid in token_checkin_ids:
-                    check = conn.execute("""
-                        SELECT checkout_time FROM checkins WHERE id = ?
-                    """, (cid,)).fetchone()
-                    if check and not check['checkout_time']:
-                        all_checked_out = False
-                        break
-                
-                # Mark token as used if all kids are checked out
-                if all_checked_out:
-                    conn.execute("UPDATE share_tokens SET used = 1 WHERE id = ?", (token['id'],))
+    # Mark share tokens covering these check-ins as used once all their kids are checked out
+    complete_share_tokens(conn, checkin_ids)
     
     conn.commit()
     conn.close()
@@ -2546,6 +2679,15 @@ def checkout(kid_id):
         return jsonify({'success': True, 'message': f'Checked out {checked_out_count} kid(s) successfully'})
     return redirect(request.referrer or url_for('kiosk'))
 
+# A kid's siblings with an open check-in for an event
+SIBLINGS_QUERY = """
+    SELECT k.id, k.name
+    FROM kids k
+    JOIN checkins c ON c.kid_id = k.id
+    WHERE k.family_id = ? AND k.id != ? AND c.event_id = ? AND c.checkout_time IS NULL
+    ORDER BY k.name COLLATE NOCASE
+"""
+
 @app.route('/get_siblings/<int:kid_id>', methods=['POST'])
 @require_auth
 def get_siblings(kid_id):
@@ -2568,13 +2710,7 @@ def get_siblings(kid_id):
     kid_name = kid_row['name']
     
     # Get all siblings checked in to this event (excluding the current kid)
-    siblings = conn.execute("""
-        SELECT k.id, k.name
-        FROM kids k
-        JOIN checkins c ON c.kid_id = k.id
-        WHERE k.family_id = ? AND k.id != ? AND c.event_id = ? AND c.checkout_time IS NULL
-        ORDER BY k.name COLLATE NOCASE
-    """, (family_id, kid_id, event_id)).fetchall()
+    siblings = conn.execute(SIBLINGS_QUERY, (family_id, kid_id, event_id)).fetchall()
     
     conn.close()
     
@@ -2586,75 +2722,113 @@ def get_siblings(kid_id):
         'siblings': sibling_list
     })
 
+def build_share_payload(conn, token_row):
+    """Gather what the share page shows for a token (None if it has nothing to show)"""
+    event = conn.execute("SELECT name, start_time FROM events WHERE id = ?", (token_row['event_id'],)).fetchone()
+    if not event:
+        return None
+
+    # Get checkin details - all kids share the same code
+    checkins = conn.execute("""
+        SELECT c.checkout_code, c.checkin_time, c.checkout_time,
+               k.name as kid_name
+        FROM share_token_checkins stc
+        JOIN checkins c ON c.id = stc.checkin_id
+        JOIN kids k ON k.id = c.kid_id
+        WHERE stc.token_id = ?
+        ORDER BY c.id
+    """, (token_row['id'],)).fetchall()
+    kids = []
+    family_code = None
+    checkin_time = None
+    all_checked_out = True
+    
+    for checkin in checkins:
+        # Get the family code from the first checkin (they're all the same)
+        if not family_code:
+            family_code = checkin['checkout_code']
+            # Convert UTC to local time
+            utc_time = datetime.fromisoformat(checkin['checkin_time']).replace(tzinfo=pytz.UTC)
+            checkin_time = utc_time.astimezone(local_tz).strftime('%I:%M %p')
+        
+        kids.append({
+            'name': checkin['kid_name'],
+            'checked_out': checkin['checkout_time'] is not None
+        })
+        
+        if not checkin['checkout_time']:
+            all_checked_out = False
+    
+    if not kids or not family_code:
+        return None
+    
+    # Format event time
+    event_time = datetime.fromisoformat(event['start_time']).replace(tzinfo=pytz.UTC).astimezone(local_tz)
+    
+    return {
+        'event_name': event['name'],
+        'event_date': event_time.strftime('%B %d, %Y'),
+        'checkout_code': family_code,
+        'checkin_time': checkin_time,
+        'kids': kids,
+        'all_checked_out': all_checked_out
+    }
+
 @app.route('/share/<token>')
 def share_codes(token):
-    """Display checkout codes for a family's check-ins with Web Share API support"""
-    cleanup_expired_tokens()  # Clean up old tokens first
-    
+    """Display checkout codes for a family's check-ins with Web Share API support
+
+    Read-only: expired tokens are removed by the background sweeper, and the
+    page data is cached per token until one of its check-ins changes."""
     conn = get_db()
     
     # Get token data
-    token_data = conn.execute("""
-        SELECT st.*, e.name as event_name, e.start_time
-        FROM share_tokens st
-        JOIN events e ON e.id = st.event_id
-        WHERE st.token = ? AND st.used = 0 AND st.expires_at > ?
+    token_row = conn.execute("""
+        SELECT id, event_id, version FROM share_tokens
+        WHERE token = ? AND used = 0 AND expires_at > ?
     """, (token, datetime.utcnow().isoformat())).fetchone()
     
-    if not token_data:
+    if not token_row:
         conn.close()
         return render_template('share_expired.html'), 404
     
-    # Get checkin details - all kids share the same code
-    checkin_ids = token_data['checkin_ids'].split(',')
-    kids = []
-    family_code = None
-    checkin_time = None
-    all_checked_out = True
-    
-    for checkin_id in checkin_ids:
-        checkin = conn.execute("""
-            SELECT c.checkout_code, c.checkin_time, c.checkout_time,
-                   k.name as kid_name
-            FROM checkins c
-            JOIN kids k ON k.id = c.kid_id
-            WHERE c.id = ?
-        """, (checkin_id,)).fetchone()
-        
-        if checkin:
-            # Get the family code from the first checkin (they're all the same)
-            if not family_code:
-                family_code = checkin['checkout_code']
-                # Convert UTC to local time
-                utc_time = datetime.fromisoformat(checkin['checkin_time']).replace(tzinfo=pytz.UTC)
-                checkin_time = utc_time.astimezone(local_tz).strftime('%I:%M %p')
-            
-            kids.append({
-                'name': checkin['kid_name'],
-                'checked_out': checkin['checkout_time'] is not None
-            })
-            
-            if not checkin['checkout_time']:
-                all_checked_out = False
-    
+    db_key = str(app.config.get('DATABASE', DB_PATH))
+    payload = share_payload_cache.get(db_key, token, token_row['version'])
+    if payload is None:
+        payload = build_share_payload(conn, token_row)
+        if payload is not None:
+            share_payload_cache.put(db_key, token, token_row['version'], payload)
     conn.close()
     
-    if not kids or not family_code:
+    if payload is None:
         return render_template('share_expired.html'), 404
     
-    # Format event time
-    event_time = datetime.fromisoformat(token_data['start_time']).replace(tzinfo=pytz.UTC).astimezone(local_tz)
-    
     logo_filename = get_logo_filename()
     
-    return render_template('share_codes.html',
-                         event_name=token_data['event_name'],
-                         event_date=event_time.strftime('%B %d, %Y'),
-                         checkout_code=family_code,
-                         checkin_time=checkin_time,
-                         kids=kids,
-                         all_checked_out=all_checked_out,
-                         logo_filename=logo_filename)
+    return render_template('share_codes.html', logo_filename=logo_filename, **payload)
+
+@app.route('/share/<token>/qr.<any(svg, png):fmt>')
+def share_qr(token, fmt):
+    """QR code linking to a share page, rendered on demand and cacheable by the browser"""
+    conn = get_db()
+    token_row = conn.execute(
+        "SELECT id FROM share_tokens WHERE token = ? AND used = 0 AND expires_at > ?",
+        (token, datetime.utcnow().isoformat())
+    ).fetchone()
+    conn.close()
+    if not token_row:
+        return 'Not found', 404
+
+    share_url = url_for('share_codes', token=token, _external=True)
+    etag = hashlib.sha256(f"{fmt}:{share_url}".encode()).hexdigest()[:32]
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(render_qr_code(share_url, fmt), mimetype=QR_MIMETYPES[fmt])
+    response.set_etag(etag)
+    # Tokens last 24 hours; the image for a link never changes
+    response.headers['Cache-Control'] = 'private, max-age=86400'
+    return response
 
 @app.route('/kiosk')
 @require_auth
@@ -2663,13 +2837,7 @@ def kiosk():
     if not event_id:
         # Redirect to select event
         conn = get_db()
-        months = get_event_date_range_months()
-        cur = conn.execute(f"""
-            SELECT id, name FROM events
-            WHERE start_time >= datetime('now', '-{months} month') AND start_time <= datetime('now', '+{months} month')
-            ORDER BY ABS(strftime('%s', start_time) - strftime('%s', 'now')) ASC
-            LIMIT 1
-        """)
+        cur = conn.execute(DEFAULT_EVENT_QUERY, event_range_params())
         default_event = cur.fetchone()
         conn.close()
         if default_event:
@@ -2678,20 +2846,11 @@ def kiosk():
             return "No events available", 404
 
     conn = get_db()
-    cur = conn.execute("""
-        SELECT c.id, k.id as kid_id, c.checkin_time, c.checkout_time, k.name as kid_name, k.notes as kid_notes,
-               f.authorized_adults, f.phone, f.troop, a.name as adult_name
-        FROM checkins c
-        JOIN kids k ON c.kid_id = k.id
-        JOIN families f ON k.family_id = f.id
-        JOIN adults a ON c.adult_id = a.id
-        WHERE c.checkout_time IS NULL AND c.event_id = ?
-        ORDER BY SUBSTR(k.name, INSTR(k.name, ' ') + 1) COLLATE NOCASE ASC, k.name COLLATE NOCASE ASC, c.checkin_time DESC
-    """, (event_id,))
-    checked_in = cur.fetchall()
+    # Read the change marker first: the page's live feed resumes from here
+    roster_seq = latest_roster_seq(conn, event_id)
+    checked_in = get_live_roster(conn, event_id)
 
-    months = get_event_date_range_months()
-    cur2 = conn.execute(f"SELECT id, name, start_time FROM events WHERE start_time >= datetime('now', '-{months} month') AND start_time <= datetime('now', '+{months} month') ORDER BY start_time DESC")
+    cur2 = conn.execute(EVENTS_IN_RANGE_QUERY, event_range_params())
     events = cur2.fetchall()
     current_event = next((e for e in events if e['id'] == int(event_id)), None)
     if current_event:
@@ -2703,13 +2862,9 @@ def kiosk():
         current_event_date = ''
 
     # Convert to dicts for mutability
-    checked_in = [dict(c) for c in checked_in]
     events = [dict(e) for e in events]
 
-    # Format times for display
-    for c in checked_in:
-        dt = datetime.fromisoformat(c['checkin_time']).replace(tzinfo=pytz.UTC).astimezone(local_tz)
-        c['formatted_time'] = dt.strftime('%b %d %I:%M %p')
+    # Format times for display (roster times are formatted once by the live roster)
     for e in events:
         dt = datetime.fromisoformat(e['start_time']).astimezone(local_tz)
         e['formatted_start'] = dt.strftime('%b %d, %Y %I:%M %p')
@@ -2718,7 +2873,83 @@ def kiosk():
     
     conn.close()
 
-    return render_template('kiosk.html', checked_in=checked_in, events=events, current_event_id=int(event_id), current_event_name=current_event_name, current_event_date=current_event_date, logo_filename=logo_filename, kiosk_locked=session.get('kiosk_locked', False))
+    return render_template('kiosk.html', checked_in=checked_in, events=events, current_event_id=int(event_id), current_event_name=current_event_name, current_event_date=current_event_date, logo_filename=logo_filename, kiosk_locked=session.get('kiosk_locked', False), roster_seq=roster_seq)
+
+# Open roster streams in this worker process (see roster_stream)
+roster_streams_open = 0
+roster_streams_lock = threading.Lock()
+
+def release_roster_stream():
+    global roster_streams_open
+    with roster_streams_lock:
+        roster_streams_open -= 1
+
+@app.route('/events/<int:event_id>/stream')
+@require_auth
+def roster_stream(event_id):
+    """Server-Sent Events feed of roster changes for the index and kiosk pages
+
+    Each connection lasts at most ROSTER_STREAM_SECONDS; the browser reconnects
+    with Last-Event-ID and picks up where it left off, so workers are never
+    tied up indefinitely. Each open stream holds one of the worker's threads,
+    so beyond ROSTER_STREAM_MAX_PER_WORKER streams the page is told to poll
+    /events/<id>/changes instead."""
+    global roster_streams_open
+    view = request.args.get('view', 'index')
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        since = int(since)
+    except (TypeError, ValueError):
+        conn = get_db()
+        since = latest_roster_seq(conn, event_id)
+        conn.close()
+
+    with roster_streams_lock:
+        full = roster_streams_open >= app.config.get('ROSTER_STREAM_MAX_PER_WORKER', 4)
+        if not full:
+            roster_streams_open += 1
+    if full:
+        return Response(f"event: poll\ndata: {json.dumps({'seq': since})}\n\n", mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
+
+    poll_seconds = app.config.get('ROSTER_STREAM_POLL_SECONDS', 1)
+    duration = app.config.get('ROSTER_STREAM_SECONDS', 25)
+
+    def generate(since):
+        yield f"retry: 1000\nid: {since}\n\n"
+        deadline = time.monotonic() + duration
+        while True:
+            conn = get_db()
+            try:
+                seq, changes = get_roster_deltas(conn, event_id, since, view)
+            finally:
+                conn.close()
+            if changes:
+                since = seq
+                yield f"id: {seq}\nevent: roster\ndata: {json.dumps({'changes': changes})}\n\n"
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(poll_seconds)
+
+    response = Response(stream_with_context(generate(since)), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs when the server closes the response, even if the client went away mid-stream
+    response.call_on_close(release_roster_stream)
+    return response
+
+@app.route('/events/<int:event_id>/changes')
+@require_auth
+def roster_changes(event_id):
+    """Roster changes since a sequence number (polling fallback for the stream)"""
+    view = request.args.get('view', 'index')
+    conn = get_db()
+    try:
+        since = int(request.args.get('since', ''))
+    except ValueError:
+        since = latest_roster_seq(conn, event_id)
+    seq, changes = get_roster_deltas(conn, event_id, since, view)
+    conn.close()
+    return jsonify({'seq': seq, 'changes': changes})
 
 @app.route('/kiosk/lock', methods=['POST'])
 @require_auth
@@ -2740,48 +2971,123 @@ def kiosk_unlock():
         return jsonify({'success': True, 'message': 'Kiosk unlocked', 'redirect': url_for('index')})
     return jsonify({'success': False, 'message': 'Invalid access code'}), 401
 
+# Rows per /history page
+HISTORY_PAGE_SIZE = 100
+
+HISTORY_QUERY = """
+    SELECT c.id, c.checkin_time, c.checkout_time, k.name as kid_name, f.phone, f.troop, e.name as event_name, a.name as adult_name
+    FROM checkins c
+    JOIN kids k ON c.kid_id = k.id
+    JOIN families f ON k.family_id = f.id
+    JOIN adults a ON c.adult_id = a.id
+    JOIN events e ON c.event_id = e.id
+    WHERE 1=1
+"""
+
+def local_day_start_utc(date_str, days=0):
+    """UTC time ('YYYY-MM-DD HH:MM:SS') at which a local date (plus days) begins"""
+    day = datetime.strptime(date_str, '%Y-%m-%d') + timedelta(days=days)
+    return local_tz.localize(day).astimezone(pytz.UTC).strftime('%Y-%m-%d %H:%M:%S')
+
+def history_filters(event_id, start_date, end_date):
+    """
+    Build the WHERE clauses for history filters
+
+    Dates are local calendar days, inclusive. Each bound is a range on the
+    stored UTC checkin_time: a coarse whole-date bound the index can use
+    (stored values mix 'T' and ' ' separators), plus the exact bound.
+
+    Returns:
+        (sql, params) to append to HISTORY_QUERY
+
+    Raises:
+        ValueError: A date is not YYYY-MM-DD
+    """
+    sql = ""
+    params = []
+    if event_id:
+        sql += " AND c.event_id = ?"
+        params.append(event_id)
+    if start_date:
+        start = local_day_start_utc(start_date)
+        sql += " AND c.checkin_time >= ? AND datetime(c.checkin_time) >= ?"
+        params += [start[:10], start]
+    if end_date:
+        end = local_day_start_utc(end_date, days=1)
+        next_day = (datetime.strptime(end[:10], '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        sql += " AND c.checkin_time < ? AND datetime(c.checkin_time) < ?"
+        params += [next_day, end]
+    return sql, params
+
+def history_page_query(event_id, start_date, end_date, before_time=None, before_id=None):
+    """
+    Build the query for one /history page: the filtered rows older than the
+    keyset cursor (before_time, before_id), plus one to tell whether there is
+    an older page
+
+    Returns:
+        (sql, params)
+
+    Raises:
+        ValueError: A date is not YYYY-MM-DD
+    """
+    filter_sql, params = history_filters(event_id, start_date, end_date)
+    query = HISTORY_QUERY + filter_sql
+    if before_time and before_id is not None:
+        query += " AND (c.checkin_time, c.id) < (?, ?)"
+        params += [before_time, before_id]
+    query += " ORDER BY c.checkin_time DESC, c.id DESC LIMIT ?"
+    params.append(HISTORY_PAGE_SIZE + 1)
+    return query, params
+
+def get_filter_events(conn, selected_event_id=None, search=None, limit=50):
+    """Events for the history filter: the most recent (or those matching search), plus the selected one"""
+    if search:
+        events = conn.execute(
+            "SELECT id, name, start_time FROM events WHERE name LIKE ? ORDER BY start_time DESC LIMIT ?",
+            (f"%{search}%", limit)
+        ).fetchall()
+    else:
+        events = conn.execute(
+            "SELECT id, name, start_time FROM events ORDER BY start_time DESC LIMIT ?", (limit,)
+        ).fetchall()
+    if selected_event_id and not any(str(e['id']) == str(selected_event_id) for e in events):
+        selected = conn.execute("SELECT id, name, start_time FROM events WHERE id = ?", (selected_event_id,)).fetchone()
+        if selected:
+            events = [selected] + events
+    return events
+
 @app.route('/history')
 @require_auth
 def history():
     event_id = request.args.get('event_id')
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
+    # Keyset cursor: the (checkin_time, id) of the last row on the previous page
+    before_time = request.args.get('before_time')
+    before_id = request.args.get('before_id', type=int)
 
     conn = get_db()
 
-    # Get all events for the filter dropdown
-    events_cur = conn.execute("SELECT id, name, start_time FROM events ORDER BY start_time DESC")
-    events = events_cur.fetchall()
-
-    # Build the query with filters
-    query = """
-        SELECT c.id, c.checkin_time, c.checkout_time, k.name as kid_name, f.phone, f.troop, e.name as event_name, a.name as adult_name
-        FROM checkins c
-        JOIN kids k ON c.kid_id = k.id
-        JOIN families f ON k.family_id = f.id
-        JOIN adults a ON c.adult_id = a.id
-        JOIN events e ON c.event_id = e.id
-        WHERE 1=1
-    """
-    params = []
-
-    if event_id:
-        query += " AND c.event_id = ?"
-        params.append(event_id)
-
-    if start_date:
-        query += " AND date(c.checkin_time) >= ?"
-        params.append(start_date)
-
-    if end_date:
-        query += " AND date(c.checkin_time) <= ?"
-        params.append(end_date)
+    # Recent events for the filter dropdown (older ones are found with the search box)
+    events = get_filter_events(conn, event_id)
 
-    query += " ORDER BY c.checkin_time DESC LIMIT 200"
+    try:
+        query, params = history_page_query(event_id, start_date, end_date, before_time, before_id)
+    except ValueError:
+        flash('Invalid date filter - use YYYY-MM-DD', 'warning')
+        start_date = end_date = None
+        query, params = history_page_query(event_id, None, None, before_time, before_id)
 
     cur = conn.execute(query, params)
     rows = cur.fetchall()
 
+    # One extra row tells us whether there is an older page
+    next_cursor = None
+    if len(rows) > HISTORY_PAGE_SIZE:
+        rows = rows[:HISTORY_PAGE_SIZE]
+        next_cursor = {'before_time': rows[-1]['checkin_time'], 'before_id': rows[-1]['id']}
+
     # Convert to dicts and format times
     rows = [dict(r) for r in rows]
     for r in rows:
@@ -2807,111 +3113,129 @@ def history():
             r['formatted_checkout'] = ''
     conn.close()
 
-    return render_template('history.html', rows=rows, events=events, event_id=event_id, start_date=start_date, end_date=end_date)
+    return render_template('history.html', rows=rows, events=events, event_id=event_id, start_date=start_date, end_date=end_date,
+                           next_cursor=next_cursor, paged=before_time is not None)
 
-@app.route('/admin/history/email', methods=['POST'])
+@app.route('/history/events')
 @require_auth
-def email_history():
-    """Generate and email the check-in/check-out history report"""
-    email_address = request.form.get('email_address', '').strip()
-    email_subject = request.form.get('email_subject', 'Check-in Report').strip()
-    event_id = request.form.get('event_id', '').strip()
-    start_date = request.form.get('start_date', '').strip()
-    end_date = request.form.get('end_date', '').strip()
-    
-    if not email_address:
-        flash('Email address is required', 'danger')
-        return redirect(url_for('history', event_id=event_id, start_date=start_date, end_date=end_date))
+def history_events():
+    """Search events by name for the history filter (JSON)"""
+    conn = get_db()
+    events = get_filter_events(conn, search=request.args.get('q', '').strip())
+    conn.close()
+    return jsonify([{'id': e['id'], 'label': f"{e['name']} - {e['start_time'][:10]}"} for e in events])
+
+# Columns in history exports (times are local)
+HISTORY_EXPORT_FIELDS = ['id', 'kid_name', 'adult_name', 'phone', 'troop', 'event_name', 'checkin_time', 'checkout_time']
+
+def format_export_time(value):
+    """Format a stored (UTC) time as local 'YYYY-MM-DD HH:MM:SS' for exports ('' if unset)"""
+    if not value:
+        return ''
+    try:
+        dt = datetime.fromisoformat(value)
+        if dt.tzinfo is None:
+            dt = pytz.UTC.localize(dt)
+        return dt.astimezone(local_tz).strftime('%Y-%m-%d %H:%M:%S')
+    except (ValueError, TypeError):
+        return value
+
+def iter_history_rows(conn, event_id, start_date, end_date):
+    """
+    Yield history export rows (dicts keyed by HISTORY_EXPORT_FIELDS), newest first
+
+    Rows are read from the cursor as they are consumed, so memory use doesn't
+    grow with the size of the export.
+
+    Raises:
+        ValueError: A date is not YYYY-MM-DD
+    """
+    filter_sql, params = history_filters(event_id, start_date, end_date)
+    cur = conn.execute(HISTORY_QUERY + filter_sql + " ORDER BY c.checkin_time DESC, c.id DESC", params)
+    for r in cur:
+        row = {field: r[field] for field in HISTORY_EXPORT_FIELDS}
+        row['checkin_time'] = format_export_time(r['checkin_time'])
+        row['checkout_time'] = format_export_time(r['checkout_time'])
+        yield row
+
+def csv_chunks(header, rows, batch_size=500):
+    """Encode a header and rows (sequences) as CSV text, yielding a chunk every batch_size rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def history_csv_chunks(rows, batch_size=500):
+    """Encode export rows as CSV text, yielding a chunk every batch_size rows"""
+    return csv_chunks(HISTORY_EXPORT_FIELDS, ([row[f] for f in HISTORY_EXPORT_FIELDS] for row in rows), batch_size)
+
+def history_ndjson_chunks(rows, batch_size=500):
+    """Encode export rows as newline-delimited JSON, yielding a chunk every batch_size rows"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row) + '\n')
+        if len(lines) >= batch_size:
+            yield ''.join(lines)
+            lines = []
+    yield ''.join(lines)
+
+HISTORY_EXPORT_FORMATS = {
+    'csv': (history_csv_chunks, 'text/csv'),
+    'ndjson': (history_ndjson_chunks, 'application/x-ndjson'),
+}
+
+@app.route('/admin/history/export')
+@require_auth
+def export_history():
+    """Stream the filtered check-in history as CSV or NDJSON"""
+    event_id = request.args.get('event_id', '').strip()
+    start_date = request.args.get('start_date', '').strip()
+    end_date = request.args.get('end_date', '').strip()
+    fmt = request.args.get('format', 'csv')
+    if fmt not in HISTORY_EXPORT_FORMATS:
+        return jsonify({'error': f'Unknown export format: {fmt}'}), 400
+    try:
+        history_filters(event_id, start_date, end_date)
+    except ValueError:
+        flash('Invalid date filter - use YYYY-MM-DD', 'warning')
+        return redirect(url_for('history', event_id=event_id))
+
+    encode, mimetype = HISTORY_EXPORT_FORMATS[fmt]
+    conn = get_db()
+    chunks = encode(iter_history_rows(conn, event_id, start_date, end_date))
+    filename = f"checkin_history_{datetime.now(local_tz).strftime('%Y%m%d')}.{fmt}"
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@task_handler('history_report')
+def send_history_report(email_address, email_subject, event_id, start_date, end_date):
+    """Email the filtered check-in history as a gzipped CSV (run on the task queue)"""
+    require_smtp_settings()
+    conn = get_db()
     
+    # Write a gzipped CSV export to a temp file as rows stream from the database
+    export_name = f"checkin_history_{datetime.now(local_tz).strftime('%Y%m%d')}.csv.gz"
+    fd, export_path = tempfile.mkstemp(suffix='.csv.gz')
+    os.close(fd)
+    counted = {'rows': 0}
+
+    def counted_rows():
+        for row in iter_history_rows(conn, event_id, start_date, end_date):
+            counted['rows'] += 1
+            yield row
+
     try:
-        conn = get_db()
-        
-        # Build the query with filters (same as history page)
-        query = """
-            SELECT c.id, c.checkin_time, c.checkout_time, k.name as kid_name, f.phone, f.troop, e.name as event_name, a.name as adult_name
-            FROM checkins c
-            JOIN kids k ON c.kid_id = k.id
-            JOIN families f ON k.family_id = f.id
-            JOIN adults a ON c.adult_id = a.id
-            JOIN events e ON c.event_id = e.id
-            WHERE 1=1
-        """
-        params = []
-        
-        if event_id:
-            query += " AND c.event_id = ?"
-            params.append(event_id)
-        
-        if start_date:
-            query += " AND date(c.checkin_time) >= ?"
-            params.append(start_date)
-        
-        if end_date:
-            query += " AND date(c.checkin_time) <= ?"
-            params.append(end_date)
-        
-        query += " ORDER BY c.checkin_time DESC"
-        
-        cur = conn.execute(query, params)
-        rows = cur.fetchall()
-        rows = [dict(r) for r in rows]
-        
-        # Format times and build HTML table
-        html_rows = []
-        for r in rows:
-            dt = datetime.fromisoformat(r['checkin_time']).replace(tzinfo=pytz.UTC).astimezone(local_tz)
-            checkin_time = dt.strftime('%b %d, %Y %I:%M %p')
-            
-            checkout_time = ''
-            if r['checkout_time']:
-                dt = datetime.fromisoformat(r['checkout_time']).replace(tzinfo=pytz.UTC).astimezone(local_tz)
-                checkout_time = dt.strftime('%b %d, %Y %I:%M %p')
-            
-            html_rows.append({
-                'kid_name': r['kid_name'],
-                'adult_name': r['adult_name'],
-                'phone': r['phone'],
-                'event_name': r['event_name'],
-                'checkin_time': checkin_time,
-                'checkout_time': checkout_time or '-'
-            })
-        
+        with gzip.open(export_path, 'wt', newline='') as f:
+            for chunk in history_csv_chunks(counted_rows()):
+                f.write(chunk)
         conn.close()
-        
-        # Build HTML table
-        html_table = """
-        <table style="border-collapse: collapse; width: 100%; font-family: Arial, sans-serif; font-size: 12px;">
-            <thead>
-                <tr style="background-color: #f0f0f0; border-bottom: 2px solid #333;">
-                    <th style="padding: 8px; text-align: left; border: 1px solid #999;">Youth Name</th>
-                    <th style="padding: 8px; text-align: left; border: 1px solid #999;">Adult</th>
-                    <th style="padding: 8px; text-align: left; border: 1px solid #999;">Phone</th>
-                    <th style="padding: 8px; text-align: left; border: 1px solid #999;">Event</th>
-                    <th style="padding: 8px; text-align: left; border: 1px solid #999;">Check-in Time</th>
-                    <th style="padding: 8px; text-align: left; border: 1px solid #999;">Check-out Time</th>
-                </tr>
-            </thead>
-            <tbody>
-        """
-        
-        for row in html_rows:
-            html_table += f"""
-                <tr style="border-bottom: 1px solid #ddd;">
-                    <td style="padding: 8px; border: 1px solid #ccc;">{row['kid_name']}</td>
-                    <td style="padding: 8px; border: 1px solid #ccc;">{row['adult_name']}</td>
-                    <td style="padding: 8px; border: 1px solid #ccc;">{row['phone']}</td>
-                    <td style="padding: 8px; border: 1px solid #ccc;">{row['event_name']}</td>
-                    <td style="padding: 8px; border: 1px solid #ccc;">{row['checkin_time']}</td>
-                    <td style="padding: 8px; border: 1px solid #ccc;">{row['checkout_time']}</td>
-                </tr>
-            """
-        
-        html_table += """
-            </tbody>
-        </table>
-        """
-        
-        # Build HTML email body
+
         html_body = f"""
         <html>
             <body style="font-family: Arial, sans-serif; color: #333;">
@@ -2920,10 +3244,10 @@ def email_history():
                     
                     <div style="background-color: #f9f9f9; padding: 10px; margin: 15px 0; border-left: 4px solid #0dcaf0;">
                         <p><strong>Report Generated:</strong> {datetime.now().strftime('%b %d, %Y %I:%M %p')}</p>
-                        <p><strong>Total Records:</strong> {len(html_rows)}</p>
+                        <p><strong>Total Records:</strong> {counted['rows']}</p>
                     </div>
                     
-                    {html_table}
+                    <p>The check-ins and check-outs are attached as <strong>{export_name}</strong> (gzip-compressed CSV, opens in Excel or Google Sheets once extracted).</p>
                     
                     <div style="margin-top: 20px; font-size: 11px; color: #666; border-top: 1px solid #ddd; padding-top:  10px;">
                         <p>This is an automated report. Please do not reply to this email.</p>
@@ -2933,19 +3257,38 @@ def email_history():
         </html>
         """
         
-        # Send email
-        success, message = send_email(email_address, email_subject, html_body)
-        
-        if success:
-            flash(f'Report sent successfully to {email_address}', 'success')
-        else:
-            flash(f'Failed to send report: {message}', 'danger')
-        
-        return redirect(url_for('history', event_id=event_id, start_date=start_date, end_date=end_date))
+        success, message = send_email(email_address, email_subject, html_body,
+                                      attachment_path=export_path, attachment_name=export_name)
+    finally:
+        os.remove(export_path)
     
-    except Exception as e:
-        flash(f'Error generating report: {str(e)}', 'danger')
+    if not success:
+        raise RuntimeError(message)
+    return f"Report with {counted['rows']} records sent to {email_address}"
+
+@app.route('/admin/history/email', methods=['POST'])
+@require_auth
+def email_history():
+    """Queue the check-in/check-out history report email"""
+    email_address = request.form.get('email_address', '').strip()
+    email_subject = request.form.get('email_subject', 'Check-in Report').strip()
+    event_id = request.form.get('event_id', '').strip()
+    start_date = request.form.get('start_date', '').strip()
+    end_date = request.form.get('end_date', '').strip()
+    
+    if not email_address:
+        flash('Email address is required', 'danger')
         return redirect(url_for('history', event_id=event_id, start_date=start_date, end_date=end_date))
+    try:
+        history_filters(event_id, start_date, end_date)
+    except ValueError:
+        flash('Invalid date filter - use YYYY-MM-DD', 'warning')
+        return redirect(url_for('history', event_id=event_id))
+    
+    enqueue_task('history_report', f'Emailing the check-in report to {email_address}',
+                 email_address=email_address, email_subject=email_subject,
+                 event_id=event_id, start_date=start_date, end_date=end_date)
+    return redirect(url_for('history', event_id=event_id, start_date=start_date, end_date=end_date))
 
 # Admin routes
 @app.route('/admin/regenerate-recovery-codes', methods=['POST'])
@@ -3005,20 +3348,39 @@ def admin_events():
     events = conn.execute("SELECT * FROM events ORDER BY start_time DESC").fetchall()
     
     # Get iCal settings
-    ical_url_row = conn.execute("SELECT value FROM settings WHERE key = 'ical_url'").fetchone()
-    ical_url = ical_url_row['value'] if ical_url_row else ''
+    settings = get_settings()
+    ical_url = settings.get('ical_url', '')
     
-    last_sync_row = conn.execute("SELECT value FROM settings WHERE key = 'last_ical_sync'").fetchone()
+    last_sync_value = settings.get('last_ical_sync')
     last_sync = ''
-    if last_sync_row and last_sync_row['value']:
+    if last_sync_value:
         try:
-            dt = datetime.fromisoformat(last_sync_row['value']).replace(tzinfo=pytz.UTC).astimezone(local_tz)
+            dt = datetime.fromisoformat(last_sync_value).replace(tzinfo=pytz.UTC).astimezone(local_tz)
             last_sync = dt.strftime('%b %d, %Y %I:%M %p')
         except:
-            last_sync = last_sync_row['value']
-            
+            last_sync = last_sync_value
+
+    sync_runs = recent_ical_sync_runs(conn)
+    conn.close()
+    return render_template('admin/events.html', events=events, ical_url=ical_url, last_sync=last_sync, sync_runs=sync_runs)
+
+@app.route('/admin/events/<int:event_id>/code_pool')
+@require_auth
+def admin_event_code_pool(event_id):
+    """Checkout code pool utilisation for an event (JSON)"""
+    conn = get_db()
+    stats = checkout_code_pool_stats(conn, event_id)
+    conn.close()
+    return jsonify(stats)
+
+@app.route('/admin/jobs')
+@require_auth
+def admin_jobs():
+    """Background job leader, schedules and recent runs (JSON)"""
+    conn = get_db()
+    status = job_runner.status(conn)
     conn.close()
-    return render_template('admin/events.html', events=events, ical_url=ical_url, last_sync=last_sync)
+    return jsonify(status)
 
 @app.route('/admin/events/set_ical', methods=['POST'])
 @require_auth
@@ -3030,12 +3392,9 @@ def set_ical_url():
     conn.close()
     
     if ical_url:
-        # Trigger initial sync
-        success, message = sync_ical_events()
-        if success:
-            flash(f'iCal URL saved and initial sync completed: {message}', 'success')
-        else:
-            flash(f'iCal URL saved but sync failed: {message}', 'warning')
+        # Initial sync runs in the background
+        flash('iCal URL saved', 'success')
+        enqueue_task('ical_sync', 'Syncing events from the calendar', max_attempts=2)
     else:
         flash('iCal URL cleared', 'info')
         
@@ -3044,11 +3403,7 @@ def set_ical_url():
 @app.route('/admin/events/sync', methods=['POST'])
 @require_auth
 def sync_events():
-    success, message = sync_ical_events()
-    if success:
-        flash(f'Sync completed: {message}', 'success')
-    else:
-        flash(f'Sync failed: {message}', 'danger')
+    enqueue_task('ical_sync', 'Syncing events from the calendar', max_attempts=2)
     return redirect(url_for('admin_events'))
 
 @app.route('/admin/events/clear', methods=['POST'])
@@ -3247,8 +3602,8 @@ def add_family():
         conn = get_db()
         try:
             # Create family
-            cur = conn.execute("INSERT INTO families (phone, troop, authorized_adults) VALUES (?, ?, ?)",
-                              (family_phone, troop, authorized_adults))
+            cur = conn.execute("INSERT INTO families (phone, phone_digits_rev, troop, authorized_adults) VALUES (?, ?, ?, ?)",
+                              (family_phone, phone_search_key(family_phone), troop, authorized_adults))
             family_id = cur.lastrowid
             
             # Add adults
@@ -3257,8 +3612,8 @@ def add_family():
                 adult_phone = adult_phones[i] if i < len(adult_phones) else ''
                 name_hash = FieldEncryption.hash_for_search(name)
                 token_hashes = json.dumps(FieldEncryption.hash_name_tokens(name))
-                cur = conn.execute("INSERT INTO adults (family_id, name, name_hash, name_token_hashes, phone) VALUES (?, ?, ?, ?, ?)", 
-                                  (family_id, name, name_hash, token_hashes, adult_phone if adult_phone else None))
+                cur = conn.execute("INSERT INTO adults (family_id, name, name_hash, name_token_hashes, phone, phone_digits_rev) VALUES (?, ?, ?, ?, ?, ?)", 
+                                  (family_id, name, name_hash, token_hashes, adult_phone if adult_phone else None, phone_search_key(adult_phone)))
                 if i == default_adult_index:
                     default_adult_id = cur.lastrowid
             
@@ -3288,6 +3643,8 @@ def add_family():
             
     return render_template('admin/add_family.html')
 
+FAMILY_KIDS_QUERY = "SELECT * FROM kids WHERE family_id = ?"
+
 @app.route('/admin/families/edit/<int:family_id>', methods=['GET', 'POST'])
 @require_auth
 def edit_family(family_id):
@@ -3316,8 +3673,8 @@ def edit_family(family_id):
         
         try:
             # Update family details
-            conn.execute("UPDATE families SET phone = ?, troop = ?, authorized_adults = ?, default_adult_id = ? WHERE id = ?",
-                        (family_phone, troop, authorized_adults, default_adult_id if default_adult_id else None, family_id))
+            conn.execute("UPDATE families SET phone = ?, phone_digits_rev = ?, troop = ?, authorized_adults = ?, default_adult_id = ? WHERE id = ?",
+                        (family_phone, phone_search_key(family_phone), troop, authorized_adults, default_adult_id if default_adult_id else None, family_id))
             
             # Update/Add adults
             # First, get existing adults to know which ones to delete if not in list
@@ -3335,13 +3692,13 @@ def edit_family(family_id):
                 
                 if adult_id:
                     # Update existing
-                    conn.execute("UPDATE adults SET name = ?, name_hash = ?, name_token_hashes = ?, phone = ? WHERE id = ?", 
-                               (name.strip(), name_hash, token_hashes, adult_phone if adult_phone else None, adult_id))
+                    conn.execute("UPDATE adults SET name = ?, name_hash = ?, name_token_hashes = ?, phone = ?, phone_digits_rev = ? WHERE id = ?", 
+                               (name.strip(), name_hash, token_hashes, adult_phone if adult_phone else None, phone_search_key(adult_phone), adult_id))
                     processed_adult_ids.append(int(adult_id))
                 else:
                     # Add new
-                    conn.execute("INSERT INTO adults (family_id, name, name_hash, name_token_hashes, phone) VALUES (?, ?, ?, ?, ?)", 
-                               (family_id, name.strip(), name_hash, token_hashes, adult_phone if adult_phone else None))
+                    conn.execute("INSERT INTO adults (family_id, name, name_hash, name_token_hashes, phone, phone_digits_rev) VALUES (?, ?, ?, ?, ?, ?)", 
+                               (family_id, name.strip(), name_hash, token_hashes, adult_phone if adult_phone else None, phone_search_key(adult_phone)))
             
             # Delete removed adults
             for aid in existing_adults:
@@ -3387,7 +3744,7 @@ def edit_family(family_id):
             # Re-fetch data for form after error
             family = conn.execute("SELECT * FROM families WHERE id = ?", (family_id,)).fetchone()
             adults = conn.execute("SELECT * FROM adults WHERE family_id = ?", (family_id,)).fetchall()
-            kids = conn.execute("SELECT * FROM kids WHERE family_id = ?", (family_id,)).fetchall()
+            kids = conn.execute(FAMILY_KIDS_QUERY, (family_id,)).fetchall()
             branding = get_branding_settings()
             conn.close()
             return render_template('admin/edit_family.html', family=family, adults=adults, kids=kids, branding=branding)
@@ -3405,7 +3762,7 @@ def edit_family(family_id):
         return redirect(url_for('admin_families'))
         
     adults = conn.execute("SELECT * FROM adults WHERE family_id = ?", (family_id,)).fetchall()
-    kids = conn.execute("SELECT * FROM kids WHERE family_id = ?", (family_id,)).fetchall()
+    kids = conn.execute(FAMILY_KIDS_QUERY, (family_id,)).fetchall()
     conn.close()
     
     return render_template('admin/edit_family.html', family=family, adults=adults, kids=kids)
@@ -3439,41 +3796,60 @@ def clear_families():
 @app.route('/admin/families/export')
 @require_auth
 def export_families():
+    """Stream every family as CSV (adults, kids and notes joined with '; ')"""
     conn = get_db()
-    families = conn.execute("SELECT * FROM families").fetchall()
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Header
-    writer.writerow(['Phone', 'Troop', 'Authorized Adults', 'Adults', 'Kids', 'Kid Notes'])
-    
-    for f in families:
-        adults = conn.execute("SELECT name FROM adults WHERE family_id = ?", (f['id'],)).fetchall()
-        adult_str = "; ".join([a['name'] for a in adults])
-        
-        kids = conn.execute("SELECT name, notes FROM kids WHERE family_id = ?", (f['id'],)).fetchall()
-        kid_str = "; ".join([k['name'] for k in kids])
-        note_str = "; ".join([k['notes'] or '' for k in kids])
-        
-        writer.writerow([
-            f['phone'],
-            f['troop'],
-            f['authorized_adults'],
-            adult_str,
-            kid_str,
-            note_str
-        ])
-        
-    conn.close()
-    
-    output.seek(0)
+    # One pass over families; the per-family lists come from correlated subqueries on the family_id indexes
+    cur = conn.execute("""
+        SELECT f.phone, f.troop, f.authorized_adults,
+               (SELECT group_concat(name, '; ') FROM (SELECT name FROM adults WHERE family_id = f.id ORDER BY id)),
+               (SELECT group_concat(name, '; ') FROM (SELECT name FROM kids WHERE family_id = f.id ORDER BY id)),
+               (SELECT group_concat(COALESCE(notes, ''), '; ') FROM (SELECT notes FROM kids WHERE family_id = f.id ORDER BY id))
+        FROM families f
+        ORDER BY f.id
+    """)
+    header = ['Phone', 'Troop', 'Authorized Adults', 'Adults', 'Kids', 'Kid Notes']
+    rows = ([value if value is not None else '' for value in row] for row in cur)
     return Response(
-        output,
+        stream_with_context(csv_chunks(header, rows)),
         mimetype="text/csv",
         headers={"Content-Disposition": "attachment;filename=families_export.csv"}
     )
 
+def family_import_paths(import_id):
+    """(upload path, status path) for a family import, kept next to the database"""
+    import_dir = Path(app.config.get('DATABASE', DB_PATH)).parent / 'imports'
+    return str(import_dir / f"{import_id}.csv"), str(import_dir / f"{import_id}.json")
+
+def start_family_import(import_id, default_troop, dry_run):
+    """Run (or dry-run) an uploaded family import in a background thread"""
+    csv_path, status_path = family_import_paths(import_id)
+    progress = ImportProgress(status_path, dry_run, os.path.getsize(csv_path), default_troop)
+
+    def run():
+        conn = get_db()
+        try:
+            run_family_import(conn, csv_path, progress, default_troop, dry_run)
+            progress.finish('done')
+        except Exception as e:
+            app.logger.error(f'Family import {import_id} failed: {str(e)}', exc_info=True)
+            progress.finish('failed', str(e))
+        finally:
+            conn.close()
+            if not dry_run:
+                os.remove(csv_path)
+
+    threading.Thread(target=run, daemon=True).start()
+
+def prune_family_imports(max_age=86400):
+    """Delete uploads and reports from imports older than max_age seconds"""
+    import_dir = Path(family_import_paths('x')[0]).parent
+    if not import_dir.exists():
+        return
+    cutoff = time.time() - max_age
+    for path in import_dir.iterdir():
+        if path.stat().st_mtime < cutoff:
+            path.unlink()
+
 @app.route('/admin/families/import', methods=['GET', 'POST'])
 @require_auth
 def import_families():
@@ -3490,63 +3866,56 @@ def import_families():
         if not file.filename.endswith('.csv'):
             flash('File must be a CSV', 'danger')
             return redirect(request.url)
+
+        # Save the upload (streamed to disk) and process it in the background
+        prune_family_imports()
+        import_id = secrets.token_hex(8)
+        csv_path, _ = family_import_paths(import_id)
+        os.makedirs(os.path.dirname(csv_path), exist_ok=True)
+        file.save(csv_path)
+        start_family_import(import_id, request.form.get('troop', '').strip(), request.form.get('dry_run') == '1')
+        return redirect(url_for('family_import_status', import_id=import_id))
             
-        try:
-            stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-            csv_input = csv.reader(stream)
-            header = next(csv_input) # Skip header
-            
-            conn = get_db()
-            count = 0
-            
-            for row in csv_input:
-                if len(row) < 5:
-                    continue
-                    
-                phone = row[0].strip()
-                troop = row[1].strip()
-                auth_adults = row[2].strip()
-                adults_str = row[3].strip()
-                kids_str = row[4].strip()
-                notes_str = row[5].strip() if len(row) > 5 else ""
-                
-                if not phone:
-                    continue
-                    
-                # Create family
-                cur = conn.execute("INSERT INTO families (phone, troop, authorized_adults) VALUES (?, ?, ?)",
-                                  (phone, troop, auth_adults))
-                family_id = cur.lastrowid
-                
-                # Add adults
-                if adults_str:
-                    for name in adults_str.split(';'):
-                        if name.strip():
-                            conn.execute("INSERT INTO adults (family_id, name) VALUES (?, ?)", (family_id, name.strip()))
-                
-                # Add kids
-                if kids_str:
-                    kid_names = [k.strip() for k in kids_str.split(';')]
-                    kid_notes = [n.strip() for n in notes_str.split(';')]
-                    
-                    for i, name in enumerate(kid_names):
-                        if name:
-                            note = kid_notes[i] if i < len(kid_notes) else ""
-                            conn.execute("INSERT INTO kids (family_id, name, notes) VALUES (?, ?, ?)", 
-                                        (family_id, name, note))
-                
-                count += 1
-                
-            conn.commit()
-            conn.close()
-            flash(f'Successfully imported {count} families', 'success')
-            return redirect(url_for('admin_families'))
-            
-        except Exception as e:
-            flash(f'Error importing CSV: {str(e)}', 'danger')
-            return redirect(request.url)
-            
-    return render_template('admin/import_families.html')
+    return render_template('admin/import_families.html', columns=FAMILY_IMPORT_COLUMNS)
+
+@app.route('/admin/families/import/template')
+@require_auth
+def family_import_template():
+    """CSV with just the import column headers"""
+    return Response(
+        ','.join(FAMILY_IMPORT_COLUMNS) + '\r\n',
+        mimetype="text/csv",
+        headers={"Content-Disposition": "attachment;filename=families_template.csv"}
+    )
+
+@app.route('/admin/families/import/<import_id>')
+@require_auth
+def family_import_status(import_id):
+    """Progress and report for a family import (JSON with ?format=json)"""
+    if not re.fullmatch(r'[0-9a-f]{16}', import_id):
+        return jsonify({'error': 'Unknown import'}), 404
+    csv_path, status_path = family_import_paths(import_id)
+    state = load_import_progress(status_path)
+    if state is None:
+        return jsonify({'error': 'Unknown import'}), 404
+    if request.args.get('format') == 'json':
+        return jsonify(state)
+    return render_template('admin/import_families_status.html', import_id=import_id, state=state,
+                           can_commit=state['dry_run'] and os.path.exists(csv_path))
+
+@app.route('/admin/families/import/<import_id>/commit', methods=['POST'])
+@require_auth
+def commit_family_import(import_id):
+    """Import a file that has been checked with a dry run"""
+    if not re.fullmatch(r'[0-9a-f]{16}', import_id):
+        return jsonify({'error': 'Unknown import'}), 404
+    csv_path, status_path = family_import_paths(import_id)
+    state = load_import_progress(status_path)
+    if state is None or not state['dry_run'] or state['status'] != 'done' or not os.path.exists(csv_path):
+        flash('That import is no longer available - please upload the file again', 'warning')
+        return redirect(url_for('import_families'))
+    start_family_import(import_id, state['default_troop'], dry_run=False)
+    return redirect(url_for('family_import_status', import_id=import_id))
 
 @app.route('/admin/families/delete/<int:family_id>', methods=['POST'])
 @require_auth
@@ -3566,30 +3935,28 @@ def delete_family(family_id):
         conn.close()
     return redirect(url_for('admin_families'))
 
-@app.route('/admin/families/import_tlc', methods=['POST'])
-@require_auth
-def import_families_tlc():
-    if 'tlc_email' not in session or 'tlc_password' not in session:
-        flash('TLC not configured. Please login first.', 'danger')
-        return redirect(url_for('admin_tlc'))
+# Existing kid matching a TLC member's name
+KID_FAMILY_BY_NAME_QUERY = "SELECT family_id FROM kids WHERE name = ? COLLATE NOCASE"
 
-    client = TrailLifeConnectClient(session['tlc_email'], session['tlc_password'])
-    if not client.login():
-        flash('Failed to login to TLC.', 'danger')
-        return redirect(url_for('admin_families'))
+@task_handler('tlc_import_families')
+def import_tlc_families(tlc_login_id):
+    """Create families from the TLC roster (run on the task queue)"""
+    from encryption import FieldEncryption
+
+    client = tlc_task_client(tlc_login_id)
+    if client is None:
+        raise PermanentError('Failed to login to TLC.')
 
     # Get roster from first upcoming event
     events = client.get_upcoming_events()
     if not events:
-        flash('No upcoming events found in TLC to fetch roster from.', 'warning')
-        return redirect(url_for('admin_families'))
+        raise PermanentError('No upcoming events found in TLC to fetch roster from.')
 
     event_id = events[0]['id']
     roster = client.get_event_roster(event_id) # Dict: Name -> {'id': ..., 'profile_url': ...}
     
     if not roster:
-        flash('Empty roster found.', 'warning')
-        return redirect(url_for('admin_families'))
+        raise PermanentError('Empty roster found.')
 
     conn = get_db()
     added_families = 0
@@ -3616,7 +3983,7 @@ def import_families_tlc():
             
             # Check if any member exists as a kid
             for member in members:
-                kid = conn.execute("SELECT family_id FROM kids WHERE name = ? COLLATE NOCASE", (member['name'],)).fetchone()
+                kid = conn.execute(KID_FAMILY_BY_NAME_QUERY, (member['name'],)).fetchone()
                 if kid:
                     family_id = kid['family_id']
                     break
@@ -3641,7 +4008,7 @@ def import_families_tlc():
                             break
                 
                 # Create new family
-                cur = conn.execute("INSERT INTO families (phone, troop) VALUES (?, ?)", (phone, ''))
+                cur = conn.execute("INSERT INTO families (phone, phone_digits_rev, troop) VALUES (?, ?, ?)", (phone, phone_search_key(phone), ''))
                 family_id = cur.lastrowid
                 added_families += 1
             
@@ -3660,20 +4027,29 @@ def import_families_tlc():
                     # Check if exists as adult
                     adult = conn.execute("SELECT id FROM adults WHERE name = ? COLLATE NOCASE", (name,)).fetchone()
                     if not adult:
-                        # Not found as kid or adult -> Add as Kid (default)
-                        conn.execute("INSERT INTO kids (family_id, name, tlc_id) VALUES (?, ?, ?)", 
-                                    (family_id, name, tlc_id))
+                        # Not found as kid or adult -> Add as Kid (default), searchable by name like any other
+                        conn.execute("INSERT INTO kids (family_id, name, name_hash, name_token_hashes, tlc_id) VALUES (?, ?, ?, ?, ?)",
+                                    (family_id, name, FieldEncryption.hash_for_search(name),
+                                     json.dumps(FieldEncryption.hash_name_tokens(name)), tlc_id))
                         added_kids += 1
 
         conn.commit()
-        flash(f'Import complete: Added {added_families} families, {added_kids} new members, updated {updated_kids} existing members.', 'success')
-        
-    except Exception as e:
+    except Exception:
         conn.rollback()
-        flash(f'Error importing from TLC: {str(e)}', 'danger')
+        raise
     finally:
         conn.close()
 
+    return f'Added {added_families} families, {added_kids} new members, updated {updated_kids} existing members.'
+
+@app.route('/admin/families/import_tlc', methods=['POST'])
+@require_auth
+def import_families_tlc():
+    if 'tlc_email' not in session or 'tlc_password' not in session:
+        flash('TLC not configured. Please login first.', 'danger')
+        return redirect(url_for('admin_tlc'))
+
+    enqueue_task('tlc_import_families', 'Importing families from Trail Life Connect', tlc_login_id=tlc_task_login())
     return redirect(url_for('admin_families'))
 
 @app.route('/admin/backups')
@@ -3685,25 +4061,16 @@ def backup_list():
         summary = backup_manager.get_backup_summary()
         
         # Get backup schedule settings
-        conn = get_db()
-        backup_frequency = conn.execute("SELECT value FROM settings WHERE key = 'backup_frequency'").fetchone()
-        backup_frequency = backup_frequency[0] if backup_frequency else 'daily'
-        
-        backup_hour = conn.execute("SELECT value FROM settings WHERE key = 'backup_hour'").fetchone()
-        backup_hour = int(backup_hour[0]) if backup_hour else 2
+        settings = get_settings()
+        backup_frequency = settings.get('backup_frequency', 'daily')
+        backup_hour = int(settings['backup_hour']) if 'backup_hour' in settings else 2
         
         # Get email backup settings
-        backup_email_enabled = conn.execute("SELECT value FROM settings WHERE key = 'backup_email_enabled'").fetchone()
-        backup_email_enabled = backup_email_enabled[0] if backup_email_enabled else 'false'
-        
-        backup_email_recipients = conn.execute("SELECT value FROM settings WHERE key = 'backup_email_recipients'").fetchone()
-        backup_email_recipients = backup_email_recipients[0] if backup_email_recipients else ''
+        backup_email_enabled = settings.get('backup_email_enabled', 'false')
+        backup_email_recipients = settings.get('backup_email_recipients', '')
         
         # Get encryption settings
-        backup_encryption_enabled = conn.execute("SELECT value FROM settings WHERE key = 'backup_encryption_password'").fetchone()
-        backup_encryption_enabled = bool(backup_encryption_enabled and backup_encryption_enabled[0])
-        
-        conn.close()
+        backup_encryption_enabled = bool(settings.get('backup_encryption_password'))
         
         return render_template('admin/backups.html',
                              backups=backups,
@@ -3729,20 +4096,16 @@ def send_backup_email(backup_path, description=''):
         Tuple of (success, message) or (None, None) if email not enabled
     """
     try:
-        conn = get_db()
+        settings = get_settings()
         
         # Check if email backup is enabled
-        row = conn.execute("SELECT value FROM settings WHERE key = 'backup_email_enabled'").fetchone()
-        email_enabled = row[0] if row else 'false'
+        email_enabled = settings.get('backup_email_enabled', 'false')
         
         if email_enabled != 'true':
-            conn.close()
             return None, None  # Email not enabled, not an error
         
         # Get recipients
-        row = conn.execute("SELECT value FROM settings WHERE key = 'backup_email_recipients'").fetchone()
-        recipients = row[0] if row else ''
-        conn.close()
+        recipients = settings.get('backup_email_recipients', '')
         
         if not recipients.strip():
             return False, "Email backup enabled but no recipients configured"
@@ -3839,35 +4202,36 @@ This is an automated backup. Store this file securely for disaster recovery.
     except Exception as e:
         return False, f"Error sending backup email: {str(e)}"
 
+@task_handler('backup')
+def create_backup_task(description):
+    """Create, rotate and (if enabled) email a manual backup (run on the task queue)"""
+    backup_path = backup_manager.create_backup(description)
+    
+    # Rotate old backups according to retention policy
+    removed = backup_manager.rotate_backups()
+    
+    message = f'Backup created: {Path(backup_path).name}'
+    if removed:
+        message += f'; rotated {removed} old backup(s)'
+    
+    # Send backup via email if enabled. A failed email is reported, not retried,
+    # since retrying the task would create another backup
+    email_success, email_msg = send_backup_email(backup_path, description)
+    if email_success is True:
+        message += f'; {email_msg}'
+    elif email_success is False:
+        message += f'; email failed: {email_msg}'
+    return message
+
 @app.route('/admin/backups/create', methods=['POST'])
 @require_auth
 def backup_create():
-    """Create a new backup"""
-    try:
-        description = request.form.get('description', '').strip()
-        if not description:
-            description = f'Manual backup at {datetime.now().strftime("%Y-%m-%d %H:%M")}'
-        
-        backup_path = backup_manager.create_backup(description)
-        
-        # Rotate old backups according to retention policy
-        removed = backup_manager.rotate_backups()
-        
-        flash(f'✓ Backup created successfully: {Path(backup_path).name}', 'success')
-        if removed:
-            flash(f'Rotated {removed} old backup(s) according to retention policy', 'info')
-        
-        # Send backup via email if enabled
-        email_success, email_msg = send_backup_email(backup_path, description)
-        if email_success is True:
-            flash(f'✓ {email_msg}', 'success')
-        elif email_success is False:
-            flash(f'Email failed: {email_msg}', 'warning')
-        # If email_success is None, email is not enabled - no message needed
-    
-    except Exception as e:
-        flash(f'Error creating backup: {str(e)}', 'danger')
+    """Queue a new backup"""
+    description = request.form.get('description', '').strip()
+    if not description:
+        description = f'Manual backup at {datetime.now().strftime("%Y-%m-%d %H:%M")}'
     
+    enqueue_task('backup', 'Creating a backup', max_attempts=1, description=description)
     return redirect(url_for('backup_list'))
 
 @app.route('/admin/backups/download/<filename>')
@@ -3900,8 +4264,11 @@ def backup_restore(filename):
         # Get optional restore password (for encrypted backups with different password)
         restore_password = request.form.get('restore_password', '').strip() or None
         
+        close_db_pools()
         success, message = backup_manager.restore_backup(filename, password=restore_password)
         if success:
+            mark_db_replaced()
+            migrate_db()
             flash(f'✓ Database restored successfully from {filename}', 'success')
             flash('NOTE: You may need to restart the application for all changes to take effect', 'info')
         else:
@@ -3953,39 +4320,16 @@ def backup_schedule():
         conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('backup_frequency', ?)", (frequency,))
         conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('backup_hour', ?)", (str(hour),))
         conn.commit()
+        # The job runner works out the next backup time from these settings
+        job_runner.reschedule(conn, 'local_backup')
         conn.close()
         
         # Update backup manager timezone
         update_backup_manager_timezone()
         
-        # Get the configured timezone for the scheduler
-        tz = get_timezone()
-        
-        # Update scheduler if available
-        if scheduler:
-            # Remove existing backup job if present
-            if scheduler.get_job('local_backup_job'):
-                scheduler.remove_job('local_backup_job')
-            
-            # Add new scheduled job with timezone
-            try:
-                if frequency == 'hourly':
-                    scheduler.add_job(perform_scheduled_local_backup, 'cron', minute=0, timezone=tz, id='local_backup_job', replace_existing=True)
-                elif frequency == 'daily':
-                    scheduler.add_job(perform_scheduled_local_backup, 'cron', hour=hour, minute=0, timezone=tz, id='local_backup_job', replace_existing=True)
-                elif frequency == 'weekly':
-                    scheduler.add_job(perform_scheduled_local_backup, 'cron', day_of_week='6', hour=hour, minute=0, timezone=tz, id='local_backup_job', replace_existing=True)
-                elif frequency == 'monthly':
-                    scheduler.add_job(perform_scheduled_local_backup, 'cron', day=1, hour=hour, minute=0, timezone=tz, id='local_backup_job', replace_existing=True)
-                
-                tz_name = str(tz)
-                app.logger.info(f"Scheduled backup job updated: {frequency} at {hour:02d}:00 ({tz_name})")
-                flash(f'✓ Backup schedule updated: {frequency} at {hour:02d}:00 ({tz_name})', 'success')
-            except Exception as e:
-                app.logger.warning(f"Failed to update scheduled backup: {e}")
-                flash(f'Settings saved but scheduler update failed: {str(e)}', 'warning')
-        else:
-            flash('✓ Backup schedule saved (scheduler not available)', 'warning')
+        tz_name = str(get_timezone())
+        app.logger.info(f"Scheduled backup updated: {frequency} at {hour:02d}:00 ({tz_name})")
+        flash(f'✓ Backup schedule updated: {frequency} at {hour:02d}:00 ({tz_name})', 'success')
     
     except Exception as e:
         flash(f'Error updating backup schedule: {str(e)}', 'danger')
@@ -4064,8 +4408,7 @@ def backup_encryption_config():
             
             # Verify current password
             conn = get_db()
-            row = conn.execute("SELECT value FROM settings WHERE key = 'backup_encryption_password'").fetchone()
-            stored_password = row[0] if row else None
+            stored_password = get_setting('backup_encryption_password')
             
             if stored_password != current_password:
                 conn.close()
@@ -4102,7 +4445,7 @@ def backup_encryption_config():
     return redirect(url_for('backup_list'))
 
 def perform_scheduled_local_backup():
-    """Perform a scheduled local backup (called by APScheduler)"""
+    """Perform a scheduled local backup (run by the job runner)"""
     try:
         description = f'Scheduled backup at {datetime.now().strftime("%Y-%m-%d %H:%M")}'
         backup_path = backup_manager.create_backup(description)
@@ -4120,9 +4463,12 @@ def perform_scheduled_local_backup():
             elif email_success is False:
                 app.logger.warning(f"Backup email failed: {email_msg}")
             # If email_success is None, email not enabled - no log needed
+        
+        return f"Created {Path(backup_path).name}, rotated {removed}"
             
     except Exception as e:
         app.logger.error(f"Error performing scheduled backup: {str(e)}")
+        raise
 
 @app.route('/admin/security', methods=['GET', 'POST'])
 @require_auth
@@ -4167,11 +4513,19 @@ def admin_security():
             checkout_code_method = request.form.get('checkout_code_method', 'qr')
             printer_type = request.form.get('label_printer_type', 'dymo')
             label_size = request.form.get('label_size', '30336')
+            print_location = request.form.get('label_print_location', 'browser')
             
             conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('checkout_method', ?)", (checkout_method,))
             conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('checkout_code_method', ?)", (checkout_code_method,))
             conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('label_printer_type', ?)", (printer_type,))
             conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('label_size', ?)", (label_size,))
+            conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('label_print_location', ?)", (print_location,))
+            if print_location == 'server':
+                print_backend = 'brother_ql' if printer_type == 'brother' else 'file'
+                conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('print_backend', ?)", (print_backend,))
+                for key in ('print_device', 'brother_ql_model', 'brother_ql_label'):
+                    conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                                 (key, request.form.get(key, '').strip()))
             # Auto-set require_checkout_code based on checkout method
             require_code_value = 'true' if checkout_method in ('random_codes', 'phone_codes') else 'false'
             conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('require_checkout_code', ?)", (require_code_value,))
@@ -4195,14 +4549,13 @@ def admin_security():
     
     # Get the timestamp of when codes were last generated
     recovery_codes_generated_at = None
+    settings = get_settings()
     try:
-        result = conn.execute(
-            "SELECT value FROM settings WHERE key = 'recovery_codes_generated_at'"
-        ).fetchone()
-        if result and result[0]:
+        generated_at = settings.get('recovery_codes_generated_at')
+        if generated_at:
             # Parse and format the timestamp nicely, converting from UTC to local timezone
             from datetime import datetime as dt
-            generated_time_utc = dt.fromisoformat(result[0])
+            generated_time_utc = dt.fromisoformat(generated_at)
             # Convert UTC to local timezone
             local_tz = get_timezone()
             generated_time_local = generated_time_utc.astimezone(local_tz)
@@ -4213,15 +4566,14 @@ def admin_security():
     
     # Fetch label printing settings
     label_settings = {}
-    for key in ['checkout_method', 'require_checkout_code', 'checkout_code_method', 'label_printer_type', 'label_size']:
-        row = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
-        label_settings[key] = row[0] if row else None
+    for key in ['checkout_method', 'require_checkout_code', 'checkout_code_method', 'label_printer_type', 'label_size',
+                'label_print_location', 'print_device', 'brother_ql_model', 'brother_ql_label']:
+        label_settings[key] = settings.get(key)
     
     # Fetch YOURLS settings
     yourls_settings = {}
     for key in ['yourls_api_url', 'yourls_signature']:
-        row = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
-        yourls_settings[key] = row[0] if row else None
+        yourls_settings[key] = settings.get(key)
     
     conn.close()
     
@@ -4413,14 +4765,13 @@ def admin_branding():
     
     # Get footer settings
     footer_settings = {}
+    settings = get_settings()
     footer_keys = ['footer_enabled', 'footer_text', 'footer_show_github', 'footer_show_version', 'footer_show_admin_link']
     for key in footer_keys:
-        cur = conn.execute("SELECT value FROM settings WHERE key = ?", (key,))
-        row = cur.fetchone()
         if key == 'footer_text':
-            footer_settings[key] = row['value'] if row else ''
+            footer_settings[key] = settings.get(key, '')
         else:
-            footer_settings[key] = row['value'] == 'True' if row else True
+            footer_settings[key] = settings[key] == 'True' if key in settings else True
     
     conn.close()
     
@@ -4463,10 +4814,10 @@ def admin_email():
     smtp_unlocked = session.get('smtp_unlocked', False)
     
     # Fetch current settings as an object - use smtp_server to match template and send_email()
+    settings = get_settings()
     smtp_settings = {}
     for key in ['smtp_server', 'smtp_port', 'smtp_username', 'smtp_password', 'smtp_from', 'smtp_use_tls']:
-        row = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
-        smtp_settings[key] = row[0] if row else ''
+        smtp_settings[key] = settings.get(key, '')
     
     conn.close()
     return render_template('admin/email_settings.html', branding=get_branding_settings(), smtp_unlocked=smtp_unlocked, smtp_settings=smtp_settings)
@@ -4501,30 +4852,24 @@ def test_email():
         return redirect(url_for('admin_email'))
     
     # Get SMTP settings - use smtp_server to match the rest of the codebase
-    conn = get_db()
+    settings = get_settings()
     smtp_config = {}
     for key in ['smtp_server', 'smtp_port', 'smtp_username', 'smtp_password', 'smtp_from']:
-        row = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
-        smtp_config[key] = row[0] if row else ''
-    conn.close()
+        smtp_config[key] = settings.get(key, '')
     
     # Validate settings
     if not all([smtp_config['smtp_server'], smtp_config['smtp_port'], smtp_config['smtp_from']]):
         flash('SMTP settings are incomplete. Please configure all required fields.', 'danger')
         return redirect(url_for('admin_email'))
     
-    # Send test email
-    success, message = send_email(
-        test_recipient,
-        'Test Email from Check-in System',
-        '<h2>Test Email</h2><p>This is a test email to verify your SMTP configuration is working correctly.</p><p>If you received this email, your settings are configured properly!</p>'
+    # Send test email (one attempt, so a bad setting is reported at once)
+    enqueue_task(
+        'email', f'Sending a test email to {test_recipient}', max_attempts=1,
+        to_address=test_recipient,
+        subject='Test Email from Check-in System',
+        html_body='<h2>Test Email</h2><p>This is a test email to verify your SMTP configuration is working correctly.</p><p>If you received this email, your settings are configured properly!</p>'
     )
     
-    if success:
-        flash(f'Test email sent successfully to {test_recipient}', 'success')
-    else:
-        flash(f'Failed to send test email: {message}', 'danger')
-    
     return redirect(url_for('admin_email'))
 
 @app.route('/admin/utilities', methods=['GET'])
@@ -4561,7 +4906,7 @@ def admin_utilities():
 @require_auth
 def export_configuration():
     """Export all configuration settings as JSON backup"""
-    conn = get_db()
+    stored = get_settings()
     
     # Collect all settings
     settings = {}
@@ -4571,25 +4916,20 @@ def export_configuration():
                      'primary_color', 'secondary_color', 'accent_color', 
                      'logo_filename', 'favicon_filename']
     for key in branding_keys:
-        val = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
-        if val:
-            settings[key] = val['value']
+        if key in stored:
+            settings[key] = stored[key]
     
     # Security/access settings (exclude developer_password as it's env-only)
     security_keys = ['app_password', 'admin_override_password', 'checkout_code']
     for key in security_keys:
-        val = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
-        if val:
-            settings[key] = val['value']
+        if key in stored:
+            settings[key] = stored[key]
     
     # Other settings
     other_keys = ['event_date_range_months', 'label_line_1', 'label_line_2', 'label_line_3']
     for key in other_keys:
-        val = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
-        if val:
-            settings[key] = val['value']
-    
-    conn.close()
+        if key in stored:
+            settings[key] = stored[key]
     
     # Add metadata
     backup = {
@@ -4652,25 +4992,40 @@ def import_configuration():
 @app.route('/admin/integrations')
 @require_auth
 def admin_integrations():
-    conn = get_db()
+    settings = get_settings()
     
     # Check TLC status
-    tlc_enabled = False
-    last_tlc_sync = None
-    
-    tlc_enabled_row = conn.execute("SELECT value FROM settings WHERE key = 'tlc_enabled'").fetchone()
-    if tlc_enabled_row and tlc_enabled_row['value'] == 'true':
-        tlc_enabled = True
-    
-    last_sync_row = conn.execute("SELECT value FROM settings WHERE key = 'last_tlc_sync'").fetchone()
-    if last_sync_row:
-        last_tlc_sync = last_sync_row['value']
-    
-    conn.close()
+    tlc_enabled = settings.get('tlc_enabled') == 'true'
+    last_tlc_sync = settings.get('last_tlc_sync')
+    tlc_push_workers, tlc_push_rate = tlc_push_settings()
     
     return render_template('admin/integrations.html', 
                          tlc_enabled=tlc_enabled,
-                         last_tlc_sync=last_tlc_sync)
+                         last_tlc_sync=last_tlc_sync,
+                         tlc_push_workers=tlc_push_workers,
+                         tlc_push_rate=tlc_push_rate)
+
+@app.route('/admin/integrations/tlc_push', methods=['POST'])
+@require_auth
+def tlc_push_config():
+    """Save how fast attendance is pushed to TLC"""
+    try:
+        workers = int(request.form.get('tlc_push_workers', TLC_PUSH_WORKERS))
+        rate = float(request.form.get('tlc_push_rate', TLC_PUSH_RATE))
+    except ValueError:
+        flash('Parallel requests and requests per second must be numbers', 'danger')
+        return redirect(url_for('admin_integrations'))
+    if not 1 <= workers <= 10 or not 0.5 <= rate <= 20:
+        flash('Use 1-10 parallel requests and 0.5-20 requests per second', 'danger')
+        return redirect(url_for('admin_integrations'))
+    
+    conn = get_db()
+    conn.executemany("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                     [('tlc_push_workers', str(workers)), ('tlc_push_rate', str(rate))])
+    conn.commit()
+    conn.close()
+    flash('TLC sync speed saved', 'success')
+    return redirect(url_for('admin_integrations'))
 
 @app.route('/admin/integrations/toggle', methods=['POST'])
 @require_auth
@@ -4701,11 +5056,10 @@ def admin_tlc():
     
     # Try to fetch events
     try:
-        client = TrailLifeConnectClient(session['tlc_email'], session['tlc_password'])
-        if not client.login():
+        client = tlc_clients.get(session['tlc_email'], session['tlc_password'])
+        if client is None:
             flash('Login failed. Please check your credentials.', 'error')
-            session.pop('tlc_email', None)
-            session.pop('tlc_password', None)
+            forget_tlc_login()
             return render_template('admin/tlc_sync.html', step='login', branding=branding)
             
         events = client.get_upcoming_events()
@@ -4722,6 +5076,7 @@ def admin_tlc_login():
     password = request.form.get('password')
     
     if email and password:
+        forget_tlc_login()
         session['tlc_email'] = email
         session['tlc_password'] = password
         return redirect(url_for('admin_tlc'))
@@ -4729,6 +5084,16 @@ def admin_tlc_login():
     flash('Please provide both email and password.', 'error')
     return redirect(url_for('admin_tlc'))
 
+# Check-ins on a local date: the coarse UTC window from checkin_time_window
+# (which the index can use), then the exact local date at the given offset
+TLC_DAY_CHECKINS_QUERY = """
+    SELECT k.id, k.name, k.tlc_id, c.checkin_time, c.tlc_synced
+    FROM checkins c
+    JOIN kids k ON c.kid_id = k.id
+    WHERE c.checkin_time >= ? AND c.checkin_time < ?
+      AND date(datetime(c.checkin_time, ?)) = ?
+"""
+
 @app.route('/admin/tlc/sync/<event_id>', methods=['GET'])
 @require_auth
 def admin_tlc_sync_confirm(event_id):
@@ -4737,8 +5102,8 @@ def admin_tlc_sync_confirm(event_id):
     if 'tlc_email' not in session:
         return redirect(url_for('admin_tlc'))
         
-    client = TrailLifeConnectClient(session['tlc_email'], session['tlc_password'])
-    if not client.login():
+    client = tlc_clients.get(session['tlc_email'], session['tlc_password'])
+    if client is None:
         return redirect(url_for('admin_tlc'))
         
     # 1. Get TLC Roster
@@ -4760,10 +5125,6 @@ def admin_tlc_sync_confirm(event_id):
         except ValueError:
             pass # Keep default if parsing fails
             
-    # Ensure DB schema is up to date
-    ensure_tlc_synced_column()
-    ensure_adult_phone_column()
-            
     conn = get_db()
     # Get checkins for the specific date of the event
     # Also fetch tlc_synced status
@@ -4775,12 +5136,9 @@ def admin_tlc_sync_confirm(event_id):
     tz_offset_hours = localized_dt.utcoffset().total_seconds() / 3600
     tz_offset_str = f"{tz_offset_hours:+.0f} hours"
     
-    checkins = conn.execute('''
-        SELECT k.id, k.name, k.tlc_id, c.checkin_time, c.tlc_synced
-        FROM checkins c
-        JOIN kids k ON c.kid_id = k.id
-        WHERE date(datetime(c.checkin_time, ?)) = ?
-    ''', (tz_offset_str, target_date_str)).fetchall()
+    checkins = conn.execute(
+        TLC_DAY_CHECKINS_QUERY, checkin_time_window(target_date_str) + (tz_offset_str, target_date_str)
+    ).fetchall()
     conn.close()
     
     matches = []
@@ -4943,64 +5301,100 @@ def admin_tlc_sync_confirm(event_id):
                          branding=branding,
                          target_date=target_date_str)
 
+# Attendance push defaults: parallel TLC requests, and the most requests a second
+# (admins can change both on the integrations page)
+TLC_PUSH_WORKERS = 4
+TLC_PUSH_RATE = 5.0
+
+def tlc_push_settings():
+    """The configured (workers, rate) for attendance pushes"""
+    settings = get_settings()
+    try:
+        workers = min(max(int(settings.get('tlc_push_workers') or TLC_PUSH_WORKERS), 1), 10)
+    except ValueError:
+        workers = TLC_PUSH_WORKERS
+    try:
+        rate = min(max(float(settings.get('tlc_push_rate') or TLC_PUSH_RATE), 0.5), 20.0)
+    except ValueError:
+        rate = TLC_PUSH_RATE
+    return workers, rate
+
+@task_handler('tlc_attendance')
+def push_tlc_attendance(tlc_login_id, event_id, mappings, target_date):
+    """
+    Mark kids present on a TLC event and flag their check-ins as synced (run on the task queue)
+
+    Args:
+        tlc_login_id: Stored TLC login (see tlc_logins.py)
+        event_id: TLC event id
+        mappings: [kid_id, tlc_user_id] pairs to mark present
+        target_date: Local date (YYYY-MM-DD) of the check-ins to flag, or None
+    """
+    client = tlc_task_client(tlc_login_id)
+    if client is None:
+        raise PermanentError('Failed to login to TLC.')
+    
+    kids_by_tlc_id = {}
+    for kid_id, tlc_id in mappings:
+        kids_by_tlc_id.setdefault(tlc_id, []).append(int(kid_id))
+    total = len(kids_by_tlc_id)
+    
+    # SAFE SYNC: We only mark attendance as Present (True).
+    # We do NOT mark anyone as Absent (False).
+    # This ensures that if someone is marked Present on TLC but not checked in locally,
+    # their status on TLC is preserved (not overwritten).
+    workers, rate = tlc_push_settings()
+    report_task_progress(force=True, done=0, failed=0, total=total)
+    succeeded, failed = client.mark_attendance_many(
+        event_id, list(kids_by_tlc_id), workers=workers, rate=rate,
+        on_progress=lambda done, failed: report_task_progress(done=done, failed=failed, total=total)
+    )
+    report_task_progress(force=True, done=len(succeeded), failed=len(failed), total=total)
+    if total and not succeeded:
+        raise RuntimeError(f'All {total} TLC updates failed')
+    
+    # Flag the synced kids' check-ins on that local date in one statement
+    synced_kids = [kid_id for tlc_id in succeeded for kid_id in kids_by_tlc_id[tlc_id]]
+    conn = get_db()
+    if target_date and synced_kids:
+        # Convert UTC checkin_time to local timezone before comparing dates
+        tz = get_timezone()
+        localized_dt = tz.localize(datetime.strptime(target_date, '%Y-%m-%d'))
+        tz_offset_str = f"{localized_dt.utcoffset().total_seconds() / 3600:+.0f} hours"
+        conn.execute('''
+            UPDATE checkins 
+            SET tlc_synced = 1 
+            WHERE kid_id IN (SELECT value FROM json_each(?))
+              AND checkin_time >= ? AND checkin_time < ?
+              AND date(datetime(checkin_time, ?)) = ?
+        ''', (json.dumps(synced_kids),) + checkin_time_window(target_date) + (tz_offset_str, target_date))
+    conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('last_tlc_sync', ?)",
+                 (datetime.now(get_timezone()).strftime('%b %d, %Y %I:%M %p'),))
+    conn.commit()
+    conn.close()
+    
+    if failed:
+        return f'Synced {len(succeeded)} records, but {len(failed)} failed.'
+    return f'Successfully synced {len(succeeded)} records to Trail Life Connect!'
+
 @app.route('/admin/tlc/sync/<event_id>/execute', methods=['POST'])
 @require_auth
 def admin_tlc_sync_execute(event_id):
     if 'tlc_email' not in session:
         return redirect(url_for('admin_tlc'))
-        
-    client = TrailLifeConnectClient(session['tlc_email'], session['tlc_password'])
-    if not client.login():
-        return redirect(url_for('admin_tlc'))
-        
-    count = 0
-    errors = 0
     
-    # Get target date from form or determine it again (safer to pass it)
-    target_date_str = request.form.get('target_date')
-    
-    conn = get_db()
-    
-    # Iterate through form data
-    # Look for sync_{local_id} checkboxes
+    # Look for sync_{kid_id} checkboxes and their mapped TLC ids
+    mappings = []
     for key, value in request.form.items():
         if key.startswith('sync_') and value == 'on':
             kid_id = key.replace('sync_', '')
-            # Get the mapped TLC ID
             tlc_id = request.form.get(f'mapping_{kid_id}')
-            
             if tlc_id:
-                # SAFE SYNC: We only mark attendance as Present (True).
-                # We do NOT mark anyone as Absent (False).
-                # This ensures that if someone is marked Present on TLC but not checked in locally,
-                # their status on TLC is preserved (not overwritten).
-                if client.mark_attendance(event_id, tlc_id, present=True):
-                    count += 1
-                    # Update local sync status
-                    # We need to find the checkin record for this kid on this date
-                    if target_date_str:
-                        # Convert UTC checkin_time to local timezone before comparing dates
-                        tz = get_timezone()
-                        naive_dt = datetime.strptime(target_date_str, '%Y-%m-%d')
-                        localized_dt = tz.localize(naive_dt)
-                        tz_offset_hours = localized_dt.utcoffset().total_seconds() / 3600
-                        tz_offset_str = f"{tz_offset_hours:+.0f} hours"
-                        conn.execute('''
-                            UPDATE checkins 
-                            SET tlc_synced = 1 
-                            WHERE kid_id = ? AND date(datetime(checkin_time, ?)) = ?
-                        ''', (kid_id, tz_offset_str, target_date_str))
-                else:
-                    errors += 1
+                mappings.append([kid_id, tlc_id])
     
-    conn.commit()
-    conn.close()
-                    
-    if errors > 0:
-        flash(f'Synced {count} records, but {errors} failed.', 'warning')
-    else:
-        flash(f'Successfully synced {count} records to Trail Life Connect!', 'success')
-        
+    # A retry marks already-synced kids present again, which TLC treats as a no-op
+    enqueue_task('tlc_attendance', f'Syncing {len(mappings)} records to Trail Life Connect',
+                 tlc_login_id=tlc_task_login(), event_id=event_id, mappings=mappings, target_date=request.form.get('target_date'))
     return redirect(url_for('admin_tlc'))
 
 @app.route('/admin/tlc/roster', methods=['GET'])
@@ -5010,8 +5404,8 @@ def admin_tlc_roster():
     if 'tlc_email' not in session:
         return redirect(url_for('admin_tlc'))
     
-    client = TrailLifeConnectClient(session['tlc_email'], session['tlc_password'])
-    if not client.login():
+    client = tlc_clients.get(session['tlc_email'], session['tlc_password'])
+    if client is None:
         return redirect(url_for('admin_tlc'))
 
     # We need an event to get the roster. 
@@ -5101,25 +5495,21 @@ def admin_tlc_roster_save():
     flash(f"Updated roster links for {count} records.", "success")
     return redirect(url_for('admin_tlc'))
 
-@app.route('/admin/tlc/roster/sync', methods=['GET'])
-@require_auth
-def admin_tlc_roster_sync():
-    """Sync roster from TLC - creates local kids for any TLC members not yet in the system."""
-    branding = get_branding_settings()
-    if 'tlc_email' not in session:
-        flash("Please login to Trail Life Connect first.", "warning")
-        return redirect(url_for('admin_tlc'))
-    
-    client = TrailLifeConnectClient(session['tlc_email'], session['tlc_password'])
-    if not client.login():
-        flash("TLC Login failed. Please try again.", "danger")
-        return redirect(url_for('admin_tlc'))
+FAMILY_BY_PHONE_QUERY = "SELECT id FROM families WHERE phone = ?"
+
+@task_handler('tlc_roster_sync')
+def sync_tlc_roster(tlc_login_id):
+    """Create local kids for any TLC members not yet in the system (run on the task queue)"""
+    from encryption import FieldEncryption
+
+    client = tlc_task_client(tlc_login_id)
+    if client is None:
+        raise PermanentError("TLC Login failed. Please try again.")
 
     # Get first upcoming event to fetch roster
     events = client.get_upcoming_events()
     if not events:
-        flash("No upcoming events found to fetch roster from.", "warning")
-        return redirect(url_for('admin_tlc_roster'))
+        raise PermanentError("No upcoming events found to fetch roster from.")
         
     event_id = events[0]['id']
     tlc_roster = client.get_event_roster(event_id)  # Dict: Name -> {'id': ..., 'profile_url': ...}
@@ -5135,12 +5525,12 @@ def admin_tlc_roster_sync():
     # Get or create a default "TLC Import" family using placeholder phone
     # Use a recognizable placeholder phone number
     tlc_family_phone = '000-000-0000'
-    tlc_family = conn.execute("SELECT id FROM families WHERE phone = ?", (tlc_family_phone,)).fetchone()
+    tlc_family = conn.execute(FAMILY_BY_PHONE_QUERY, (tlc_family_phone,)).fetchone()
     if not tlc_family:
-        conn.execute("INSERT INTO families (phone, troop) VALUES (?, ?)", 
-                    (tlc_family_phone, 'TLC Import'))
+        conn.execute("INSERT INTO families (phone, phone_digits_rev, troop) VALUES (?, ?, ?)", 
+                    (tlc_family_phone, phone_search_key(tlc_family_phone), 'TLC Import'))
         conn.commit()
-        tlc_family = conn.execute("SELECT id FROM families WHERE phone = ?", (tlc_family_phone,)).fetchone()
+        tlc_family = conn.execute(FAMILY_BY_PHONE_QUERY, (tlc_family_phone,)).fetchone()
     
     family_id = tlc_family['id']
     
@@ -5184,19 +5574,28 @@ def admin_tlc_roster_sync():
             conn.execute("UPDATE kids SET tlc_id = ? WHERE id = ?", (tlc_id, matched_kid['id']))
             updated_count += 1
         else:
-            # Create new kid with this TLC member
-            conn.execute("INSERT INTO kids (name, family_id, tlc_id) VALUES (?, ?, ?)",
-                        (tlc_name, family_id, tlc_id))
+            # Create new kid with this TLC member (with name hashes, so name search finds them)
+            conn.execute("INSERT INTO kids (name, name_hash, name_token_hashes, family_id, tlc_id) VALUES (?, ?, ?, ?, ?)",
+                        (tlc_name, FieldEncryption.hash_for_search(tlc_name),
+                         json.dumps(FieldEncryption.hash_name_tokens(tlc_name)), family_id, tlc_id))
             added_count += 1
     
     conn.commit()
     conn.close()
     
     if added_count > 0 or updated_count > 0:
-        flash(f"Roster sync complete! Added {added_count} new kids, linked {updated_count} existing kids.", "success")
-    else:
-        flash("Roster sync complete. All TLC members are already in the system.", "info")
+        return f"Added {added_count} new kids, linked {updated_count} existing kids."
+    return "All TLC members are already in the system."
+
+@app.route('/admin/tlc/roster/sync', methods=['GET'])
+@require_auth
+def admin_tlc_roster_sync():
+    """Sync roster from TLC - creates local kids for any TLC members not yet in the system."""
+    if 'tlc_email' not in session:
+        flash("Please login to Trail Life Connect first.", "warning")
+        return redirect(url_for('admin_tlc'))
     
+    enqueue_task('tlc_roster_sync', 'Syncing the roster from Trail Life Connect', tlc_login_id=tlc_task_login())
     return redirect(url_for('admin_tlc_roster'))
 
 @app.route('/admin/tlc/autosync/<int:local_event_id>', methods=['GET'])
@@ -5235,8 +5634,8 @@ def admin_tlc_autosync(local_event_id):
     target_date_str = local_dt.strftime('%m/%d/%Y')
 
     # 2. Login and Fetch TLC Events
-    client = TrailLifeConnectClient(session['tlc_email'], session['tlc_password'])
-    if not client.login():
+    client = tlc_clients.get(session['tlc_email'], session['tlc_password'])
+    if client is None:
         flash("TLC Login failed.", "danger")
         return redirect(url_for('admin_tlc'))
 
@@ -0,0 +1,93 @@
+"""
+One-time startup (bootstrap) runner for Youth Secure Check-in.
+
+Schema creation, data migrations and hash backfills must not run in every
+gunicorn worker at import time - they race each other on the same database
+and stall worker boot. Instead they run once, in order, under an exclusive
+file lock next to the database, and each stage is timed so slow startups can
+be diagnosed from the logs.
+
+The gunicorn master runs the bootstrap in its ``on_starting`` hook (see
+gunicorn.conf.py) and sets BOOTSTRAP_ENV_FLAG so forked workers skip it.
+"""
+
+import os
+import time
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Set once the bootstrap has completed in this process (inherited by forked workers)
+BOOTSTRAP_ENV_FLAG = 'YSC_BOOTSTRAP_DONE'
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+@contextmanager
+def file_lock(lock_path):
+    """Hold an exclusive lock on lock_path for the duration of the block"""
+    with open(lock_path, 'a+') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        elif msvcrt:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            elif msvcrt:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def is_bootstrapped():
+    """Check if this process (or the master it was forked from) already bootstrapped"""
+    return os.getenv(BOOTSTRAP_ENV_FLAG) == '1'
+
+
+def run_stages(stages, lock_path):
+    """
+    Run bootstrap stages in order under an exclusive file lock
+
+    Args:
+        stages: List of (name, callable) tuples
+        lock_path: Path of the lock file (created if missing)
+
+    Returns:
+        List of dicts with 'stage', 'seconds' and 'error' (None on success).
+        A failing stage is logged and does not stop the remaining stages.
+    """
+    report = []
+    wait_started = time.perf_counter()
+    with file_lock(lock_path):
+        waited = time.perf_counter() - wait_started
+        if waited > 0.5:
+            logger.info(f"Bootstrap: waited {waited:.2f}s for lock held by another process")
+
+        for name, func in stages:
+            started = time.perf_counter()
+            error = None
+            try:
+                func()
+            except Exception as e:
+                error = str(e)
+                logger.warning(f"Bootstrap: stage '{name}' failed: {error}")
+            elapsed = time.perf_counter() - started
+            report.append({'stage': name, 'seconds': round(elapsed, 4), 'error': error})
+            logger.info(f"Bootstrap: {name} took {elapsed * 1000:.1f} ms")
+
+    os.environ[BOOTSTRAP_ENV_FLAG] = '1'
+    total = sum(r['seconds'] for r in report)
+    logger.info(f"Bootstrap: completed {len(report)} stages in {total * 1000:.1f} ms")
+    return report
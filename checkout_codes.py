@@ -0,0 +1,188 @@
+"""
+Per-event checkout code pool.
+
+In random-codes mode each family gets a 5-digit checkout code that must be
+unique among the event's open check-ins. Drawing random codes and retrying on
+collision gets slower as an event fills, and a sequence anyone can continue
+from two codes lets families guess each other's, so each event gets its own
+random permutation of 10000-99999, persisted in the database:
+
+- ``checkout_code_pools.free_count`` is the number of codes not handed out.
+  Slots ``0 .. free_count - 1`` of the permutation hold exactly those codes.
+- A slot holds ``10000 + slot`` unless ``checkout_code_slots`` says otherwise,
+  so a new pool is a single row and the table only grows with use.
+- Allocating picks a slot with ``secrets`` (a Fisher-Yates step), hands out
+  its code and moves the last free slot's code into its place. Codes are
+  unpredictable and drawn uniformly from those still free.
+- A code handed out stays in ``checkout_code_held`` until the last open
+  check-in holding it is checked out or deleted; a trigger then pushes it
+  back onto the end of the free slots.
+
+Allocation and release are both constant time and run on the caller's
+connection, so they commit or roll back with the check-in itself.
+"""
+
+import secrets
+from datetime import datetime
+
+CODE_MIN = 10000
+CAPACITY = 90000  # 10000-99999
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkout_code_pools (
+    event_id INTEGER PRIMARY KEY,
+    free_count INTEGER NOT NULL,  -- Slots 0 .. free_count - 1 hold the free codes
+    issued INTEGER NOT NULL DEFAULT 0,  -- Codes handed out so far (for the utilisation report)
+    created_at TEXT NOT NULL
+);
+
+-- Slots of the permutation whose code isn't 10000 + slot
+CREATE TABLE IF NOT EXISTS checkout_code_slots (
+    event_id INTEGER NOT NULL,
+    slot INTEGER NOT NULL,
+    code TEXT NOT NULL,
+    PRIMARY KEY (event_id, slot)
+) WITHOUT ROWID;
+
+-- Codes handed out from the pool and not yet released
+CREATE TABLE IF NOT EXISTS checkout_code_held (
+    event_id INTEGER NOT NULL,
+    code TEXT NOT NULL,
+    PRIMARY KEY (event_id, code)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS checkout_codes_release_on_checkout AFTER UPDATE OF checkout_time ON checkins
+WHEN OLD.checkout_time IS NULL AND NEW.checkout_time IS NOT NULL
+     AND EXISTS (SELECT 1 FROM checkout_code_held WHERE event_id = NEW.event_id AND code = NEW.checkout_code)
+     AND NOT EXISTS (SELECT 1 FROM checkins WHERE event_id = NEW.event_id
+                     AND checkout_code = NEW.checkout_code AND checkout_time IS NULL)
+BEGIN
+    INSERT OR REPLACE INTO checkout_code_slots (event_id, slot, code)
+    SELECT event_id, free_count, NEW.checkout_code FROM checkout_code_pools WHERE event_id = NEW.event_id;
+    UPDATE checkout_code_pools SET free_count = free_count + 1 WHERE event_id = NEW.event_id;
+    DELETE FROM checkout_code_held WHERE event_id = NEW.event_id AND code = NEW.checkout_code;
+END;
+
+CREATE TRIGGER IF NOT EXISTS checkout_codes_release_on_delete AFTER DELETE ON checkins
+WHEN OLD.checkout_time IS NULL
+     AND EXISTS (SELECT 1 FROM checkout_code_held WHERE event_id = OLD.event_id AND code = OLD.checkout_code)
+     AND NOT EXISTS (SELECT 1 FROM checkins WHERE event_id = OLD.event_id
+                     AND checkout_code = OLD.checkout_code AND checkout_time IS NULL)
+BEGIN
+    INSERT OR REPLACE INTO checkout_code_slots (event_id, slot, code)
+    SELECT event_id, free_count, OLD.checkout_code FROM checkout_code_pools WHERE event_id = OLD.event_id;
+    UPDATE checkout_code_pools SET free_count = free_count + 1 WHERE event_id = OLD.event_id;
+    DELETE FROM checkout_code_held WHERE event_id = OLD.event_id AND code = OLD.checkout_code;
+END;
+
+CREATE TRIGGER IF NOT EXISTS checkout_codes_event_delete AFTER DELETE ON events
+BEGIN
+    DELETE FROM checkout_code_pools WHERE event_id = OLD.id;
+    DELETE FROM checkout_code_slots WHERE event_id = OLD.id;
+    DELETE FROM checkout_code_held WHERE event_id = OLD.id;
+END;
+"""
+
+# Drops the sequential pool (multiplier/offset/next_index plus a free list):
+# an affine sequence let anyone who saw two codes predict the rest
+SEQUENTIAL_POOL_DROP = """
+DROP TRIGGER IF EXISTS checkout_codes_release_on_checkout;
+DROP TRIGGER IF EXISTS checkout_codes_release_on_delete;
+DROP TRIGGER IF EXISTS checkout_codes_event_delete;
+DROP TABLE IF EXISTS checkout_code_free;
+DROP TABLE IF EXISTS checkout_code_pools;
+"""
+
+
+class CodePoolExhausted(Exception):
+    """Every checkout code for the event is held by an open check-in"""
+
+
+def _slot_code(conn, event_id, slot):
+    row = conn.execute(
+        "SELECT code FROM checkout_code_slots WHERE event_id = ? AND slot = ?", (event_id, slot)
+    ).fetchone()
+    return row[0] if row else str(CODE_MIN + slot)
+
+
+def _in_use(conn, event_id, code):
+    return conn.execute(
+        "SELECT 1 FROM checkins WHERE checkout_code = ? AND checkout_time IS NULL AND event_id = ? LIMIT 1",
+        (code, event_id)
+    ).fetchone() is not None
+
+
+def allocate_code(conn, event_id):
+    """
+    Take a random free checkout code for an event
+
+    Must be called inside the write transaction that stores the check-in
+    (BEGIN IMMEDIATE), so the code is claimed atomically with it.
+
+    Args:
+        conn: Open database connection, inside a write transaction
+        event_id: Event the code is for
+
+    Returns:
+        5-digit code as a string
+
+    Raises:
+        CodePoolExhausted: All 90000 codes are held by open check-ins
+    """
+    pool = conn.execute("SELECT free_count FROM checkout_code_pools WHERE event_id = ?", (event_id,)).fetchone()
+    if pool is None:
+        conn.execute(
+            "INSERT INTO checkout_code_pools (event_id, free_count, created_at) VALUES (?, ?, ?)",
+            (event_id, CAPACITY, datetime.utcnow().isoformat())
+        )
+        free_count = CAPACITY
+    else:
+        free_count = pool[0]
+
+    while True:
+        if free_count == 0:
+            raise CodePoolExhausted(f"No free checkout codes for event {event_id}")
+        slot = secrets.randbelow(free_count)
+        last = free_count - 1
+        code = _slot_code(conn, event_id, slot)
+        if slot != last:
+            conn.execute(
+                "INSERT OR REPLACE INTO checkout_code_slots (event_id, slot, code) VALUES (?, ?, ?)",
+                (event_id, slot, _slot_code(conn, event_id, last))
+            )
+        conn.execute("DELETE FROM checkout_code_slots WHERE event_id = ? AND slot = ?", (event_id, last))
+        free_count = last
+        conn.execute("INSERT OR IGNORE INTO checkout_code_held (event_id, code) VALUES (?, ?)", (event_id, code))
+        # A check-in from before the pool existed (or one reopened after checkout)
+        # may still hold the code; it is released again when that one checks out
+        if not _in_use(conn, event_id, code):
+            break
+
+    conn.execute(
+        "UPDATE checkout_code_pools SET free_count = ?, issued = issued + 1 WHERE event_id = ?",
+        (free_count, event_id)
+    )
+    return code
+
+
+def pool_stats(conn, event_id):
+    """
+    Report checkout code pool utilisation for an event
+
+    Returns:
+        Dict with capacity, issued (codes handed out so far), free (codes
+        left in the pool), in_use (codes out of the pool) and utilisation
+        (in_use / capacity)
+    """
+    pool = conn.execute(
+        "SELECT free_count, issued FROM checkout_code_pools WHERE event_id = ?", (event_id,)
+    ).fetchone()
+    free_count, issued = (pool[0], pool[1]) if pool else (CAPACITY, 0)
+    in_use = CAPACITY - free_count
+    return {
+        'capacity': CAPACITY,
+        'issued': issued,
+        'free': free_count,
+        'in_use': in_use,
+        'utilisation': round(in_use / CAPACITY, 4),
+    }
@@ -0,0 +1,173 @@
+"""
+SQLite connection pooling for Youth Secure Check-in.
+
+Each worker process keeps a small pool of open connections per database file.
+Connections are configured once (row factory, WAL journal, busy timeout) when
+they are first opened and are then reused, so a page render no longer pays for
+several connect/PRAGMA round trips.
+
+Inside a Flask request the app binds one pooled connection to ``g`` and hands
+the same connection to every helper; the connection goes back to the pool on
+teardown. Outside a request (background threads, CLI scripts) each
+``get_db()`` call borrows a connection and ``close()`` returns it.
+
+Restoring a backup replaces the database file underneath every worker's
+pool. ``checkpoint`` empties the WAL before the file is replaced, so no old
+pages are applied to the new file. ``mark_replaced`` then touches a marker
+file next to the database. Each pool checks the marker on ``acquire`` and
+drops connections opened before it changed, so every process reconnects to
+the restored file.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+
+class ConnectionPool:
+    def __init__(self, db_path, max_idle=4, timeout=30):
+        """
+        Initialize the pool
+
+        Args:
+            db_path: Path to the SQLite database file
+            max_idle: Maximum number of idle connections kept open
+            timeout: Seconds to wait on a locked database (busy timeout)
+        """
+        self.db_path = str(db_path)
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.marker_path = self.db_path + '-restored'
+        self._generation = self._read_generation()
+        # Connection -> the generation it was opened in
+        self._born = {}
+
+    def _read_generation(self):
+        """Identity of the restore marker (None if the database was never replaced)"""
+        try:
+            st = os.stat(self.marker_path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    def _connect(self):
+        """Open and configure a new connection (pragmas are applied once here)"""
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA busy_timeout = {int(self.timeout * 1000)}")
+        with self._lock:
+            self.opened += 1
+            self._born[conn] = self._generation
+        return conn
+
+    def acquire(self):
+        """Borrow a connection from the pool, opening one if none are idle"""
+        generation = self._read_generation()
+        stale = []
+        with self._lock:
+            if generation != self._generation:
+                # The database file was replaced (perhaps by another process)
+                stale, self._idle = self._idle, []
+                self._generation = generation
+            conn = self._idle.pop() if self._idle else None
+        for old in stale:
+            self._discard(old)
+        return conn if conn is not None else self._connect()
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding any uncommitted work"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Broken connection - don't put it back
+            self._discard(conn)
+            return
+
+        with self._lock:
+            # Connections opened before a restore are never reused
+            if self._born.get(conn) == self._generation and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        self._discard(conn)
+
+    def _discard(self, conn):
+        self._born.pop(conn, None)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def checkpoint(self):
+        """Write the WAL into the database file and empty it (before the file is replaced)"""
+        conn = self.acquire()
+        try:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            self._discard(conn)
+
+    def mark_replaced(self):
+        """
+        Record that the database file was replaced (e.g. restored from a
+        backup), so every process's pool drops its old connections on its next
+        acquire
+        """
+        tmp_path = self.marker_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(time.time_ns()))
+        os.replace(tmp_path, self.marker_path)
+        self.close_all()
+
+    def close_all(self):
+        """Close every idle connection (e.g. after a database restore)"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn)
+
+    def stats(self):
+        """Return pool counters for diagnostics"""
+        with self._lock:
+            return {'db_path': self.db_path, 'idle': len(self._idle), 'opened': self.opened}
+
+
+class PooledConnection:
+    """Thin proxy around a pooled sqlite3 connection.
+
+    Behaves like a regular connection. ``close()`` is a no-op while the
+    connection is bound to a request (it is released on teardown) and returns
+    the connection to the pool otherwise.
+    """
+
+    def __init__(self, pool, conn, request_bound=False):
+        self._pool = pool
+        self._conn = conn
+        self._request_bound = request_bound
+
+    def __getattr__(self, name):
+        conn = self.__dict__.get('_conn')
+        if conn is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a released connection.")
+        return getattr(conn, name)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    def close(self):
+        if not self._request_bound:
+            self.release()
+
+    def release(self):
+        """Hand the underlying connection back to the pool"""
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn)
@@ -12,6 +12,8 @@ import random
 import json
 import hashlib
 
+from phone_search import search_key as phone_search_key
+
 # Demo configuration
 DEMO_TROOP = "Demo Troop 4603"
 DATABASE_PATH = os.getenv('DATABASE_PATH', 'data/demo.db')
@@ -239,8 +241,8 @@ def seed_families_and_kids(conn):
     for fam_data in DEMO_FAMILIES:
         # Insert family
         cur = conn.execute(
-            "INSERT INTO families (phone, troop) VALUES (?, ?)",
-            (fam_data['phone'], fam_data['troop'])
+            "INSERT INTO families (phone, phone_digits_rev, troop) VALUES (?, ?, ?)",
+            (fam_data['phone'], phone_search_key(fam_data['phone']), fam_data['troop'])
         )
         family_id = cur.lastrowid
         family_ids.append(family_id)
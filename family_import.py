@@ -0,0 +1,264 @@
+"""
+Bulk family import from CSV.
+
+Councils are onboarded from spreadsheets with tens of thousands of rows, so
+the import is a single streaming pass over the uploaded file:
+
+- each row is parsed and validated as it is read (bad rows are reported with
+  their line number and skipped)
+- families whose phone number is already in the database, or earlier in the
+  file, are reported as duplicates and skipped
+- name search hashes and phone search keys are computed as each row is
+  parsed, exactly as the add/edit family forms do, so imported people are
+  searchable at once and batch writes only insert
+- rows are written with executemany in batches, all inside one transaction,
+  so a failed import leaves nothing behind
+
+A dry run does the same pass without writing and returns the report. Progress
+is written to a small JSON file next to the upload so any worker can serve it.
+
+Expected columns (the format /admin/families/export produces):
+Phone, Troop, Authorized Adults, Adults, Kids, Kid Notes - people and notes
+separated by ';'.
+"""
+
+import csv
+import io
+import json
+import os
+from datetime import datetime
+
+from encryption import FieldEncryption
+from phone_search import search_key as phone_search_key
+
+COLUMNS = ['Phone', 'Troop', 'Authorized Adults', 'Adults', 'Kids', 'Kid Notes']
+
+# Families per executemany batch
+BATCH_SIZE = 1000
+
+# Most errors/duplicates listed individually in a report (the rest are only counted)
+MAX_REPORTED = 100
+
+
+class ImportProgress:
+    """Import status, written to a JSON file so every worker can report it"""
+
+    def __init__(self, path, dry_run, total_bytes=0, default_troop=''):
+        self.path = path
+        self.state = {
+            'status': 'running',  # running, done, failed
+            'dry_run': dry_run,
+            'default_troop': default_troop,
+            'rows': 0,
+            'families': 0,
+            'adults': 0,
+            'kids': 0,
+            'duplicates': 0,
+            'errors': 0,
+            'duplicate_rows': [],
+            'error_rows': [],
+            'bytes_read': 0,
+            'total_bytes': total_bytes,
+            'message': '',
+            'started_at': datetime.utcnow().isoformat(),
+            'finished_at': None,
+        }
+        self.save()
+
+    def note(self, kind, line, message):
+        """Record a duplicate or error row ('duplicate' or 'error')"""
+        self.state[kind + 's'] += 1
+        listed = self.state[kind + '_rows']
+        if len(listed) < MAX_REPORTED:
+            listed.append({'line': line, 'message': message})
+
+    def finish(self, status, message=''):
+        self.state.update(status=status, message=message, finished_at=datetime.utcnow().isoformat())
+        self.save()
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+
+def load_progress(path):
+    """Read an import's status (None if unknown)"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def split_names(value):
+    return [part.strip() for part in (value or '').split(';')]
+
+
+def name_hashes(name):
+    """(name, name_hash, name_token_hashes) as stored for an adult or kid"""
+    return name, FieldEncryption.hash_for_search(name), json.dumps(FieldEncryption.hash_name_tokens(name))
+
+
+def parse_row(row, default_troop=''):
+    """
+    Turn a CSV row into a family dict
+
+    Returns:
+        Dict with phone, phone_key, troop, authorized_adults, adults
+        ((name, name_hash, name_token_hashes) tuples) and kids ((name,
+        name_hash, name_token_hashes, notes) tuples)
+
+    Raises:
+        ValueError: The row can't be imported
+    """
+    if len(row) < 5:
+        raise ValueError(f"Expected at least 5 columns, got {len(row)}")
+    phone = row[0].strip()
+    phone_key = phone_search_key(phone)
+    if not phone_key:
+        raise ValueError("Missing phone number")
+
+    adults = [name for name in split_names(row[3]) if name]
+    kid_names = split_names(row[4])
+    kid_notes = split_names(row[5]) if len(row) > 5 else []
+    kids = [(name, kid_notes[i] if i < len(kid_notes) else '') for i, name in enumerate(kid_names) if name]
+    if not adults and not kids:
+        raise ValueError("No adults or kids")
+
+    return {
+        'phone': phone,
+        'phone_key': phone_key,
+        'troop': row[1].strip() or default_troop,
+        'authorized_adults': row[2].strip(),
+        'adults': [name_hashes(name) for name in adults],
+        'kids': [name_hashes(name) + (notes,) for name, notes in kids],
+    }
+
+
+def find_existing(conn, phone_keys):
+    """Map phone keys already used by families to those families' ids"""
+    existing = {}
+    keys = list(phone_keys)
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i + 500]
+        placeholders = ','.join('?' * len(chunk))
+        for row in conn.execute(
+            f"SELECT phone_digits_rev, id FROM families WHERE phone_digits_rev IN ({placeholders})", chunk
+        ):
+            existing.setdefault(row[0], row[1])
+    return existing
+
+
+def _next_id(conn, table):
+    # AUTOINCREMENT never reuses ids, so start past both the sequence and the current maximum
+    row = conn.execute(f"""
+        SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = '{table}'), 0),
+                   COALESCE((SELECT MAX(id) FROM {table}), 0))
+    """).fetchone()
+    return row[0] + 1
+
+
+def write_batch(conn, families):
+    """
+    Insert a batch of parsed families with their adults and kids
+
+    Must run inside the import's write transaction (ids are assigned from the
+    current maximum, which nothing else can change while it holds the lock).
+
+    Returns:
+        (adults, kids) - the number of each inserted
+    """
+    family_id = _next_id(conn, 'families')
+    family_rows, adult_rows, kid_rows = [], [], []
+    for family in families:
+        family_rows.append((family_id, family['phone'], family['phone_key'], family['troop'], family['authorized_adults']))
+        adult_rows += [(family_id,) + adult for adult in family['adults']]
+        kid_rows += [(family_id,) + kid for kid in family['kids']]
+        family_id += 1
+
+    conn.executemany(
+        "INSERT INTO families (id, phone, phone_digits_rev, troop, authorized_adults) VALUES (?, ?, ?, ?, ?)",
+        family_rows
+    )
+    conn.executemany(
+        "INSERT INTO adults (family_id, name, name_hash, name_token_hashes) VALUES (?, ?, ?, ?)", adult_rows
+    )
+    conn.executemany(
+        "INSERT INTO kids (family_id, name, name_hash, name_token_hashes, notes) VALUES (?, ?, ?, ?, ?)", kid_rows
+    )
+    return len(adult_rows), len(kid_rows)
+
+
+def run_import(conn, path, progress, default_troop='', dry_run=False):
+    """
+    Import (or dry-run) a family CSV file
+
+    Args:
+        conn: Open database connection
+        path: Uploaded CSV file
+        progress: ImportProgress to update as batches complete
+        default_troop: Troop for rows that don't name one
+        dry_run: Validate and report without writing
+
+    Returns:
+        The final progress state dict
+    """
+    with open(path, 'rb') as raw:
+        text = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+        reader = csv.reader(text)
+        if not dry_run:
+            conn.execute("BEGIN IMMEDIATE")
+        try:
+            next(reader, None)  # Header
+            seen = set()
+            batch = []
+            for row in reader:
+                progress.state['rows'] += 1
+                if not any(cell.strip() for cell in row):
+                    continue
+                try:
+                    family = parse_row(row, default_troop)
+                except ValueError as e:
+                    progress.note('error', reader.line_num, str(e))
+                    continue
+                if family['phone_key'] in seen:
+                    progress.note('duplicate', reader.line_num, f"Phone {family['phone']} appears earlier in the file")
+                    continue
+                seen.add(family['phone_key'])
+                family['line'] = reader.line_num
+                batch.append(family)
+                if len(batch) >= BATCH_SIZE:
+                    _flush(conn, batch, progress, dry_run, raw.tell())
+                    batch = []
+            _flush(conn, batch, progress, dry_run, raw.tell())
+            if not dry_run:
+                conn.commit()
+        except Exception:
+            if not dry_run:
+                conn.rollback()
+            raise
+    return progress.state
+
+
+def _flush(conn, batch, progress, dry_run, bytes_read):
+    existing = find_existing(conn, [family['phone_key'] for family in batch])
+    new_families = []
+    for family in batch:
+        if family['phone_key'] in existing:
+            progress.note('duplicate', family['line'],
+                          f"Phone {family['phone']} already belongs to family {existing[family['phone_key']]}")
+        else:
+            new_families.append(family)
+
+    if dry_run:
+        adults = sum(len(family['adults']) for family in new_families)
+        kids = sum(len(family['kids']) for family in new_families)
+    else:
+        adults, kids = write_batch(conn, new_families) if new_families else (0, 0)
+    progress.state['families'] += len(new_families)
+    progress.state['adults'] += adults
+    progress.state['kids'] += kids
+    progress.state['bytes_read'] = bytes_read
+    progress.save()
@@ -0,0 +1,27 @@
+"""
+Gunicorn configuration - loaded automatically from the working directory.
+
+Runs the one-time bootstrap (migrations, schema, hash backfill) in the master
+process before any workers are forked, so worker boot and restarts during an
+event don't touch the database.
+"""
+
+# Kiosks hold a Server-Sent Events roster stream open (up to ~25 s per
+# connection, see /events/<id>/stream). Threaded workers keep those from
+# starving ordinary requests the way sync workers would, and each worker
+# holds at most ROSTER_STREAM_MAX_PER_WORKER (4) streams so at least half its
+# threads stay free; further pages poll /events/<id>/changes instead.
+worker_class = 'gthread'
+threads = 8
+
+
+def on_starting(server):
+    from app import bootstrap, close_db_pools
+
+    report = bootstrap() or []
+    for stage in report:
+        status = 'ok' if not stage['error'] else f"failed: {stage['error']}"
+        server.log.info(f"Bootstrap {stage['stage']}: {stage['seconds'] * 1000:.1f} ms ({status})")
+
+    # Workers are forked from this process - never share SQLite connections across fork
+    close_db_pools()
@@ -0,0 +1,325 @@
+"""
+Incremental iCal event sync.
+
+Council calendars are several MB and years deep, and most hourly syncs find
+nothing new. Each sync therefore does as little as it can:
+
+- the download is conditional (If-None-Match / If-Modified-Since with the
+  validators from the last successful run), so an unchanged calendar costs a
+  304 and no body
+- if the server sends the body anyway, its SHA-256 is compared with the last
+  run's and an identical calendar is not parsed at all
+- both shortcuts only apply while the expansion window (below) is the one
+  the last run used; once it moves (daily, or when the date range setting
+  changes) the calendar is fetched in full and expanded again
+- otherwise the parsed events are diffed against the events table, and only
+  rows whose fields actually differ are written, with one bulk upsert
+
+Events are keyed by their iCal UID plus recurrence id (``events.ical_uid``,
+``events.ical_recurrence_id``, unique together), so a renamed or rescheduled
+event updates its row instead of adding a new one. Recurring events (RRULE,
+RDATE, EXDATE and RECURRENCE-ID overrides) are expanded into one row per
+occurrence, but only inside the window the app shows events for; occurrences
+that drift out of the window are left alone rather than deleted.
+
+Every run is recorded in ``ical_sync_runs`` with what it fetched and changed.
+The latest successful run also holds the validators, hash and window for the
+next one.
+"""
+
+import hashlib
+from datetime import date, datetime, timedelta
+
+import pytz
+from dateutil.rrule import rruleset, rrulestr
+from icalendar.prop import vRecur
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ical_sync_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    outcome TEXT NOT NULL,  -- not_modified (304), unchanged (same content hash), synced, error
+    http_status INTEGER,
+    etag TEXT,
+    last_modified TEXT,
+    content_hash TEXT,
+    fetched_bytes INTEGER NOT NULL DEFAULT 0,
+    parsed_events INTEGER NOT NULL DEFAULT 0,
+    inserted INTEGER NOT NULL DEFAULT 0,
+    updated INTEGER NOT NULL DEFAULT 0,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    duration_ms INTEGER NOT NULL DEFAULT 0,
+    message TEXT,
+    window_start TEXT,  -- Recurrence expansion window the events table reflects after this run
+    window_end TEXT
+);
+"""
+
+UID_SCHEMA = """
+CREATE UNIQUE INDEX IF NOT EXISTS idx_events_ical_uid ON events(ical_uid, ical_recurrence_id) WHERE ical_uid IS NOT NULL;
+"""
+
+# Runs kept in ical_sync_runs
+KEEP_RUNS = 200
+
+# Event columns compared to decide whether a row needs updating
+EVENT_FIELDS = ('name', 'start_time', 'end_time', 'description')
+
+UPSERT_EVENT = """
+    INSERT INTO events (ical_uid, ical_recurrence_id, name, start_time, end_time, description)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (ical_uid, ical_recurrence_id) WHERE ical_uid IS NOT NULL DO UPDATE SET
+        name = excluded.name, start_time = excluded.start_time,
+        end_time = excluded.end_time, description = excluded.description
+"""
+
+
+def content_hash(content):
+    """SHA-256 of a downloaded calendar"""
+    return hashlib.sha256(content).hexdigest()
+
+
+def last_good_run(conn, url):
+    """The latest successful run for url (its validators, content hash and window), or None"""
+    return conn.execute("""
+        SELECT etag, last_modified, content_hash, window_start, window_end FROM ical_sync_runs
+        WHERE url = ? AND outcome != 'error'
+        ORDER BY id DESC LIMIT 1
+    """, (url,)).fetchone()
+
+
+def to_local_iso(value, tz):
+    """Convert an iCal date/datetime to an ISO string in tz (dates are local midnight)"""
+    if not isinstance(value, datetime) and isinstance(value, date):
+        value = datetime(value.year, value.month, value.day)
+    if value.tzinfo:
+        return value.astimezone(tz).isoformat()
+    return tz.localize(value).isoformat()
+
+
+def recurrence_id(value):
+    """Key for one occurrence: its original start (UTC for zoned times)"""
+    if not isinstance(value, datetime):
+        return value.strftime('%Y%m%d')
+    if value.tzinfo:
+        return value.astimezone(pytz.UTC).strftime('%Y%m%dT%H%M%SZ')
+    return value.strftime('%Y%m%dT%H%M%S')
+
+
+def _wall_clock(value, tzinfo, tz):
+    """A date/datetime as a naive datetime in tzinfo's wall-clock time (tz for floating times)"""
+    if not isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day)
+    if value.tzinfo:
+        return value.astimezone(tzinfo or tz).replace(tzinfo=None)
+    return value
+
+
+def _attach(value, tzinfo):
+    if tzinfo is None:
+        return value
+    if hasattr(tzinfo, 'localize'):
+        return tzinfo.localize(value)
+    return value.replace(tzinfo=tzinfo)
+
+
+def _dates(prop):
+    """Dates/datetimes from an RDATE/EXDATE property (which may repeat)"""
+    for item in prop if isinstance(prop, list) else [prop] if prop is not None else []:
+        for value in item.dts:
+            yield value.dt
+
+
+def occurrences(component, start, window, tz):
+    """
+    Expand a recurring VEVENT's start times inside window
+
+    Rules are evaluated in the event's own wall-clock time, so a weekly 7 pm
+    meeting stays at 7 pm across DST changes.
+
+    Returns:
+        Occurrence starts, of the same type as start (date, or datetime with start's tzinfo)
+    """
+    is_date = not isinstance(start, datetime)
+    tzinfo = None if is_date else start.tzinfo
+    naive_start = _wall_clock(start, tzinfo, tz)
+
+    rule = vRecur(dict(component.get('rrule')))
+    if 'UNTIL' in rule:
+        rule['UNTIL'] = [_wall_clock(until, tzinfo, tz) for until in rule['UNTIL']]
+    rules = rruleset()
+    rules.rrule(rrulestr(rule.to_ical().decode(), dtstart=naive_start))
+    for value in _dates(component.get('rdate')):
+        rules.rdate(_wall_clock(value, tzinfo, tz))
+    for value in _dates(component.get('exdate')):
+        rules.exdate(_wall_clock(value, tzinfo, tz))
+
+    low, high = (_wall_clock(edge, tzinfo, tz) for edge in window)
+    for occurrence in rules.between(low, high, inc=True):
+        yield occurrence.date() if is_date else _attach(occurrence, tzinfo)
+
+
+def _event(component, uid, rid, start, end, tz):
+    return {
+        'ical_uid': uid,
+        'ical_recurrence_id': rid,
+        'name': str(component.get('summary', 'Event')),
+        'start_time': to_local_iso(start, tz),
+        'end_time': to_local_iso(end, tz) if end is not None else None,
+        'description': str(component.get('description', '')),
+    }
+
+
+def _in_window(value, window, tz):
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    if value.tzinfo is None:
+        value = tz.localize(value)
+    return window[0] <= value <= window[1]
+
+
+def parse_events(calendar, tz, window):
+    """
+    Extract events from a parsed icalendar Calendar
+
+    Args:
+        calendar: icalendar Calendar
+        tz: Local timezone (pytz) for stored times and floating/all-day values
+        window: (start, end) aware datetimes - recurring events are only
+            expanded inside it
+
+    Returns:
+        (events, recurring_uids) - events is a dict of (uid, recurrence id) ->
+        event dict (ical_uid, ical_recurrence_id, name, start_time, end_time,
+        description); recurring_uids is the set of UIDs with an RRULE
+    """
+    events = {}
+    recurring_uids = set()
+    overrides = []
+    for component in calendar.walk('VEVENT'):
+        start_prop = component.get('dtstart')
+        if start_prop is None:
+            continue
+        start = start_prop.dt
+        end = component['dtend'].dt if component.get('dtend') is not None else None
+        if end is None and component.get('duration') is not None:
+            end = start + component['duration'].dt
+        uid = str(component.get('uid') or '')
+        if not uid:
+            # UID is required by RFC 5545, but be lenient with hand-made feeds
+            summary = str(component.get('summary', 'Event'))
+            uid = 'no-uid:' + hashlib.sha256(f"{summary}|{recurrence_id(start)}".encode()).hexdigest()[:32]
+
+        if component.get('recurrence-id') is not None:
+            overrides.append((component, uid, start, end))
+        elif component.get('rrule') is not None:
+            recurring_uids.add(uid)
+            duration = end - start if end is not None else None
+            for occurrence in occurrences(component, start, window, tz):
+                occurrence_end = occurrence + duration if duration is not None else None
+                events[(uid, recurrence_id(occurrence))] = _event(
+                    component, uid, recurrence_id(occurrence), occurrence, occurrence_end, tz)
+        else:
+            events[(uid, '')] = _event(component, uid, '', start, end, tz)
+
+    # Overrides replace (or cancel) one occurrence of a recurring event
+    for component, uid, start, end in overrides:
+        original = component['recurrence-id'].dt
+        key = (uid, recurrence_id(original))
+        if str(component.get('status', '')).upper() == 'CANCELLED':
+            events.pop(key, None)
+        elif key in events or _in_window(original, window, tz) or _in_window(start, window, tz):
+            events[key] = _event(component, uid, key[1], start, end, tz)
+    return events, recurring_uids
+
+
+def sync_window(months, now=None):
+    """
+    (start, end) UTC datetimes for recurring event expansion, months either
+    side of today (whole days, so the window only moves once a day)
+    """
+    today = (now or datetime.now(pytz.UTC)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=31 * months), today + timedelta(days=31 * months)
+
+
+def apply_events(conn, events, recurring_uids, window):
+    """
+    Bring the events table in line with the calendar, touching only rows that differ
+
+    Events synced before UIDs were stored are adopted by matching name and
+    start time. Synced events no longer in the calendar are deleted once they
+    are more than a week old and have no open check-ins; occurrences of a
+    recurring event that are merely outside the window are kept. Events added
+    by hand (no UID) are never touched. The caller commits.
+
+    Returns:
+        Dict with inserted, updated and deleted counts
+    """
+    legacy = {}
+    for row in conn.execute("SELECT id, name, start_time FROM events WHERE ical_uid IS NULL"):
+        legacy.setdefault((row['name'], row['start_time']), row['id'])
+    if legacy:
+        existing_keys = {(row[0], row[1]) for row in conn.execute(
+            "SELECT ical_uid, ical_recurrence_id FROM events WHERE ical_uid IS NOT NULL")}
+        adopt = []
+        for key, event in events.items():
+            legacy_id = legacy.pop((event['name'], event['start_time']), None) if key not in existing_keys else None
+            if legacy_id is not None:
+                adopt.append((event['ical_uid'], event['ical_recurrence_id'], legacy_id))
+        conn.executemany("UPDATE events SET ical_uid = ?, ical_recurrence_id = ? WHERE id = ?", adopt)
+
+    existing = {}
+    for row in conn.execute("""
+        SELECT id, ical_uid, ical_recurrence_id, name, start_time, end_time, description
+        FROM events WHERE ical_uid IS NOT NULL
+    """):
+        existing[(row['ical_uid'], row['ical_recurrence_id'])] = row
+
+    upserts = []
+    inserted = 0
+    for key, event in events.items():
+        row = existing.pop(key, None)
+        if row is None:
+            inserted += 1
+        elif all(row[field] == event[field] for field in EVENT_FIELDS):
+            continue
+        upserts.append((event['ical_uid'], event['ical_recurrence_id'], event['name'],
+                        event['start_time'], event['end_time'], event['description']))
+    conn.executemany(UPSERT_EVENT, upserts)
+
+    # Whatever is left in existing wasn't in this calendar
+    stale = []
+    for (uid, _), row in existing.items():
+        if uid in recurring_uids and not _in_window(datetime.fromisoformat(row['start_time']), window, pytz.UTC):
+            continue
+        stale.append(row['id'])
+
+    deleted = 0
+    if events:
+        for i in range(0, len(stale), 500):
+            chunk = stale[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            cur = conn.execute(f"""
+                DELETE FROM events
+                WHERE id IN ({placeholders})
+                AND start_time < datetime('now', '-7 days')
+                AND id NOT IN (SELECT event_id FROM checkins WHERE checkout_time IS NULL)
+            """, chunk)
+            deleted += cur.rowcount
+    return {'inserted': inserted, 'updated': len(upserts) - inserted, 'deleted': deleted}
+
+
+def record_run(conn, run):
+    """Store a run's stats (dict keyed by ical_sync_runs columns) and prune old runs. The caller commits."""
+    columns = [key for key in run if key != 'id']
+    conn.execute(
+        f"INSERT INTO ical_sync_runs ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        [run[key] for key in columns]
+    )
+    conn.execute("DELETE FROM ical_sync_runs WHERE id <= (SELECT MAX(id) FROM ical_sync_runs) - ?", (KEEP_RUNS,))
+
+
+def recent_runs(conn, limit=10):
+    """Latest runs, newest first"""
+    return conn.execute("SELECT * FROM ical_sync_runs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
@@ -0,0 +1,238 @@
+"""
+Background jobs run once per deployment, not once per worker.
+
+Every gunicorn worker starts a JobRunner thread, but only the one holding the
+``scheduler`` lease in ``job_leases`` runs jobs. The leader renews the lease on
+every tick. If it dies, the lease lapses after ``lease_seconds`` and the next
+worker to tick takes over, so background load stays the same however many
+workers there are.
+
+Each job's next run time is kept in ``job_schedules``, so schedules survive
+restarts and a restart neither skips a due job nor runs it twice. A job is
+claimed by moving its next run time forward, in the same transaction that
+checks the lease, before it runs. Every run is recorded in ``job_runs``
+with its duration and outcome.
+
+A job's schedule is a function from "now" to its next run time (or None
+while the job is disabled). It is evaluated when the job is claimed, or when
+it has no stored time yet, so schedules read from settings take effect once
+``reschedule()`` clears the stored time.
+"""
+
+import logging
+import os
+import secrets
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at REAL NOT NULL  -- unix time
+);
+
+CREATE TABLE IF NOT EXISTS job_schedules (
+    name TEXT PRIMARY KEY,
+    next_run_at TEXT NOT NULL,  -- UTC, YYYY-MM-DDTHH:MM:SSZ
+    last_run_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS job_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job TEXT NOT NULL,
+    holder TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    status TEXT NOT NULL,  -- running, ok, error
+    duration_ms INTEGER,
+    message TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_job_runs_job ON job_runs(job, id);
+"""
+
+LEASE_NAME = 'scheduler'
+
+# Runs kept in job_runs
+KEEP_RUNS = 1000
+
+
+def _iso(dt):
+    return dt.astimezone(pytz.UTC).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def every(seconds):
+    """Schedule: a fixed interval after the previous run"""
+    return lambda now: now + timedelta(seconds=seconds)
+
+
+def next_cron_time(now, tz, frequency, hour):
+    """
+    Next run time for the backup-style schedules
+
+    Args:
+        now: Aware datetime to schedule after
+        tz: Timezone the hour is in
+        frequency: 'hourly', 'daily', 'weekly' (Saturdays) or 'monthly' (the 1st)
+        hour: Hour of day (ignored for hourly)
+
+    Returns:
+        Aware UTC datetime
+    """
+    if frequency == 'hourly':
+        return now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    matches = {
+        'daily': lambda day: True,
+        'weekly': lambda day: day.weekday() == 5,
+        'monthly': lambda day: day.day == 1,
+    }[frequency]
+    today = now.astimezone(tz).date()
+    for offset in range(63):
+        day = today + timedelta(days=offset)
+        if matches(day):
+            candidate = tz.localize(datetime(day.year, day.month, day.day, hour))
+            if candidate > now:
+                return candidate.astimezone(pytz.UTC)
+    raise ValueError(f"No run time found for {frequency}")
+
+
+class Job:
+    def __init__(self, name, func, schedule):
+        """
+        Args:
+            name: Unique job name (key in job_schedules/job_runs)
+            func: Callable run by the leader; may return a message for the run history
+            schedule: Callable (now) -> next aware run time, or None while disabled
+        """
+        self.name = name
+        self.func = func
+        self.schedule = schedule
+
+
+class JobRunner:
+    def __init__(self, connect, tick_seconds=15, lease_seconds=300):
+        """
+        Initialize the runner
+
+        Args:
+            connect: Callable returning a database connection (closed after use)
+            tick_seconds: How often each worker checks the lease and due jobs
+            lease_seconds: How long a silent leader keeps the lease (bounds failover
+                time; must exceed tick_seconds plus the longest job)
+        """
+        self.connect = connect
+        self.tick_seconds = tick_seconds
+        self.lease_seconds = lease_seconds
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self.jobs = {}
+        self._thread = None
+
+    def add(self, job):
+        self.jobs[job.name] = job
+
+    def start(self):
+        """Start the runner thread (once per process)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                logger.warning(f"Job runner error: {e}")
+            time.sleep(self.tick_seconds)
+
+    def tick(self, now=None):
+        """Take or renew the lease and run whatever is due. Returns the names of jobs run."""
+        now = now or datetime.now(pytz.UTC)
+        conn = self.connect()
+        try:
+            due = self._claim_due(conn, now)
+            for job in due:
+                self._run_job(conn, job)
+        finally:
+            conn.close()
+        return [job.name for job in due]
+
+    def _claim_due(self, conn, now):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cur = conn.execute("""
+                INSERT INTO job_leases (name, holder, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+                WHERE job_leases.holder = excluded.holder OR job_leases.expires_at < ?
+            """, (LEASE_NAME, self.holder, time.time() + self.lease_seconds, time.time()))
+            if cur.rowcount != 1:
+                conn.commit()
+                return []
+
+            due = []
+            stored = {row[0]: row[1] for row in conn.execute("SELECT name, next_run_at FROM job_schedules")}
+            for job in self.jobs.values():
+                next_run_at = stored.get(job.name)
+                if next_run_at is not None and next_run_at > _iso(now):
+                    continue
+                next_run = job.schedule(now)
+                if next_run is None:
+                    conn.execute("DELETE FROM job_schedules WHERE name = ?", (job.name,))
+                    continue
+                conn.execute("""
+                    INSERT INTO job_schedules (name, next_run_at) VALUES (?, ?)
+                    ON CONFLICT (name) DO UPDATE SET next_run_at = excluded.next_run_at
+                """, (job.name, _iso(next_run)))
+                if next_run_at is not None:
+                    due.append(job)
+            conn.commit()
+            return due
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _run_job(self, conn, job):
+        started_at = _iso(datetime.now(pytz.UTC))
+        run_id = conn.execute(
+            "INSERT INTO job_runs (job, holder, started_at, status) VALUES (?, ?, ?, 'running')",
+            (job.name, self.holder, started_at)
+        ).lastrowid
+        conn.execute("UPDATE job_schedules SET last_run_at = ? WHERE name = ?", (started_at, job.name))
+        conn.commit()
+
+        started = time.monotonic()
+        try:
+            message = job.func()
+            status = 'ok'
+        except Exception as e:
+            logger.error(f"Job {job.name} failed: {e}")
+            status, message = 'error', str(e)
+        conn.execute(
+            "UPDATE job_runs SET status = ?, duration_ms = ?, message = ? WHERE id = ?",
+            (status, int((time.monotonic() - started) * 1000), str(message) if message is not None else None, run_id)
+        )
+        conn.execute("DELETE FROM job_runs WHERE id <= ? - ?", (run_id, KEEP_RUNS))
+        conn.commit()
+
+    def reschedule(self, conn, name):
+        """Forget a job's stored run time so its schedule is re-evaluated on the next tick"""
+        conn.execute("DELETE FROM job_schedules WHERE name = ?", (name,))
+        conn.commit()
+
+    def status(self, conn, limit=20):
+        """Current leader, each job's schedule and the latest runs"""
+        lease = conn.execute("SELECT holder, expires_at FROM job_leases WHERE name = ?", (LEASE_NAME,)).fetchone()
+        return {
+            'leader': lease[0] if lease and lease[1] > time.time() else None,
+            'this_worker': self.holder,
+            'schedules': [dict(row) for row in conn.execute(
+                "SELECT name, next_run_at, last_run_at FROM job_schedules ORDER BY name")],
+            'runs': [dict(row) for row in conn.execute(
+                "SELECT job, holder, started_at, status, duration_ms, message FROM job_runs ORDER BY id DESC LIMIT ?",
+                (limit,))],
+        }
@@ -2,12 +2,14 @@
 """
 Label printing module for check-in system.
 Supports DYMO label printers with customizable label sizes.
+
+Run ``python label_printer.py --benchmark [count]`` to measure rendering throughput.
 """
 
-import random
-import sqlite3
-from datetime import datetime
-from typing import Optional, TYPE_CHECKING
+import sys
+import time
+from functools import lru_cache
+from typing import Iterable, List, Optional, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from PIL import Image
@@ -18,13 +20,6 @@ try:
 except ImportError:
     HAS_PIL = False
 
-try:
-    from brother_ql.brother_ql_create import convert
-    from brother_ql import BrotherQLRaster
-    HAS_BROTHER_QL = True
-except ImportError:
-    HAS_BROTHER_QL = False
-
 try:
     from dymoprinter import DymoLabeler
     HAS_DYMO = True
@@ -32,30 +27,121 @@ except ImportError:
     HAS_DYMO = False
 
 
-def generate_unique_code(event_id: int, db_path: str) -> str:
+# DYMO label stock offered in admin settings: code -> (width, height) in inches, printed landscape
+LABEL_SIZES = {
+    '30336': (2.125, 1.0),
+    '30330': (2.0, 0.75),
+    '11352': (2.75, 0.875),
+    '30334': (2.25, 1.25),
+    '30252': (3.5, 1.125),
+    '30323': (4.0, 2.125),
+}
+
+DEFAULT_LABEL_SIZE = '30336'
+
+FONT_REGULAR = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+FONT_BOLD = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+
+
+@lru_cache(maxsize=64)
+def load_font(path: str, size: int):
+    """Load a TrueType font once per (path, size), falling back to Pillow's built-in font"""
+    try:
+        return ImageFont.truetype(path, size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+
+class LabelRenderer:
     """
-    Generate a unique 5-digit code for this event.
-    Ensures no duplicate codes exist for active check-ins in this event.
+    Renders checkout labels as 1-bit images for one label size.
+
+    Fonts are loaded once and the layout is computed once, so rendering a
+    label is just drawing text onto a blank bitmap. Thermal label printers
+    only print black or white, so a 1-bit image is all they need (and is
+    24x smaller than RGB).
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    max_attempts = 100
-    for _ in range(max_attempts):
-        code = f"{random.randint(10000, 99999)}"
-        
-        # Check if code already exists for active check-ins in this event
-        cursor.execute("""
-            SELECT COUNT(*) FROM checkins 
-            WHERE event_id = ? AND checkout_code = ? AND checkout_time IS NULL
-        """, (event_id, code))
-        
-        if cursor.fetchone()[0] == 0:
-            conn.close()
-            return code
-    
-    conn.close()
-    raise Exception("Failed to generate unique checkout code after 100 attempts")
+
+    # Layout for a 1" tall label at 300 DPI; scaled to the label height
+    BASE_HEIGHT = 300
+
+    def __init__(self, width_inches: float = 2.0, height_inches: float = 1.0, dpi: int = 300):
+        if not HAS_PIL:
+            raise ImportError("PIL/Pillow is not installed. Install with: pip install Pillow")
+        self.size = (int(width_inches * dpi), int(height_inches * dpi))
+        scale = self.size[1] / self.BASE_HEIGHT
+        self.margin = int(15 * scale)
+        self.title_sizes = [int(size * scale) for size in (48, 40, 34, 28)]
+        self.body_font = load_font(FONT_REGULAR, int(32 * scale))
+        self.code_font = load_font(FONT_BOLD, int(72 * scale))
+        self.small_font = load_font(FONT_REGULAR, int(24 * scale))
+        self.lines_y = [int(y * scale) for y in (20, 80, 115, 160, 205)]
+        self._backgrounds = {}
+
+    @classmethod
+    def for_label_size(cls, label_size: str, dpi: int = 300) -> 'LabelRenderer':
+        """Renderer for a configured label_size setting (unknown sizes use the default)"""
+        width, height = LABEL_SIZES.get(label_size, LABEL_SIZES[DEFAULT_LABEL_SIZE])
+        return cls(width, height, dpi)
+
+    def _title_font(self, text: str):
+        # Largest title size that fits the label width
+        available = self.size[0] - 2 * self.margin
+        for size in self.title_sizes:
+            font = load_font(FONT_BOLD, size)
+            if font.getlength(text) <= available:
+                return font
+        return font
+
+    def _background(self, event_line: str, date_line: str) -> 'Image.Image':
+        # Text shared by every label of an event is drawn once and copied
+        key = (event_line, date_line)
+        background = self._backgrounds.get(key)
+        if background is None:
+            if len(self._backgrounds) >= 32:
+                self._backgrounds.clear()
+            background = Image.new('1', self.size, color=1)
+            draw = ImageDraw.Draw(background)
+            _, event_y, date_y, caption_y, _ = self.lines_y
+            draw.text((self.margin, event_y), event_line, fill=0, font=self.small_font)
+            draw.text((self.margin, date_y), date_line, fill=0, font=self.small_font)
+            draw.text((self.margin, caption_y), "Checkout Code:", fill=0, font=self.body_font)
+            self._backgrounds[key] = background
+        return background
+
+    def render(self, label: dict) -> 'Image.Image':
+        """
+        Render one label
+
+        Args:
+            label: Dict with kid_name, event_name, event_date, checkin_time and checkout_code
+
+        Returns:
+            1-bit PIL Image
+        """
+        # Event info (truncate if too long)
+        event_name = label['event_name']
+        event_display = event_name[:30] + "..." if len(event_name) > 30 else event_name
+        img = self._background(event_display, f"{label['event_date']} • {label['checkin_time']}").copy()
+
+        draw = ImageDraw.Draw(img)
+        title_y, _, _, _, code_y = self.lines_y
+        # Kid name (title)
+        kid_name = label['kid_name']
+        draw.text((self.margin, title_y), kid_name, fill=0, font=self._title_font(kid_name))
+        # Checkout code (prominently displayed) with extra spacing between digits for readability
+        draw.text((self.margin, code_y), " ".join(label['checkout_code']), fill=0, font=self.code_font)
+        return img
+
+    def render_batch(self, labels: Iterable[dict]) -> List['Image.Image']:
+        """Render many labels (a family, or a whole roster) with the same fonts and layout"""
+        return [self.render(label) for label in labels]
+
+
+@lru_cache(maxsize=None)
+def get_renderer(label_size: str = DEFAULT_LABEL_SIZE) -> LabelRenderer:
+    """Shared renderer for a label size"""
+    return LabelRenderer.for_label_size(label_size)
 
 
 def create_label_image(kid_name: str, event_name: str, event_date: str, 
@@ -74,55 +160,45 @@ def create_label_image(kid_name: str, event_name: str, event_date: str,
         height_inches: Label height in inches
     
     Returns:
-        PIL Image object
+        1-bit PIL Image object
     """
-    if not HAS_PIL:
-        raise ImportError("PIL/Pillow is not installed. Install with: pip install Pillow")
-    
-    # Convert inches to pixels (300 DPI)
-    dpi = 300
-    width = int(width_inches * dpi)
-    height = int(height_inches * dpi)
-    
-    # Create image
-    img = Image.new('RGB', (width, height), color='white')
-    draw = ImageDraw.Draw(img)
-    
-    # Try to use a better font, fall back to default if not available
-    try:
-        title_font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 48)
-        body_font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 32)
-        code_font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 72)
-        small_font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 24)
-    except:
-        title_font = ImageFont.load_default()
-        body_font = ImageFont.load_default()
-        code_font = ImageFont.load_default()
-        small_font = ImageFont.load_default()
-    
-    # Layout - more compact for 2"x1" label
-    y_pos = 20
-    
-    # Kid name (title)
-    draw.text((15, y_pos), kid_name, fill='black', font=title_font)
-    y_pos += 60
-    
-    # Event info (truncate if too long)
-    event_display = event_name[:30] + "..." if len(event_name) > 30 else event_name
-    draw.text((15, y_pos), event_display, fill='black', font=small_font)
-    y_pos += 35
-    draw.text((15, y_pos), f"{event_date} • {checkin_time}", fill='black', font=small_font)
-    y_pos += 45
-    
-    # Checkout code (prominently displayed)
-    draw.text((15, y_pos), "Checkout Code:", fill='black', font=body_font)
-    y_pos += 45
-    
-    # Draw the checkout code with extra spacing between digits for readability
-    code_display = " ".join(checkout_code)  # Add spaces between digits
-    draw.text((15, y_pos), code_display, fill='black', font=code_font)
-    
-    return img
+    renderer = LabelRenderer(width_inches, height_inches)
+    return renderer.render({
+        'kid_name': kid_name,
+        'event_name': event_name,
+        'event_date': event_date,
+        'checkin_time': checkin_time,
+        'checkout_code': checkout_code,
+    })
+
+
+def benchmark(count: int = 300, label_size: str = DEFAULT_LABEL_SIZE) -> dict:
+    """
+    Measure label rendering throughput
+
+    Args:
+        count: Number of labels to render (e.g. a camporee roster)
+        label_size: Label size to render
+
+    Returns:
+        Dict with labels, seconds and labels_per_second
+    """
+    labels = [{
+        'kid_name': f"Camper Number {i}",
+        'event_name': "Spring Camporee",
+        'event_date': "2025-04-12",
+        'checkin_time': "08:30 AM",
+        'checkout_code': f"{10000 + i}",
+    } for i in range(count)]
+    renderer = LabelRenderer.for_label_size(label_size)
+    start = time.perf_counter()
+    renderer.render_batch(labels)
+    seconds = time.perf_counter() - start
+    return {
+        'labels': count,
+        'seconds': round(seconds, 3),
+        'labels_per_second': round(count / seconds, 1) if seconds else float('inf'),
+    }
 
 
 def print_label_dymo(img: 'Image.Image', printer_name: Optional[str] = None) -> bool:
@@ -155,7 +231,8 @@ def print_label_dymo(img: 'Image.Image', printer_name: Optional[str] = None) ->
 def print_checkout_label(kid_name: str, event_name: str, event_date: str,
                         checkin_time: str, checkout_code: str,
                         printer_type: str = 'dymo',
-                        width: float = 2.0, height: float = 1.0) -> bool:
+                        width: float = 2.0, height: float = 1.0,
+                        debug_path: Optional[str] = None) -> bool:
     """
     Main function to print a checkout label.
     
@@ -168,6 +245,7 @@ def print_checkout_label(kid_name: str, event_name: str, event_date: str,
         printer_type: Type of printer ('dymo', 'brother', etc.)
         width: Label width in inches
         height: Label height in inches
+        debug_path: Also save the label image here (off by default)
     
     Returns:
         True if printing successful, False otherwise
@@ -178,13 +256,12 @@ def print_checkout_label(kid_name: str, event_name: str, event_date: str,
     img = create_label_image(kid_name, event_name, event_date, checkin_time, 
                             checkout_code, width, height)
     
-    # Save a copy for debugging
-    try:
-        label_path = f'/tmp/label_{checkout_code}.png'
-        img.save(label_path)
-        print(f"Label image saved to: {label_path}")
-    except Exception as e:
-        print(f"Could not save label image: {e}")
+    if debug_path:
+        try:
+            img.save(debug_path)
+            print(f"Label image saved to: {debug_path}")
+        except Exception as e:
+            print(f"Could not save label image: {e}")
     
     # Print based on printer type
     if printer_type.lower() == 'dymo':
@@ -196,6 +273,13 @@ def print_checkout_label(kid_name: str, event_name: str, event_date: str,
 
 # For testing
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--benchmark':
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+        for size in LABEL_SIZES:
+            result = benchmark(count, size)
+            print(f"{size}: {result['labels']} labels in {result['seconds']}s ({result['labels_per_second']}/s)")
+        sys.exit(0)
+
     # Test label generation
     img = create_label_image(
         kid_name="John Smith",
@@ -0,0 +1,153 @@
+"""
+Durable work queues kept in an SQLite table, shared by the print queue
+(print_queue.py) and the background task queue (task_queue.py).
+
+A queue table has at least ``id``, ``status``, ``attempts``, ``max_attempts``,
+``last_error``, ``next_attempt_at``, ``lease_expires_at`` and ``updated_at``.
+Worker threads in each app process claim the oldest due row under BEGIN
+IMMEDIATE and hold a lease on it while it runs; a row claimed by a worker
+that died is picked up again once its lease expires. Failures are retried
+with exponential backoff up to ``max_attempts``.
+"""
+
+import logging
+import threading
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+
+def now_iso():
+    return datetime.utcnow().isoformat()
+
+
+def claim_next(conn, table, running_status, lease_seconds):
+    """Claim the next due row of table (or one whose lease has expired). Returns the row or None."""
+    now = now_iso()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        item = conn.execute(f"""
+            SELECT * FROM {table}
+            WHERE (status = 'queued' AND next_attempt_at <= ?)
+               OR (status = ? AND lease_expires_at < ?)
+            ORDER BY id LIMIT 1
+        """, (now, running_status, now)).fetchone()
+        if item is not None:
+            lease = (datetime.utcnow() + timedelta(seconds=lease_seconds)).isoformat()
+            conn.execute(f"""
+                UPDATE {table} SET status = ?, attempts = attempts + 1,
+                       lease_expires_at = ?, updated_at = ?
+                WHERE id = ?
+            """, (running_status, lease, now, item['id']))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return item
+
+
+class LeaseQueue:
+    """
+    Worker threads for one queue table. Subclasses set the class attributes
+    and implement ``execute``.
+    """
+
+    table = None
+    # Status of a claimed row
+    running_status = 'running'
+    # How long a claimed row may take before another worker may retry it
+    lease_seconds = 300
+    # First retry delay; doubles with each attempt
+    retry_base_seconds = 2
+
+    def __init__(self, connect, poll_interval=5, threads=1):
+        """
+        Initialize the queue
+
+        Args:
+            connect: Callable returning a database connection (closed after use)
+            poll_interval: Seconds between checks for rows queued by other processes
+            threads: Worker threads per process
+        """
+        self.connect = connect
+        self.poll_interval = poll_interval
+        self.threads = threads
+        self._wake = threading.Event()
+        self._workers = []
+
+    def execute(self, item):
+        """Do the work for a claimed row; returns a result for ``finished_columns`` or raises"""
+        raise NotImplementedError
+
+    def is_permanent(self, error):
+        """Whether a failure should not be retried"""
+        return False
+
+    def finished_columns(self, result):
+        """Extra columns to set once a row is done (result) or has failed for good (None)"""
+        return {}
+
+    def describe(self, item):
+        """How log messages refer to a row"""
+        return f"{self.table} row {item['id']}"
+
+    def start(self):
+        """Start the worker threads (once per process)"""
+        if not self._workers:
+            for _ in range(self.threads):
+                worker = threading.Thread(target=self._run, daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def notify(self):
+        """Wake a worker after queueing a row"""
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                self.run_pending()
+            except Exception as e:
+                logger.warning(f"{self.table} queue error: {e}")
+
+    def run_pending(self):
+        """Process every due row. Returns the number attempted."""
+        attempted = 0
+        while True:
+            conn = self.connect()
+            try:
+                item = claim_next(conn, self.table, self.running_status, self.lease_seconds)
+                if item is None:
+                    return attempted
+                attempted += 1
+                self._process(conn, item)
+            finally:
+                conn.close()
+
+    def _update(self, conn, item_id, **columns):
+        columns['updated_at'] = now_iso()
+        conn.execute(
+            f"UPDATE {self.table} SET {', '.join(f'{column} = ?' for column in columns)} WHERE id = ?",
+            list(columns.values()) + [item_id]
+        )
+
+    def _process(self, conn, item):
+        try:
+            result = self.execute(item)
+        except Exception as e:
+            attempts = item['attempts'] + 1
+            if self.is_permanent(e) or attempts >= item['max_attempts']:
+                logger.error(f"{self.describe(item)} failed after {attempts} attempt(s): {e}")
+                self._update(conn, item['id'], status='failed', last_error=str(e), lease_expires_at=None,
+                             **self.finished_columns(None))
+            else:
+                next_attempt = datetime.utcnow() + timedelta(seconds=self.retry_base_seconds * 2 ** (attempts - 1))
+                logger.warning(f"{self.describe(item)} attempt {attempts} failed, retrying: {e}")
+                self._update(conn, item['id'], status='queued', last_error=str(e),
+                             next_attempt_at=next_attempt.isoformat(), lease_expires_at=None)
+        else:
+            self._update(conn, item['id'], status='done', last_error=None, lease_expires_at=None,
+                         **self.finished_columns(result))
+        conn.commit()
@@ -0,0 +1,281 @@
+"""
+Per-worker live roster of open check-ins for each event.
+
+The index and kiosk pages show everyone currently checked in to an event.
+Rather than re-running the roster join (and re-formatting every check-in time)
+on every render, each worker keeps the roster in memory and applies only what
+changed since it last looked.
+
+Changes are recorded by triggers in ``roster_changes``: any check-in, checkout
+or deletion of a check-in, and any edit to a checked-in kid, their family or
+the adult who dropped them off, appends one row keyed by event. Because the
+log lives in the database it is shared by all gunicorn workers (and by the
+kiosk change feed), whichever process handled the write.
+"""
+
+import bisect
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS roster_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_id INTEGER NOT NULL,
+    checkin_id INTEGER NOT NULL,
+    change TEXT NOT NULL,  -- 'upsert' (check-in or edited details) or 'remove' (checked out/deleted)
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_roster_changes_event_seq ON roster_changes(event_id, seq);
+
+CREATE TRIGGER IF NOT EXISTS roster_checkins_insert AFTER INSERT ON checkins
+WHEN NEW.checkout_time IS NULL
+BEGIN
+    INSERT INTO roster_changes (event_id, checkin_id, change) VALUES (NEW.event_id, NEW.id, 'upsert');
+END;
+
+CREATE TRIGGER IF NOT EXISTS roster_checkins_update AFTER UPDATE OF checkout_time, event_id ON checkins
+BEGIN
+    INSERT INTO roster_changes (event_id, checkin_id, change)
+    VALUES (OLD.event_id, OLD.id, 'remove');
+    INSERT INTO roster_changes (event_id, checkin_id, change)
+    SELECT NEW.event_id, NEW.id, 'upsert' WHERE NEW.checkout_time IS NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS roster_checkins_delete AFTER DELETE ON checkins
+WHEN OLD.checkout_time IS NULL
+BEGIN
+    INSERT INTO roster_changes (event_id, checkin_id, change) VALUES (OLD.event_id, OLD.id, 'remove');
+END;
+
+CREATE TRIGGER IF NOT EXISTS roster_kids_update AFTER UPDATE OF name, notes ON kids
+BEGIN
+    INSERT INTO roster_changes (event_id, checkin_id, change)
+    SELECT c.event_id, c.id, 'upsert' FROM checkins c
+    WHERE c.kid_id = NEW.id AND c.checkout_time IS NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS roster_kids_delete AFTER DELETE ON kids
+BEGIN
+    INSERT INTO roster_changes (event_id, checkin_id, change)
+    SELECT c.event_id, c.id, 'remove' FROM checkins c
+    WHERE c.kid_id = OLD.id AND c.checkout_time IS NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS roster_families_update AFTER UPDATE OF phone, troop, authorized_adults ON families
+BEGIN
+    INSERT INTO roster_changes (event_id, checkin_id, change)
+    SELECT c.event_id, c.id, 'upsert' FROM kids k JOIN checkins c ON c.kid_id = k.id
+    WHERE k.family_id = NEW.id AND c.checkout_time IS NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS roster_adults_update AFTER UPDATE OF name ON adults
+BEGIN
+    INSERT INTO roster_changes (event_id, checkin_id, change)
+    SELECT c.event_id, c.id, 'upsert' FROM checkins c
+    WHERE c.adult_id = NEW.id AND c.checkout_time IS NULL;
+END;
+"""
+
+ROSTER_QUERY = """
+    SELECT c.id, k.id as kid_id, c.checkin_time, c.checkout_time, k.name as kid_name, k.notes as kid_notes,
+           f.authorized_adults, f.phone, f.troop, a.name as adult_name
+    FROM checkins c
+    JOIN kids k ON c.kid_id = k.id
+    JOIN families f ON k.family_id = f.id
+    JOIN adults a ON c.adult_id = a.id
+    WHERE c.checkout_time IS NULL
+"""
+
+# One event's open check-ins
+EVENT_ROSTER_QUERY = ROSTER_QUERY + " AND c.event_id = ?"
+
+
+def sort_key(entry):
+    """Last name, then full name (case-insensitive), newest check-in first"""
+    name = entry['kid_name'] or ''
+    last_name = name[name.find(' ') + 1:]
+    return (last_name.lower(), name.lower(), -entry['id'])
+
+
+def latest_seq(conn, event_id):
+    """Return the newest change sequence number for an event (0 if none)"""
+    row = conn.execute(
+        "SELECT COALESCE(MAX(seq), 0) FROM roster_changes WHERE event_id = ?", (event_id,)
+    ).fetchone()
+    return row[0]
+
+
+def changes_since(conn, event_id, seq):
+    """Return (seq, checkin_id, change) rows logged for an event after seq"""
+    return conn.execute(
+        "SELECT seq, checkin_id, change FROM roster_changes WHERE event_id = ? AND seq > ? ORDER BY seq",
+        (event_id, seq)
+    ).fetchall()
+
+
+class LiveRoster:
+    """Open check-ins for one event, kept sorted for display"""
+
+    def __init__(self, event_id, format_time):
+        self.event_id = event_id
+        self.format_time = format_time
+        self.seq = 0
+        self.built_at = 0
+        self._keys = []
+        self._entries = []
+        self._by_id = {}
+
+    def _entry(self, row):
+        entry = dict(row)
+        entry['formatted_time'] = self.format_time(entry['checkin_time'])
+        return entry
+
+    @staticmethod
+    def _remove(keys, entries, by_id, checkin_id):
+        entry = by_id.pop(checkin_id, None)
+        if entry is not None:
+            i = bisect.bisect_left(keys, sort_key(entry))
+            del keys[i]
+            del entries[i]
+
+    @staticmethod
+    def _insert(keys, entries, by_id, entry):
+        key = sort_key(entry)
+        i = bisect.bisect_left(keys, key)
+        keys.insert(i, key)
+        entries.insert(i, entry)
+        by_id[entry['id']] = entry
+
+    def rebuild(self, conn):
+        """Load the full roster (read the change marker first so nothing is missed)"""
+        seq = latest_seq(conn, self.event_id)
+        entries = [self._entry(row) for row in conn.execute(EVENT_ROSTER_QUERY, (self.event_id,))]
+        entries.sort(key=sort_key)
+        self._keys = [sort_key(e) for e in entries]
+        self._entries = entries
+        self._by_id = {e['id']: e for e in entries}
+        self.seq = seq
+        self.built_at = time.monotonic()
+
+    def apply_changes(self, conn):
+        """Apply logged changes since the last refresh. Returns the number applied."""
+        changes = changes_since(conn, self.event_id, self.seq)
+        if not changes:
+            return 0
+
+        # Only the last change per check-in matters
+        final = {}
+        for row in changes:
+            final[row['checkin_id']] = row['change']
+
+        # Edit copies and swap them in: lists already handed out by entries()
+        # may still be read by other request threads
+        keys = list(self._keys)
+        entries = list(self._entries)
+        by_id = dict(self._by_id)
+        for checkin_id in final:
+            self._remove(keys, entries, by_id, checkin_id)
+
+        upserts = [cid for cid, change in final.items() if change == 'upsert']
+        if upserts:
+            placeholders = ','.join('?' * len(upserts))
+            rows = conn.execute(
+                EVENT_ROSTER_QUERY + f" AND c.id IN ({placeholders})",
+                [self.event_id] + upserts
+            ).fetchall()
+            for row in rows:
+                self._insert(keys, entries, by_id, self._entry(row))
+        self._keys = keys
+        self._entries = entries
+        self._by_id = by_id
+        self.seq = changes[-1]['seq']
+        return len(changes)
+
+    def entries(self):
+        """Sorted list of check-in dicts. Never changed once returned (shared between requests) - do not mutate."""
+        return self._entries
+
+
+class RosterCache:
+    def __init__(self, format_time, max_age=3600):
+        """
+        Initialize the cache
+
+        Args:
+            format_time: Callable turning a stored checkin_time into display text
+            max_age: Seconds before a roster is rebuilt from scratch (bounds how
+                long the change log must be kept)
+        """
+        self.format_time = format_time
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._rosters = {}  # (db key, event id) -> LiveRoster
+        self.rebuilds = 0
+
+    def roster(self, conn, db_key, event_id):
+        """
+        Return the open check-ins for an event, sorted for display
+
+        Args:
+            conn: Open database connection
+            db_key: Identifies the database (its path) so tests/demo DBs don't mix
+            event_id: Event to list
+
+        Returns:
+            List of check-in dicts (with 'formatted_time'). Callers must not mutate it.
+        """
+        event_id = int(event_id)
+        with self._lock:
+            roster = self._rosters.get((db_key, event_id))
+            if roster is None or time.monotonic() - roster.built_at > self.max_age:
+                roster = LiveRoster(event_id, self.format_time)
+                roster.rebuild(conn)
+                self._rosters[(db_key, event_id)] = roster
+                self.rebuilds += 1
+            else:
+                roster.apply_changes(conn)
+            return roster.entries()
+
+    def deltas(self, conn, db_key, event_id, since):
+        """
+        Describe how an event's roster changed after a change sequence number
+
+        Args:
+            conn: Open database connection
+            db_key: Identifies the database (its path)
+            event_id: Event to follow
+            since: Last sequence number the client has seen
+
+        Returns:
+            (seq, changes) - the sequence number to resume from, and a list of
+            dicts with 'op' ('upsert' or 'remove'), 'checkin_id' and, for
+            upserts, the current 'entry' and its 'position' in the sorted roster
+        """
+        changes = changes_since(conn, event_id, since)
+        if not changes:
+            return since, []
+
+        entries = self.roster(conn, db_key, event_id)
+        positions = {entry['id']: i for i, entry in enumerate(entries)}
+        deltas = []
+        for checkin_id in dict.fromkeys(row['checkin_id'] for row in changes):
+            if checkin_id in positions:
+                position = positions[checkin_id]
+                deltas.append({'op': 'upsert', 'checkin_id': checkin_id,
+                               'entry': entries[position], 'position': position})
+            else:
+                deltas.append({'op': 'remove', 'checkin_id': checkin_id})
+        return changes[-1]['seq'], deltas
+
+    def clear(self):
+        """Drop every roster (e.g. after a database restore)"""
+        with self._lock:
+            self._rosters.clear()
+
+
+def prune_changes(conn, keep='-1 day'):
+    """Delete change log rows older than keep (an SQLite datetime modifier)"""
+    cur = conn.execute("DELETE FROM roster_changes WHERE created_at < datetime('now', ?)", (keep,))
+    conn.commit()
+    return cur.rowcount
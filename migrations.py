@@ -0,0 +1,341 @@
+"""
+Numbered schema migrations for Youth Secure Check-in.
+
+schema.sql describes a fresh database. Databases created by older releases
+are brought up to date by the steps below, applied in order and recorded in
+the ``schema_version`` table so each one runs exactly once per database.
+
+Every step is idempotent (columns are only added when missing, tables and
+indexes use IF NOT EXISTS), so a fresh database built from schema.sql can run
+the full list safely. To change the schema, update schema.sql AND append a new
+step here - never edit a step that has already shipped.
+"""
+
+import sqlite3
+import logging
+from datetime import datetime
+
+from settings_cache import SCHEMA as SETTINGS_VERSION_SCHEMA
+from phone_search import search_key
+from live_roster import SCHEMA as ROSTER_CHANGES_SCHEMA
+from checkout_codes import SCHEMA as CHECKOUT_CODE_POOL_SCHEMA, SEQUENTIAL_POOL_DROP
+from print_queue import SCHEMA as PRINT_JOBS_SCHEMA
+from ical_sync import SCHEMA as ICAL_SYNC_RUNS_SCHEMA, UID_SCHEMA as EVENT_UID_SCHEMA
+from job_runner import SCHEMA as JOB_RUNNER_SCHEMA
+from share_tokens import SCHEMA as SHARE_TOKEN_CHECKINS_SCHEMA, VERSION_SCHEMA as SHARE_TOKEN_VERSION_SCHEMA, parse_checkin_ids
+from task_queue import SCHEMA as TASK_QUEUE_SCHEMA
+from tlc_logins import SCHEMA as TLC_LOGINS_SCHEMA
+
+logger = logging.getLogger(__name__)
+
+
+def column_exists(conn, table, column):
+    """Check if a table has a column"""
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table})"))
+
+
+def add_column(conn, table, column, declaration):
+    """Add a column unless it already exists"""
+    if not column_exists(conn, table, column):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+        logger.info(f"Added {column} column to {table} table")
+
+
+def execute_script(conn, script):
+    """
+    Run a multi-statement SQL script inside the current transaction
+
+    Unlike sqlite3's executescript() this does not COMMIT first, so a
+    migration step stays atomic. Trigger bodies (BEGIN ... END) are kept whole.
+    """
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ''
+    if statement.strip():
+        conn.execute(statement)
+
+
+def _add_runtime_columns(conn):
+    # Columns older releases added on the fly (ensure_*_column helpers and name hash backfill)
+    add_column(conn, 'adults', 'phone', 'TEXT')
+    add_column(conn, 'adults', 'name_hash', 'TEXT')
+    add_column(conn, 'adults', 'name_token_hashes', 'TEXT')
+    add_column(conn, 'kids', 'name_hash', 'TEXT')
+    add_column(conn, 'kids', 'name_token_hashes', 'TEXT')
+    add_column(conn, 'kids', 'tlc_id', 'TEXT')
+    add_column(conn, 'checkins', 'tlc_synced', 'BOOLEAN DEFAULT 0')
+
+
+def _add_login_tracking_tables(conn):
+    execute_script(conn, """
+        CREATE TABLE IF NOT EXISTS login_attempts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ip_address TEXT NOT NULL,
+            attempt_time TEXT NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_login_attempts_ip_time ON login_attempts(ip_address, attempt_time);
+
+        CREATE TABLE IF NOT EXISTS login_lockout (
+            ip_address TEXT PRIMARY KEY,
+            locked_until TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_login_lockout_ip ON login_lockout(ip_address);
+    """)
+
+
+def _add_settings_version(conn):
+    execute_script(conn, SETTINGS_VERSION_SCHEMA)
+
+
+def _add_hot_path_indexes(conn):
+    execute_script(conn, """
+        -- Live roster (index/kiosk), phone-code checkout and per-event counts
+        CREATE INDEX IF NOT EXISTS idx_checkins_event_open ON checkins(event_id, checkout_time);
+        -- "Is this kid already checked in?" and per-kid checkout/TLC sync updates
+        CREATE INDEX IF NOT EXISTS idx_checkins_kid_event ON checkins(kid_id, event_id, checkout_time);
+        -- Checkout code lookups in random-codes mode
+        CREATE INDEX IF NOT EXISTS idx_checkins_checkout_code ON checkins(checkout_code, checkout_time);
+        -- History ordering and date filters, TLC attendance by date
+        CREATE INDEX IF NOT EXISTS idx_checkins_checkin_time ON checkins(checkin_time);
+        CREATE INDEX IF NOT EXISTS idx_kids_family ON kids(family_id);
+        CREATE INDEX IF NOT EXISTS idx_adults_family ON adults(family_id);
+        CREATE INDEX IF NOT EXISTS idx_kids_name_hash ON kids(name_hash);
+        CREATE INDEX IF NOT EXISTS idx_adults_name_hash ON adults(name_hash);
+        -- TLC roster import matches members by name
+        CREATE INDEX IF NOT EXISTS idx_kids_name_nocase ON kids(name COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS idx_adults_name_nocase ON adults(name COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS idx_families_phone ON families(phone);
+        CREATE INDEX IF NOT EXISTS idx_events_start_time ON events(start_time);
+        CREATE INDEX IF NOT EXISTS idx_share_tokens_used ON share_tokens(used);
+    """)
+
+
+def _add_phone_search_keys(conn):
+    for table in ('families', 'adults'):
+        add_column(conn, table, 'phone_digits_rev', 'TEXT')
+        rows = conn.execute(f"SELECT id, phone FROM {table} WHERE phone IS NOT NULL").fetchall()
+        conn.executemany(
+            f"UPDATE {table} SET phone_digits_rev = ? WHERE id = ?",
+            [(search_key(row[1]), row[0]) for row in rows]
+        )
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_phone_digits_rev ON {table}(phone_digits_rev)")
+
+
+def _add_name_tokens(conn):
+    # Inverted index of name token hashes, kept in sync from name_token_hashes by triggers
+    execute_script(conn, """
+        CREATE TABLE IF NOT EXISTS name_tokens (
+            token_hash TEXT NOT NULL,
+            person_kind TEXT NOT NULL,  -- 'kid' or 'adult'
+            person_id INTEGER NOT NULL,
+            family_id INTEGER NOT NULL,
+            PRIMARY KEY (token_hash, person_kind, person_id)
+        ) WITHOUT ROWID;
+
+        CREATE INDEX IF NOT EXISTS idx_name_tokens_person ON name_tokens(person_kind, person_id);
+
+        CREATE TRIGGER IF NOT EXISTS name_tokens_kids_insert AFTER INSERT ON kids
+        BEGIN
+            INSERT OR IGNORE INTO name_tokens (token_hash, person_kind, person_id, family_id)
+            SELECT value, 'kid', NEW.id, NEW.family_id
+            FROM json_each(CASE WHEN json_valid(NEW.name_token_hashes) THEN NEW.name_token_hashes ELSE '[]' END);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS name_tokens_kids_update AFTER UPDATE OF name_token_hashes, family_id ON kids
+        BEGIN
+            DELETE FROM name_tokens WHERE person_kind = 'kid' AND person_id = OLD.id;
+            INSERT OR IGNORE INTO name_tokens (token_hash, person_kind, person_id, family_id)
+            SELECT value, 'kid', NEW.id, NEW.family_id
+            FROM json_each(CASE WHEN json_valid(NEW.name_token_hashes) THEN NEW.name_token_hashes ELSE '[]' END);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS name_tokens_kids_delete AFTER DELETE ON kids
+        BEGIN
+            DELETE FROM name_tokens WHERE person_kind = 'kid' AND person_id = OLD.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS name_tokens_adults_insert AFTER INSERT ON adults
+        BEGIN
+            INSERT OR IGNORE INTO name_tokens (token_hash, person_kind, person_id, family_id)
+            SELECT value, 'adult', NEW.id, NEW.family_id
+            FROM json_each(CASE WHEN json_valid(NEW.name_token_hashes) THEN NEW.name_token_hashes ELSE '[]' END);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS name_tokens_adults_update AFTER UPDATE OF name_token_hashes, family_id ON adults
+        BEGIN
+            DELETE FROM name_tokens WHERE person_kind = 'adult' AND person_id = OLD.id;
+            INSERT OR IGNORE INTO name_tokens (token_hash, person_kind, person_id, family_id)
+            SELECT value, 'adult', NEW.id, NEW.family_id
+            FROM json_each(CASE WHEN json_valid(NEW.name_token_hashes) THEN NEW.name_token_hashes ELSE '[]' END);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS name_tokens_adults_delete AFTER DELETE ON adults
+        BEGIN
+            DELETE FROM name_tokens WHERE person_kind = 'adult' AND person_id = OLD.id;
+        END;
+    """)
+    for kind, table in (('kid', 'kids'), ('adult', 'adults')):
+        conn.execute(f"""
+            INSERT OR IGNORE INTO name_tokens (token_hash, person_kind, person_id, family_id)
+            SELECT t.value, '{kind}', p.id, p.family_id
+            FROM {table} p, json_each(CASE WHEN json_valid(p.name_token_hashes) THEN p.name_token_hashes ELSE '[]' END) t
+        """)
+
+
+def _add_roster_changes(conn):
+    execute_script(conn, ROSTER_CHANGES_SCHEMA)
+
+
+def _add_checkout_code_pool(conn):
+    execute_script(conn, CHECKOUT_CODE_POOL_SCHEMA)
+
+
+def _add_share_token_checkins(conn):
+    execute_script(conn, SHARE_TOKEN_CHECKINS_SCHEMA)
+    rows = conn.execute("SELECT id, checkin_ids FROM share_tokens").fetchall()
+    conn.executemany(
+        "INSERT OR IGNORE INTO share_token_checkins (token_id, checkin_id) VALUES (?, ?)",
+        [(row[0], checkin_id) for row in rows for checkin_id in parse_checkin_ids(row[1])]
+    )
+
+
+def _add_share_token_versions(conn):
+    add_column(conn, 'share_tokens', 'version', 'INTEGER NOT NULL DEFAULT 0')
+    execute_script(conn, SHARE_TOKEN_VERSION_SCHEMA)
+
+
+def _add_print_jobs(conn):
+    execute_script(conn, PRINT_JOBS_SCHEMA)
+
+
+def _add_history_index(conn):
+    execute_script(conn, """
+        -- History filtered by event, newest first (keyset pagination on checkin_time, id)
+        CREATE INDEX IF NOT EXISTS idx_checkins_event_time ON checkins(event_id, checkin_time);
+    """)
+
+
+def _add_ical_sync_runs(conn):
+    execute_script(conn, ICAL_SYNC_RUNS_SCHEMA)
+
+
+def _add_event_uids(conn):
+    add_column(conn, 'events', 'ical_uid', 'TEXT')
+    add_column(conn, 'events', 'ical_recurrence_id', 'TEXT')
+    execute_script(conn, EVENT_UID_SCHEMA)
+
+
+def _add_job_runner(conn):
+    execute_script(conn, JOB_RUNNER_SCHEMA)
+
+
+def _add_task_queue(conn):
+    execute_script(conn, TASK_QUEUE_SCHEMA)
+
+
+def _add_task_progress(conn):
+    add_column(conn, 'tasks', 'progress', 'TEXT')
+
+
+def _random_checkout_codes(conn):
+    # Databases built before this step still have the sequential pool and its free list
+    if column_exists(conn, 'checkout_code_pools', 'multiplier'):
+        execute_script(conn, SEQUENTIAL_POOL_DROP)
+    execute_script(conn, CHECKOUT_CODE_POOL_SCHEMA)
+
+
+def _add_ical_sync_window(conn):
+    add_column(conn, 'ical_sync_runs', 'window_start', 'TEXT')
+    add_column(conn, 'ical_sync_runs', 'window_end', 'TEXT')
+
+
+def _add_tlc_logins(conn):
+    execute_script(conn, TLC_LOGINS_SCHEMA)
+
+
+def _shuffled_checkout_code_pool(conn):
+    # Step 18 left only a count of issued codes; replace it with the shuffled pool.
+    # Codes held by open check-ins are skipped when drawn (see allocate_code).
+    if column_exists(conn, 'checkout_code_pools', 'issued') and not column_exists(conn, 'checkout_code_pools', 'free_count'):
+        execute_script(conn, """
+            DROP TRIGGER IF EXISTS checkout_codes_event_delete;
+            DROP TABLE checkout_code_pools;
+        """)
+    execute_script(conn, CHECKOUT_CODE_POOL_SCHEMA)
+
+
+# (version, description, step) - append only
+MIGRATIONS = [
+    (1, 'Add columns previously created at runtime', _add_runtime_columns),
+    (2, 'Add login tracking tables', _add_login_tracking_tables),
+    (3, 'Add settings generation counter', _add_settings_version),
+    (4, 'Add hot-path indexes', _add_hot_path_indexes),
+    (5, 'Add indexed reversed phone digits for suffix lookups', _add_phone_search_keys),
+    (6, 'Add name_tokens inverted index for name search', _add_name_tokens),
+    (7, 'Add roster change log for live rosters', _add_roster_changes),
+    (8, 'Add per-event checkout code pool', _add_checkout_code_pool),
+    (9, 'Add share token check-in join table', _add_share_token_checkins),
+    (10, 'Add share token expiry index and payload versions', _add_share_token_versions),
+    (11, 'Add server-side print job queue', _add_print_jobs),
+    (12, 'Add per-event check-in time index for history', _add_history_index),
+    (13, 'Add iCal sync run log', _add_ical_sync_runs),
+    (14, 'Key iCal events by UID and recurrence id', _add_event_uids),
+    (15, 'Add job runner lease, schedules and run history', _add_job_runner),
+    (16, 'Add background task queue', _add_task_queue),
+    (17, 'Add task progress', _add_task_progress),
+    (18, 'Draw checkout codes at random instead of from a sequence', _random_checkout_codes),
+    (19, 'Record the iCal expansion window with each sync run', _add_ical_sync_window),
+    (20, 'Store TLC logins for background tasks outside the task payload', _add_tlc_logins),
+    (21, 'Allocate checkout codes from a persisted shuffled pool', _shuffled_checkout_code_pool),
+]
+
+
+def current_version(conn):
+    """Return the highest applied migration version (0 for an unversioned database)"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    """)
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def apply_migrations(conn, migrations=None):
+    """
+    Apply pending migrations in order, each in its own transaction
+
+    Args:
+        conn: Open database connection (not inside a transaction)
+        migrations: Override the migration list (used by tests)
+
+    Returns:
+        List of versions applied by this call
+    """
+    migrations = MIGRATIONS if migrations is None else migrations
+    applied = []
+    for version, description, step in migrations:
+        # BEGIN IMMEDIATE serializes concurrent runners; re-check the version once we hold the lock
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if current_version(conn) >= version:
+                conn.rollback()
+                continue
+            step(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, datetime.utcnow().isoformat())
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+        logger.info(f"Applied migration {version}: {description}")
+    return applied
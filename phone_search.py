@@ -0,0 +1,30 @@
+"""
+Indexed phone-suffix lookups.
+
+Families are found at the kiosk by the last digits of a phone number, and in
+phone-codes mode those digits are also the checkout code. A ``LIKE '%1234'``
+over formatted phone numbers cannot use an index, so every phone column has a
+companion ``phone_digits_rev`` column holding its digits reversed:
+"(555) 010-1234" is stored as "43210105555". An "ends with 1234" match
+becomes a prefix range on the reversed value (>= "4321" and < "4321:"),
+which SQLite answers from an index.
+
+Writers must keep the column in sync with ``search_key()``.
+"""
+
+
+def search_key(phone):
+    """Return the reversed digits of a phone number (None if it has no digits)"""
+    digits = ''.join(c for c in (phone or '') if c.isdigit())
+    return digits[::-1] or None
+
+
+def suffix_range(digits):
+    """
+    Return (low, high) bounds on phone_digits_rev for phones ending in digits
+
+    Use as ``phone_digits_rev >= low AND phone_digits_rev < high``.
+    ':' sorts right after '9', so high is the first key past every match.
+    """
+    key = search_key(digits) or ''
+    return key, key + ':'
@@ -0,0 +1,160 @@
+"""
+Server-side label print queue.
+
+In server print mode check-in doesn't wait for a printer or for the kiosk
+tablet: checkin_selected stores a job in ``print_jobs`` and returns at once.
+A worker thread in each app process claims jobs, renders their labels
+(label_printer.LabelRenderer) and sends them to the configured backend:
+
+- ``brother_ql``: Brother QL raster instructions, written to a device file
+  (e.g. /dev/usb/lp0) or a network printer (tcp://host:9100)
+- ``file``: one PNG per label in a directory, for testing without hardware
+
+Claiming, leases and retries with backoff are shared with the task queue
+(lease_queue.LeaseQueue); printing keeps its own table and worker thread so
+labels never wait behind slow email or TLC tasks.
+"""
+
+import json
+import os
+import socket
+
+from lease_queue import LeaseQueue, now_iso
+
+try:
+    from brother_ql.conversion import convert as brother_ql_convert
+    from brother_ql.raster import BrotherQLRaster
+    HAS_BROTHER_QL = True
+except ImportError:
+    HAS_BROTHER_QL = False
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS print_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    status TEXT NOT NULL DEFAULT 'queued',  -- queued, printing, done, failed
+    label_size TEXT NOT NULL,
+    labels TEXT NOT NULL,  -- JSON list of label dicts
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    last_error TEXT,
+    next_attempt_at TEXT NOT NULL,
+    lease_expires_at TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_print_jobs_status_next ON print_jobs(status, next_attempt_at);
+"""
+
+
+class FileBackend:
+    """Writes each label as a PNG into a directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def send(self, job_id, images):
+        os.makedirs(self.directory, exist_ok=True)
+        for i, img in enumerate(images):
+            img.save(os.path.join(self.directory, f"job_{job_id}_{i + 1}.png"))
+
+
+class BrotherQLBackend:
+    """Sends Brother QL raster instructions to a device file or tcp://host:port"""
+
+    def __init__(self, device, model='QL-800', label='62'):
+        if not HAS_BROTHER_QL:
+            raise ImportError("brother_ql is not installed. Install with: pip install brother_ql")
+        self.device = device
+        self.model = model
+        self.label = label
+
+    def encode(self, images):
+        """Convert label images into one raster instruction stream"""
+        qlr = BrotherQLRaster(self.model)
+        qlr.exception_on_warning = True
+        return brother_ql_convert(qlr=qlr, images=images, label=self.label,
+                                  rotate='auto', threshold=70.0, dither=False,
+                                  compress=True, red=False, dpi_600=False, hq=True, cut=True)
+
+    def send(self, job_id, images):
+        data = self.encode(images)
+        if self.device.startswith('tcp://'):
+            host, _, port = self.device[len('tcp://'):].partition(':')
+            with socket.create_connection((host, int(port or 9100)), timeout=10) as sock:
+                sock.sendall(data)
+        else:
+            with open(self.device, 'wb') as device:
+                device.write(data)
+
+
+def make_backend(settings):
+    """
+    Build the backend configured in settings
+
+    Args:
+        settings: Dict of app settings (print_backend, print_device,
+            brother_ql_model, brother_ql_label)
+    """
+    backend = settings.get('print_backend') or 'file'
+    device = settings.get('print_device') or ''
+    if backend == 'brother_ql':
+        if not device:
+            raise ValueError("No printer device configured")
+        return BrotherQLBackend(device, settings.get('brother_ql_model') or 'QL-800',
+                                settings.get('brother_ql_label') or '62')
+    if backend == 'file':
+        return FileBackend(device or os.path.join('data', 'labels'))
+    raise ValueError(f"Unknown print backend: {backend}")
+
+
+def enqueue(conn, labels, label_size, max_attempts=5):
+    """
+    Add a print job (committed by the caller)
+
+    Returns:
+        The new job id
+    """
+    now = now_iso()
+    cur = conn.execute("""
+        INSERT INTO print_jobs (label_size, labels, max_attempts, next_attempt_at, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (label_size, json.dumps(labels), max_attempts, now, now, now))
+    return cur.lastrowid
+
+
+def job_status(conn, job_id):
+    """Return a job's status fields as a dict (None if unknown)"""
+    row = conn.execute("""
+        SELECT id, status, attempts, max_attempts, last_error, created_at, updated_at
+        FROM print_jobs WHERE id = ?
+    """, (job_id,)).fetchone()
+    return dict(row) if row else None
+
+
+class PrintQueue(LeaseQueue):
+    table = 'print_jobs'
+    running_status = 'printing'
+    lease_seconds = 300
+    retry_base_seconds = 2
+
+    def __init__(self, connect, get_backend, render, poll_interval=5):
+        """
+        Initialize the queue
+
+        Args:
+            connect: Callable returning a database connection (closed after use)
+            get_backend: Callable returning the current backend (settings can change)
+            render: Callable (labels, label_size) -> list of label images
+            poll_interval: Seconds between checks for jobs queued by other processes
+        """
+        super().__init__(connect, poll_interval)
+        self.get_backend = get_backend
+        self.render = render
+
+    def describe(self, job):
+        return f"Print job {job['id']}"
+
+    def execute(self, job):
+        images = self.render(json.loads(job['labels']), job['label_size'])
+        self.get_backend().send(job['id'], images)
@@ -2,6 +2,7 @@
 CREATE TABLE IF NOT EXISTS families (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     phone TEXT,
+    phone_digits_rev TEXT,  -- see phone_search.py
     troop TEXT,
     default_adult_id INTEGER,
     authorized_adults TEXT,
@@ -15,6 +16,7 @@ CREATE TABLE IF NOT EXISTS adults (
     name_hash TEXT,
     name_token_hashes TEXT,
     phone TEXT,
+    phone_digits_rev TEXT,  -- see phone_search.py
     FOREIGN KEY (family_id) REFERENCES families(id)
 );
 
@@ -25,6 +27,7 @@ CREATE TABLE IF NOT EXISTS kids (
     name_hash TEXT,
     name_token_hashes TEXT,
     notes TEXT,
+    tlc_id TEXT,
     FOREIGN KEY (family_id) REFERENCES families(id)
 );
 
@@ -33,7 +36,9 @@ CREATE TABLE IF NOT EXISTS events (
     name TEXT NOT NULL,
     start_time TEXT NOT NULL,
     end_time TEXT,
-    description TEXT
+    description TEXT,
+    ical_uid TEXT,  -- iCal UID and occurrence key of synced events (see ical_sync.py)
+    ical_recurrence_id TEXT
 );
 
 CREATE TABLE IF NOT EXISTS settings (
@@ -41,6 +46,29 @@ CREATE TABLE IF NOT EXISTS settings (
     value TEXT
 );
 
+-- Bumped by triggers on every settings write; lets workers cheaply detect stale cached settings
+CREATE TABLE IF NOT EXISTS settings_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    generation INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO settings_version (id, generation) VALUES (1, 0);
+
+CREATE TRIGGER IF NOT EXISTS settings_version_on_insert AFTER INSERT ON settings
+BEGIN
+    UPDATE settings_version SET generation = generation + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS settings_version_on_update AFTER UPDATE ON settings
+BEGIN
+    UPDATE settings_version SET generation = generation + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS settings_version_on_delete AFTER DELETE ON settings
+BEGIN
+    UPDATE settings_version SET generation = generation + 1 WHERE id = 1;
+END;
+
 CREATE TABLE IF NOT EXISTS checkins (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     kid_id INTEGER NOT NULL,
@@ -49,6 +77,7 @@ CREATE TABLE IF NOT EXISTS checkins (
     checkin_time TEXT NOT NULL,
     checkout_time TEXT,
     checkout_code TEXT,
+    tlc_synced BOOLEAN DEFAULT 0,
     FOREIGN KEY (kid_id) REFERENCES kids(id),
     FOREIGN KEY (event_id) REFERENCES events(id)
 );
@@ -62,10 +91,314 @@ CREATE TABLE IF NOT EXISTS share_tokens (
     created_at TEXT NOT NULL,
     expires_at TEXT NOT NULL,
     used INTEGER DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0,  -- bumped when a covered check-in changes (share page cache)
     FOREIGN KEY (family_id) REFERENCES families(id),
     FOREIGN KEY (event_id) REFERENCES events(id)
 );
 
+-- Hot-path indexes (keep in sync with migrations.py)
+CREATE INDEX IF NOT EXISTS idx_checkins_event_open ON checkins(event_id, checkout_time);
+CREATE INDEX IF NOT EXISTS idx_checkins_kid_event ON checkins(kid_id, event_id, checkout_time);
+CREATE INDEX IF NOT EXISTS idx_checkins_checkout_code ON checkins(checkout_code, checkout_time);
+CREATE INDEX IF NOT EXISTS idx_checkins_checkin_time ON checkins(checkin_time);
+CREATE INDEX IF NOT EXISTS idx_checkins_event_time ON checkins(event_id, checkin_time);
+CREATE INDEX IF NOT EXISTS idx_kids_family ON kids(family_id);
+CREATE INDEX IF NOT EXISTS idx_adults_family ON adults(family_id);
+CREATE INDEX IF NOT EXISTS idx_kids_name_hash ON kids(name_hash);
+CREATE INDEX IF NOT EXISTS idx_adults_name_hash ON adults(name_hash);
+CREATE INDEX IF NOT EXISTS idx_kids_name_nocase ON kids(name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_adults_name_nocase ON adults(name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_families_phone ON families(phone);
+CREATE INDEX IF NOT EXISTS idx_families_phone_digits_rev ON families(phone_digits_rev);
+CREATE INDEX IF NOT EXISTS idx_adults_phone_digits_rev ON adults(phone_digits_rev);
+CREATE INDEX IF NOT EXISTS idx_events_start_time ON events(start_time);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_events_ical_uid ON events(ical_uid, ical_recurrence_id) WHERE ical_uid IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_share_tokens_used ON share_tokens(used);
+
+-- Inverted index for name search: one row per (name token hash, person), maintained
+-- from kids/adults.name_token_hashes by the triggers below
+CREATE TABLE IF NOT EXISTS name_tokens (
+    token_hash TEXT NOT NULL,
+    person_kind TEXT NOT NULL,  -- 'kid' or 'adult'
+    person_id INTEGER NOT NULL,
+    family_id INTEGER NOT NULL,
+    PRIMARY KEY (token_hash, person_kind, person_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_name_tokens_person ON name_tokens(person_kind, person_id);
+
+CREATE TRIGGER IF NOT EXISTS name_tokens_kids_insert AFTER INSERT ON kids
+BEGIN
+    INSERT OR IGNORE INTO name_tokens (token_hash, person_kind, person_id, family_id)
+    SELECT value, 'kid', NEW.id, NEW.family_id
+    FROM json_each(CASE WHEN json_valid(NEW.name_token_hashes) THEN NEW.name_token_hashes ELSE '[]' END);
+END;
+
+CREATE TRIGGER IF NOT EXISTS name_tokens_kids_update AFTER UPDATE OF name_token_hashes, family_id ON kids
+BEGIN
+    DELETE FROM name_tokens WHERE person_kind = 'kid' AND person_id = OLD.id;
+    INSERT OR IGNORE INTO name_tokens (token_hash, person_kind, person_id, family_id)
+    SELECT value, 'kid', NEW.id, NEW.family_id
+    FROM json_each(CASE WHEN json_valid(NEW.name_token_hashes) THEN NEW.name_token_hashes ELSE '[]' END);
+END;
+
+CREATE TRIGGER IF NOT EXISTS name_tokens_kids_delete AFTER DELETE ON kids
+BEGIN
+    DELETE FROM name_tokens WHERE person_kind = 'kid' AND person_id = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS name_tokens_adults_insert AFTER INSERT ON adults
+BEGIN
+    INSERT OR IGNORE INTO name_tokens (token_hash, person_kind, person_id, family_id)
+    SELECT value, 'adult', NEW.id, NEW.family_id
+    FROM json_each(CASE WHEN json_valid(NEW.name_token_hashes) THEN NEW.name_token_hashes ELSE '[]' END);
+END;
+
+CREATE TRIGGER IF NOT EXISTS name_tokens_adults_update AFTER UPDATE OF name_token_hashes, family_id ON adults
+BEGIN
+    DELETE FROM name_tokens WHERE person_kind = 'adult' AND person_id = OLD.id;
+    INSERT OR IGNORE INTO name_tokens (token_hash, person_kind, person_id, family_id)
+    SELECT value, 'adult', NEW.id, NEW.family_id
+    FROM json_each(CASE WHEN json_valid(NEW.name_token_hashes) THEN NEW.name_token_hashes ELSE '[]' END);
+END;
+
+CREATE TRIGGER IF NOT EXISTS name_tokens_adults_delete AFTER DELETE ON adults
+BEGIN
+    DELETE FROM name_tokens WHERE person_kind = 'adult' AND person_id = OLD.id;
+END;
+
+-- Change log for per-worker live rosters and the kiosk change feed (see live_roster.py)
+CREATE TABLE IF NOT EXISTS roster_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_id INTEGER NOT NULL,
+    checkin_id INTEGER NOT NULL,
+    change TEXT NOT NULL,  -- 'upsert' (check-in or edited details) or 'remove' (checked out/deleted)
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_roster_changes_event_seq ON roster_changes(event_id, seq);
+
+CREATE TRIGGER IF NOT EXISTS roster_checkins_insert AFTER INSERT ON checkins
+WHEN NEW.checkout_time IS NULL
+BEGIN
+    INSERT INTO roster_changes (event_id, checkin_id, change) VALUES (NEW.event_id, NEW.id, 'upsert');
+END;
+
+CREATE TRIGGER IF NOT EXISTS roster_checkins_update AFTER UPDATE OF checkout_time, event_id ON checkins
+BEGIN
+    INSERT INTO roster_changes (event_id, checkin_id, change)
+    VALUES (OLD.event_id, OLD.id, 'remove');
+    INSERT INTO roster_changes (event_id, checkin_id, change)
+    SELECT NEW.event_id, NEW.id, 'upsert' WHERE NEW.checkout_time IS NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS roster_checkins_delete AFTER DELETE ON checkins
+WHEN OLD.checkout_time IS NULL
+BEGIN
+    INSERT INTO roster_changes (event_id, checkin_id, change) VALUES (OLD.event_id, OLD.id, 'remove');
+END;
+
+CREATE TRIGGER IF NOT EXISTS roster_kids_update AFTER UPDATE OF name, notes ON kids
+BEGIN
+    INSERT INTO roster_changes (event_id, checkin_id, change)
+    SELECT c.event_id, c.id, 'upsert' FROM checkins c
+    WHERE c.kid_id = NEW.id AND c.checkout_time IS NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS roster_kids_delete AFTER DELETE ON kids
+BEGIN
+    INSERT INTO roster_changes (event_id, checkin_id, change)
+    SELECT c.event_id, c.id, 'remove' FROM checkins c
+    WHERE c.kid_id = OLD.id AND c.checkout_time IS NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS roster_families_update AFTER UPDATE OF phone, troop, authorized_adults ON families
+BEGIN
+    INSERT INTO roster_changes (event_id, checkin_id, change)
+    SELECT c.event_id, c.id, 'upsert' FROM kids k JOIN checkins c ON c.kid_id = k.id
+    WHERE k.family_id = NEW.id AND c.checkout_time IS NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS roster_adults_update AFTER UPDATE OF name ON adults
+BEGIN
+    INSERT INTO roster_changes (event_id, checkin_id, change)
+    SELECT c.event_id, c.id, 'upsert' FROM checkins c
+    WHERE c.adult_id = NEW.id AND c.checkout_time IS NULL;
+END;
+
+-- Per-event checkout code pools (see checkout_codes.py)
+CREATE TABLE IF NOT EXISTS checkout_code_pools (
+    event_id INTEGER PRIMARY KEY,
+    free_count INTEGER NOT NULL,  -- Slots 0 .. free_count - 1 hold the free codes
+    issued INTEGER NOT NULL DEFAULT 0,  -- Codes handed out so far (for the utilisation report)
+    created_at TEXT NOT NULL
+);
+
+-- Slots of the permutation whose code isn't 10000 + slot
+CREATE TABLE IF NOT EXISTS checkout_code_slots (
+    event_id INTEGER NOT NULL,
+    slot INTEGER NOT NULL,
+    code TEXT NOT NULL,
+    PRIMARY KEY (event_id, slot)
+) WITHOUT ROWID;
+
+-- Codes handed out from the pool and not yet released
+CREATE TABLE IF NOT EXISTS checkout_code_held (
+    event_id INTEGER NOT NULL,
+    code TEXT NOT NULL,
+    PRIMARY KEY (event_id, code)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS checkout_codes_release_on_checkout AFTER UPDATE OF checkout_time ON checkins
+WHEN OLD.checkout_time IS NULL AND NEW.checkout_time IS NOT NULL
+     AND EXISTS (SELECT 1 FROM checkout_code_held WHERE event_id = NEW.event_id AND code = NEW.checkout_code)
+     AND NOT EXISTS (SELECT 1 FROM checkins WHERE event_id = NEW.event_id
+                     AND checkout_code = NEW.checkout_code AND checkout_time IS NULL)
+BEGIN
+    INSERT OR REPLACE INTO checkout_code_slots (event_id, slot, code)
+    SELECT event_id, free_count, NEW.checkout_code FROM checkout_code_pools WHERE event_id = NEW.event_id;
+    UPDATE checkout_code_pools SET free_count = free_count + 1 WHERE event_id = NEW.event_id;
+    DELETE FROM checkout_code_held WHERE event_id = NEW.event_id AND code = NEW.checkout_code;
+END;
+
+CREATE TRIGGER IF NOT EXISTS checkout_codes_release_on_delete AFTER DELETE ON checkins
+WHEN OLD.checkout_time IS NULL
+     AND EXISTS (SELECT 1 FROM checkout_code_held WHERE event_id = OLD.event_id AND code = OLD.checkout_code)
+     AND NOT EXISTS (SELECT 1 FROM checkins WHERE event_id = OLD.event_id
+                     AND checkout_code = OLD.checkout_code AND checkout_time IS NULL)
+BEGIN
+    INSERT OR REPLACE INTO checkout_code_slots (event_id, slot, code)
+    SELECT event_id, free_count, OLD.checkout_code FROM checkout_code_pools WHERE event_id = OLD.event_id;
+    UPDATE checkout_code_pools SET free_count = free_count + 1 WHERE event_id = OLD.event_id;
+    DELETE FROM checkout_code_held WHERE event_id = OLD.event_id AND code = OLD.checkout_code;
+END;
+
+CREATE TRIGGER IF NOT EXISTS checkout_codes_event_delete AFTER DELETE ON events
+BEGIN
+    DELETE FROM checkout_code_pools WHERE event_id = OLD.id;
+    DELETE FROM checkout_code_slots WHERE event_id = OLD.id;
+    DELETE FROM checkout_code_held WHERE event_id = OLD.id;
+END;
+
+-- Check-ins covered by each share token (see share_tokens.py)
+CREATE TABLE IF NOT EXISTS share_token_checkins (
+    token_id INTEGER NOT NULL,
+    checkin_id INTEGER NOT NULL,
+    PRIMARY KEY (token_id, checkin_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_share_token_checkins_checkin ON share_token_checkins(checkin_id, token_id);
+
+CREATE TRIGGER IF NOT EXISTS share_token_checkins_token_delete AFTER DELETE ON share_tokens
+BEGIN
+    DELETE FROM share_token_checkins WHERE token_id = OLD.id;
+END;
+
+CREATE INDEX IF NOT EXISTS idx_share_tokens_expires_at ON share_tokens(expires_at);
+
+CREATE TRIGGER IF NOT EXISTS share_tokens_version_checkout AFTER UPDATE OF checkout_time ON checkins
+BEGIN
+    UPDATE share_tokens SET version = version + 1
+    WHERE id IN (SELECT token_id FROM share_token_checkins WHERE checkin_id = NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS share_tokens_version_checkin_delete AFTER DELETE ON checkins
+BEGIN
+    UPDATE share_tokens SET version = version + 1
+    WHERE id IN (SELECT token_id FROM share_token_checkins WHERE checkin_id = OLD.id);
+END;
+
+-- Server-side label print jobs (see print_queue.py)
+CREATE TABLE IF NOT EXISTS print_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    status TEXT NOT NULL DEFAULT 'queued',  -- queued, printing, done, failed
+    label_size TEXT NOT NULL,
+    labels TEXT NOT NULL,  -- JSON list of label dicts
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    last_error TEXT,
+    next_attempt_at TEXT NOT NULL,
+    lease_expires_at TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_print_jobs_status_next ON print_jobs(status, next_attempt_at);
+
+-- Background tasks for slow external I/O (see task_queue.py)
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    label TEXT NOT NULL,  -- What the admin UI shows while waiting
+    status TEXT NOT NULL DEFAULT 'queued',  -- queued, running, done, failed
+    payload TEXT,  -- JSON keyword arguments; cleared when the task finishes
+    result TEXT,
+    progress TEXT,  -- JSON, from report_progress while running
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    last_error TEXT,
+    next_attempt_at TEXT NOT NULL,
+    lease_expires_at TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_tasks_status_next ON tasks(status, next_attempt_at);
+
+-- TLC logins queued tasks refer to instead of carrying credentials (see tlc_logins.py)
+CREATE TABLE IF NOT EXISTS tlc_logins (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    email TEXT NOT NULL,
+    password TEXT NOT NULL,  -- Fernet token (key derived from SECRET_KEY)
+    created_at TEXT NOT NULL
+);
+
+-- Background job leader lease, persisted schedules and run history (see job_runner.py)
+CREATE TABLE IF NOT EXISTS job_leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at REAL NOT NULL  -- unix time
+);
+
+CREATE TABLE IF NOT EXISTS job_schedules (
+    name TEXT PRIMARY KEY,
+    next_run_at TEXT NOT NULL,  -- UTC, YYYY-MM-DDTHH:MM:SSZ
+    last_run_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS job_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job TEXT NOT NULL,
+    holder TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    status TEXT NOT NULL,  -- running, ok, error
+    duration_ms INTEGER,
+    message TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_job_runs_job ON job_runs(job, id);
+
+-- iCal sync runs and the validators for the next conditional fetch (see ical_sync.py)
+CREATE TABLE IF NOT EXISTS ical_sync_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    outcome TEXT NOT NULL,  -- not_modified (304), unchanged (same content hash), synced, error
+    http_status INTEGER,
+    etag TEXT,
+    last_modified TEXT,
+    content_hash TEXT,
+    fetched_bytes INTEGER NOT NULL DEFAULT 0,
+    parsed_events INTEGER NOT NULL DEFAULT 0,
+    inserted INTEGER NOT NULL DEFAULT 0,
+    updated INTEGER NOT NULL DEFAULT 0,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    duration_ms INTEGER NOT NULL DEFAULT 0,
+    message TEXT,
+    window_start TEXT,  -- Recurrence expansion window the events table reflects after this run
+    window_end TEXT
+);
+
 CREATE TABLE IF NOT EXISTS login_attempts (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     ip_address TEXT NOT NULL,
@@ -11,6 +11,8 @@ from pathlib import Path
 import random
 import json
 
+from phone_search import search_key as phone_search_key
+
 # Screenshot configuration
 TROOP_NAME = "Troop 101"
 DATABASE_PATH = os.getenv('DATABASE_PATH', 'data/screenshots.db')
@@ -203,8 +205,8 @@ def seed_families_and_kids(conn):
     for fam_data in FAMILIES:
         # Insert family
         cur = conn.execute(
-            "INSERT INTO families (phone, troop) VALUES (?, ?)",
-            (fam_data['phone'], fam_data['troop'])
+            "INSERT INTO families (phone, phone_digits_rev, troop) VALUES (?, ?, ?)",
+            (fam_data['phone'], phone_search_key(fam_data['phone']), fam_data['troop'])
         )
         family_id = cur.lastrowid
         family_ids.append(family_id)
@@ -0,0 +1,92 @@
+"""
+In-process cache for the ``settings`` table.
+
+Settings change a handful of times a year but are read on every page render,
+so each worker keeps a snapshot of the whole table loaded with one query.
+
+Invalidation works across gunicorn workers without any coordination: triggers
+on ``settings`` bump a generation counter in ``settings_version`` on every
+INSERT, UPDATE or DELETE (including ``INSERT OR REPLACE``). Before serving a
+snapshot the cache reads that single row and reloads only if the generation
+moved.
+"""
+
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    generation INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO settings_version (id, generation) VALUES (1, 0);
+
+CREATE TRIGGER IF NOT EXISTS settings_version_on_insert AFTER INSERT ON settings
+BEGIN
+    UPDATE settings_version SET generation = generation + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS settings_version_on_update AFTER UPDATE ON settings
+BEGIN
+    UPDATE settings_version SET generation = generation + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS settings_version_on_delete AFTER DELETE ON settings
+BEGIN
+    UPDATE settings_version SET generation = generation + 1 WHERE id = 1;
+END;
+"""
+
+
+def ensure_schema(conn):
+    """Create the generation table and triggers if they are missing"""
+    conn.executescript(SCHEMA)
+
+
+class SettingsCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshots = {}  # db key -> (generation, dict)
+        self.loads = 0
+
+    def _generation(self, conn):
+        try:
+            row = conn.execute("SELECT generation FROM settings_version WHERE id = 1").fetchone()
+        except sqlite3.OperationalError as e:
+            if 'no such table' not in str(e):
+                raise
+            # Database predates the cache - add the counter and triggers
+            ensure_schema(conn)
+            row = conn.execute("SELECT generation FROM settings_version WHERE id = 1").fetchone()
+        return row[0] if row else 0
+
+    def snapshot(self, conn, db_key):
+        """
+        Return a dict of all settings, reloading only if they changed
+
+        Args:
+            conn: Open database connection
+            db_key: Identifies the database (its path) so tests/demo DBs don't mix
+
+        Returns:
+            Dict mapping setting key -> value. Callers must not mutate it.
+        """
+        generation = self._generation(conn)
+        cached = self._snapshots.get(db_key)
+        if cached and cached[0] == generation:
+            return cached[1]
+
+        values = {row[0]: row[1] for row in conn.execute("SELECT key, value FROM settings")}
+        self.loads += 1
+
+        # Don't cache values read inside an open write transaction - they may be rolled back
+        if not conn.in_transaction:
+            with self._lock:
+                self._snapshots[db_key] = (generation, values)
+        return values
+
+    def clear(self):
+        """Drop every snapshot (e.g. after a database restore)"""
+        with self._lock:
+            self._snapshots.clear()
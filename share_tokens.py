@@ -0,0 +1,149 @@
+"""
+Share tokens and the check-ins they cover.
+
+A share token backs the QR code / link a family gets at check-in, showing
+their checkout code and which kids are still checked in. Its check-ins live in
+``share_token_checkins`` (indexed both ways) rather than only in the legacy
+comma-separated ``share_tokens.checkin_ids`` column, so checkout can find and
+complete the affected tokens with indexed queries instead of scanning every
+unused token.
+
+The public /share/<token> page is hit by every parent at pickup, so it never
+writes: expired tokens are deleted by a periodic sweeper, and the page is
+rendered from a small payload cached per token. ``share_tokens.version`` is
+bumped by triggers whenever one of the token's check-ins is checked out or
+deleted, which invalidates the cached payload in every worker.
+"""
+
+import threading
+from collections import OrderedDict
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS share_token_checkins (
+    token_id INTEGER NOT NULL,
+    checkin_id INTEGER NOT NULL,
+    PRIMARY KEY (token_id, checkin_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_share_token_checkins_checkin ON share_token_checkins(checkin_id, token_id);
+
+CREATE TRIGGER IF NOT EXISTS share_token_checkins_token_delete AFTER DELETE ON share_tokens
+BEGIN
+    DELETE FROM share_token_checkins WHERE token_id = OLD.id;
+END;
+"""
+
+
+VERSION_SCHEMA = """
+CREATE INDEX IF NOT EXISTS idx_share_tokens_expires_at ON share_tokens(expires_at);
+
+CREATE TRIGGER IF NOT EXISTS share_tokens_version_checkout AFTER UPDATE OF checkout_time ON checkins
+BEGIN
+    UPDATE share_tokens SET version = version + 1
+    WHERE id IN (SELECT token_id FROM share_token_checkins WHERE checkin_id = NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS share_tokens_version_checkin_delete AFTER DELETE ON checkins
+BEGIN
+    UPDATE share_tokens SET version = version + 1
+    WHERE id IN (SELECT token_id FROM share_token_checkins WHERE checkin_id = OLD.id);
+END;
+"""
+
+
+def parse_checkin_ids(value):
+    """Parse a legacy comma-separated checkin_ids value into ints"""
+    return [int(part) for part in (value or '').split(',') if part.strip().isdigit()]
+
+
+def create_token(conn, token, family_id, event_id, checkin_ids, created_at, expires_at):
+    """
+    Store a share token and link it to its check-ins
+
+    Returns:
+        The new share_tokens row id
+    """
+    cur = conn.execute("""
+        INSERT INTO share_tokens (token, family_id, event_id, checkin_ids, created_at, expires_at, used)
+        VALUES (?, ?, ?, ?, ?, ?, 0)
+    """, (token, family_id, event_id, ','.join(str(cid) for cid in checkin_ids), created_at, expires_at))
+    token_id = cur.lastrowid
+    conn.executemany(
+        "INSERT OR IGNORE INTO share_token_checkins (token_id, checkin_id) VALUES (?, ?)",
+        [(token_id, cid) for cid in checkin_ids]
+    )
+    return token_id
+
+
+# Unused tokens covering any of the given check-ins ({placeholders}) whose
+# check-ins are all checked out or deleted
+COMPLETE_TOKENS_QUERY = """
+    UPDATE share_tokens SET used = 1
+    WHERE used = 0 AND id IN (
+        SELECT stc.token_id
+        FROM share_token_checkins stc
+        LEFT JOIN checkins c ON c.id = stc.checkin_id
+        WHERE stc.token_id IN (SELECT token_id FROM share_token_checkins WHERE checkin_id IN ({placeholders}))
+        GROUP BY stc.token_id
+        HAVING SUM(c.id IS NOT NULL AND c.checkout_time IS NULL) = 0
+    )
+"""
+
+SWEEP_QUERY = "DELETE FROM share_tokens WHERE expires_at < ? OR used = 1"
+
+
+def complete_tokens(conn, checkin_ids):
+    """
+    Mark unused tokens covering any of checkin_ids as used once all their
+    check-ins are checked out (deleted check-ins count as checked out)
+
+    Returns:
+        Number of tokens marked used
+    """
+    if not checkin_ids:
+        return 0
+    placeholders = ','.join('?' * len(checkin_ids))
+    cur = conn.execute(COMPLETE_TOKENS_QUERY.format(placeholders=placeholders), list(checkin_ids))
+    return cur.rowcount
+
+
+def sweep_expired(conn, now):
+    """Delete share tokens that have expired or been used. Returns the number deleted."""
+    cur = conn.execute(SWEEP_QUERY, (now,))
+    conn.commit()
+    return cur.rowcount
+
+
+class SharePayloadCache:
+    def __init__(self, max_entries=1000):
+        """
+        Initialize the cache
+
+        Args:
+            max_entries: Most token payloads kept per worker (least recently used are dropped)
+        """
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._payloads = OrderedDict()  # (db key, token) -> (version, payload)
+
+    def get(self, db_key, token, version):
+        """Return the cached payload for a token, or None if missing or out of date"""
+        with self._lock:
+            cached = self._payloads.get((db_key, token))
+            if cached is None or cached[0] != version:
+                return None
+            self._payloads.move_to_end((db_key, token))
+            return cached[1]
+
+    def put(self, db_key, token, version, payload):
+        """Cache a token's payload as of a share_tokens.version"""
+        with self._lock:
+            self._payloads[(db_key, token)] = (version, payload)
+            self._payloads.move_to_end((db_key, token))
+            while len(self._payloads) > self.max_entries:
+                self._payloads.popitem(last=False)
+
+    def clear(self):
+        """Drop every payload (e.g. after a database restore)"""
+        with self._lock:
+            self._payloads.clear()
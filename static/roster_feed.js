@@ -0,0 +1,90 @@
+/**
+ * Live roster updates for the index and kiosk pages.
+ *
+ * Subscribes to the /events/<id>/stream Server-Sent Events feed and applies
+ * check-in/checkout deltas to the "Currently Checked In" list in place, so
+ * tablets no longer reload the whole page to stay current. Browsers without
+ * EventSource, and pages the server turns away when its workers already hold
+ * as many streams as they should, poll /events/<id>/changes instead.
+ */
+const RosterFeed = (function() {
+    let live = false;
+
+    function rosterRows(list) {
+        return list.querySelectorAll('[data-checkin-id]');
+    }
+
+    function removeRow(row) {
+        row.querySelectorAll('[data-bs-toggle="tooltip"]').forEach(el => {
+            const tooltip = bootstrap.Tooltip.getInstance(el);
+            if (tooltip) tooltip.dispose();
+        });
+        row.remove();
+    }
+
+    function applyChange(list, change) {
+        const existing = list.querySelector(`[data-checkin-id="${change.checkin_id}"]`);
+        if (existing) removeRow(existing);
+        if (change.op !== 'upsert') return;
+
+        const template = document.createElement('template');
+        template.innerHTML = change.html.trim();
+        const row = template.content.firstElementChild;
+        // position is the row's index in the server's sorted roster
+        const before = rosterRows(list)[change.position] || null;
+        if (before) {
+            list.insertBefore(row, before);
+        } else {
+            list.appendChild(row);
+        }
+        row.querySelectorAll('[data-bs-toggle="tooltip"]').forEach(el => new bootstrap.Tooltip(el));
+    }
+
+    function applyChanges(options, changes) {
+        const list = document.getElementById(options.listId);
+        if (!list || !changes.length) return;
+        changes.forEach(change => applyChange(list, change));
+        if (options.onChange) options.onChange(list, rosterRows(list).length);
+    }
+
+    function poll(options, since) {
+        fetch(`/events/${options.eventId}/changes?view=${options.view}&since=${since}`)
+            .then(response => response.json())
+            .then(data => {
+                applyChanges(options, data.changes);
+                setTimeout(() => poll(options, data.seq), options.pollInterval || 5000);
+            })
+            .catch(() => setTimeout(() => poll(options, since), options.pollInterval || 5000));
+    }
+
+    /**
+     * Start following an event's roster
+     *
+     * options: eventId, view ('index' or 'kiosk'), listId (element holding the rows),
+     *          since (change sequence the page was rendered at), onChange(list, count)
+     */
+    function start(options) {
+        if (!window.EventSource) {
+            poll(options, options.since);
+            return;
+        }
+        const source = new EventSource(`/events/${options.eventId}/stream?view=${options.view}&since=${options.since}`);
+        source.addEventListener('open', () => { live = true; });
+        // EventSource reconnects by itself, resuming from the last event id
+        source.addEventListener('error', () => { live = false; });
+        source.addEventListener('roster', e => applyChanges(options, JSON.parse(e.data).changes));
+        // Too many open streams on the server: fall back to polling
+        source.addEventListener('poll', e => {
+            source.close();
+            live = false;
+            poll(options, JSON.parse(e.data).seq);
+        });
+    }
+
+    /** Call after a check-in/checkout: the feed delivers the change, so only reload without it */
+    function afterWrite() {
+        if (!live) location.reload();
+    }
+
+    return {start: start, afterWrite: afterWrite, isLive: () => live};
+})();
@@ -0,0 +1,156 @@
+"""
+Durable background tasks for slow external I/O.
+
+Sending email, pushing to or scraping Trail Life Connect, fetching the iCal
+feed and creating backups can each take as long as a third-party server
+cares to take. Request handlers store a task in ``tasks`` and return at
+once; a worker thread in each app process claims tasks and runs the handler
+registered for the task's kind with its JSON payload as keyword arguments.
+
+A handler returns a short message for the admin UI (see ``task_status``) or
+raises, and a long-running one can call ``report_progress`` as it goes.
+Failures are retried with exponential backoff up to ``max_attempts``;
+raising ``PermanentError`` fails the task at once. A task claimed by a
+worker that died is picked up again once its lease expires. Claiming,
+leases and backoff are shared with the print queue (see lease_queue.py).
+
+Payloads carry identifiers rather than secrets (TLC tasks get a
+``tlc_logins`` id, the password reset email generates its own code) and are
+cleared once the task finishes.
+"""
+
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+from lease_queue import LeaseQueue, now_iso
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    label TEXT NOT NULL,  -- What the admin UI shows while waiting
+    status TEXT NOT NULL DEFAULT 'queued',  -- queued, running, done, failed
+    payload TEXT,  -- JSON keyword arguments; cleared when the task finishes
+    result TEXT,
+    progress TEXT,  -- JSON, from report_progress while running
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    last_error TEXT,
+    next_attempt_at TEXT NOT NULL,
+    lease_expires_at TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_tasks_status_next ON tasks(status, next_attempt_at);
+"""
+
+# Least time between progress writes for one task
+PROGRESS_INTERVAL = 1.0
+
+# The task the current worker thread is running (for report_progress)
+_current = threading.local()
+
+
+class PermanentError(Exception):
+    """A task failure that retrying won't fix (bad settings, bad input)"""
+
+
+def enqueue(conn, kind, label, payload, max_attempts=3):
+    """
+    Add a task (committed by the caller)
+
+    Returns:
+        The new task id
+    """
+    now = now_iso()
+    cur = conn.execute("""
+        INSERT INTO tasks (kind, label, payload, max_attempts, next_attempt_at, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (kind, label, json.dumps(payload), max_attempts, now, now, now))
+    return cur.lastrowid
+
+
+def task_status(conn, task_id):
+    """Return a task's status fields as a dict (None if unknown)"""
+    row = conn.execute("""
+        SELECT id, kind, label, status, result, progress, attempts, max_attempts, last_error, created_at, updated_at
+        FROM tasks WHERE id = ?
+    """, (task_id,)).fetchone()
+    if row is None:
+        return None
+    status = dict(row)
+    status['progress'] = json.loads(status['progress']) if status['progress'] else None
+    return status
+
+
+def report_progress(force=False, **progress):
+    """
+    Record the running task's progress (e.g. done=3, total=10), shown by the
+    status endpoint. Writes are throttled to one per PROGRESS_INTERVAL unless
+    ``force``. Does nothing outside a task.
+    """
+    task = getattr(_current, 'task', None)
+    if task is None:
+        return
+    now = time.monotonic()
+    if not force and now - task['reported_at'] < PROGRESS_INTERVAL:
+        return
+    task['reported_at'] = now
+    conn = task['connect']()
+    try:
+        conn.execute("UPDATE tasks SET progress = ?, updated_at = ? WHERE id = ?",
+                     (json.dumps(progress), now_iso(), task['id']))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def prune(conn, days=7):
+    """Delete finished tasks older than ``days``. Returns the number removed."""
+    cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
+    cur = conn.execute("DELETE FROM tasks WHERE status IN ('done', 'failed') AND updated_at < ?", (cutoff,))
+    conn.commit()
+    return cur.rowcount
+
+
+class TaskQueue(LeaseQueue):
+    table = 'tasks'
+    running_status = 'running'
+    lease_seconds = 900
+    retry_base_seconds = 10
+
+    def __init__(self, connect, handlers, poll_interval=5, threads=2):
+        """
+        Initialize the queue
+
+        Args:
+            connect: Callable returning a database connection (closed after use)
+            handlers: Dict of task kind -> callable taking the payload as keyword arguments
+            poll_interval: Seconds between checks for tasks queued by other processes
+            threads: Worker threads per process (so one slow server doesn't hold up the rest)
+        """
+        super().__init__(connect, poll_interval, threads)
+        self.handlers = handlers
+
+    def describe(self, task):
+        return f"Task {task['id']} ({task['kind']})"
+
+    def is_permanent(self, error):
+        return isinstance(error, PermanentError)
+
+    def finished_columns(self, result):
+        # Payloads are only needed until the task finishes
+        return {'payload': None, 'result': str(result) if result is not None else None}
+
+    def execute(self, task):
+        handler = self.handlers.get(task['kind'])
+        if handler is None:
+            raise PermanentError(f"Unknown task kind: {task['kind']}")
+        _current.task = {'id': task['id'], 'connect': self.connect, 'reported_at': 0.0}
+        try:
+            return handler(**json.loads(task['payload'] or '{}'))
+        finally:
+            _current.task = None
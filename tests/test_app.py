@@ -1,31 +1,292 @@
+import re
+import time
 import pytest
 import sqlite3
 from pathlib import Path
-from app import app, get_db, init_db, DB_PATH
+import app as app_module
+import live_roster
+import share_tokens
+from app import app, bootstrap, cleanup_expired_tokens, get_db, get_db_pool, get_live_roster, get_setting, roster_cache, settings_cache, init_db, DB_PATH
 
 @pytest.fixture
-def client():
+def client(tmp_path):
     app.config['TESTING'] = True
-    test_db = ':memory:'
+    # Pooled connections are per database file, so use a real file rather than :memory:
+    test_db = str(tmp_path / 'test.db')
     app.config['DATABASE'] = test_db
     conn = sqlite3.connect(test_db)
     conn.row_factory = sqlite3.Row
     schema_path = Path(__file__).parent.parent / 'schema.sql'
     with open(schema_path) as f:
         conn.executescript(f.read())
+    conn.execute("INSERT INTO settings (key, value) VALUES ('is_setup_complete', 'true')")
     conn.commit()
     with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['authenticated'] = True
         yield client
     conn.close()
 
+def get_test_db():
+    conn = sqlite3.connect(app.config['DATABASE'])
+    conn.row_factory = sqlite3.Row
+    return conn
+
 def test_index(client):
-    rv = client.get('/')
+    conn = get_test_db()
+    cur = conn.execute("INSERT INTO events (name, start_time) VALUES ('Meeting', datetime('now'))")
+    event_id = cur.lastrowid
+    conn.commit()
+    conn.close()
+
+    rv = client.get(f'/?event_id={event_id}')
     assert b'Check In' in rv.data
 
+def test_live_roster_applies_changes_incrementally(client):
+    conn = get_test_db()
+    event_id = conn.execute("INSERT INTO events (name, start_time) VALUES ('Meeting', datetime('now'))").lastrowid
+    family_id = conn.execute("INSERT INTO families (phone, troop) VALUES ('1234', 'Test')").lastrowid
+    adult_id = conn.execute("INSERT INTO adults (family_id, name) VALUES (?, 'Pat Adams')", (family_id,)).lastrowid
+    kid_ids = [conn.execute("INSERT INTO kids (family_id, name) VALUES (?, ?)", (family_id, name)).lastrowid
+               for name in ('Sam Young', 'Alex Brown')]
+    conn.execute("INSERT INTO checkins (kid_id, adult_id, event_id, checkin_time) VALUES (?, ?, ?, '2024-01-05T14:00:00')",
+                 (kid_ids[0], adult_id, event_id))
+    conn.commit()
+
+    with app.app_context():
+        assert [c['kid_name'] for c in get_live_roster(get_db(), event_id)] == ['Sam Young']
+        rebuilds = roster_cache.rebuilds
+
+    # Writes from any connection are picked up from the change log, sorted by last name
+    conn.execute("INSERT INTO checkins (kid_id, adult_id, event_id, checkin_time) VALUES (?, ?, ?, '2024-01-05T14:05:00')",
+                 (kid_ids[1], adult_id, event_id))
+    conn.execute("UPDATE kids SET name = 'Sam Adams' WHERE id = ?", (kid_ids[0],))
+    conn.commit()
+    with app.app_context():
+        roster = get_live_roster(get_db(), event_id)
+        assert [c['kid_name'] for c in roster] == ['Sam Adams', 'Alex Brown']
+        assert roster[0]['formatted_time'] != 'N/A'
+
+    conn.execute("UPDATE checkins SET checkout_time = '2024-01-05T15:00:00' WHERE kid_id = ?", (kid_ids[0],))
+    conn.commit()
+    conn.close()
+    with app.app_context():
+        assert [c['kid_name'] for c in get_live_roster(get_db(), event_id)] == ['Alex Brown']
+        assert roster_cache.rebuilds == rebuilds
+    # A roster already handed to a request is never changed under it
+    assert [c['kid_name'] for c in roster] == ['Sam Adams', 'Alex Brown']
+
+    assert b'Alex Brown' in client.get(f'/kiosk?event_id={event_id}').data
+
+def test_roster_stream_sends_changes_since_last_event_id(client):
+    conn = get_test_db()
+    event_id = conn.execute("INSERT INTO events (name, start_time) VALUES ('Meeting', datetime('now'))").lastrowid
+    family_id = conn.execute("INSERT INTO families (phone, troop) VALUES ('1234', 'Test')").lastrowid
+    adult_id = conn.execute("INSERT INTO adults (family_id, name) VALUES (?, 'Pat Adams')", (family_id,)).lastrowid
+    kid_id = conn.execute("INSERT INTO kids (family_id, name) VALUES (?, 'Sam Young')", (family_id,)).lastrowid
+    checkin_id = conn.execute("INSERT INTO checkins (kid_id, adult_id, event_id, checkin_time) VALUES (?, ?, ?, datetime('now'))",
+                              (kid_id, adult_id, event_id)).lastrowid
+    conn.commit()
+
+    app.config['ROSTER_STREAM_SECONDS'] = 0
+    try:
+        rv = client.get(f'/events/{event_id}/stream?view=kiosk', headers={'Last-Event-ID': '0'})
+    finally:
+        app.config.pop('ROSTER_STREAM_SECONDS')
+    body = rv.get_data(as_text=True)
+    assert rv.mimetype == 'text/event-stream'
+    assert 'event: roster' in body
+    assert f'data-checkin-id=\\"{checkin_id}\\"' in body
+    assert 'Sam Young' in body
+
+    seq = client.get(f'/events/{event_id}/changes?since=0').get_json()['seq']
+    conn.execute("UPDATE checkins SET checkout_time = datetime('now') WHERE id = ?", (checkin_id,))
+    conn.commit()
+    conn.close()
+    data = client.get(f'/events/{event_id}/changes?since={seq}').get_json()
+    assert data['changes'] == [{'op': 'remove', 'checkin_id': checkin_id}]
+    assert data['seq'] > seq
+
+def test_roster_streams_per_worker_are_capped(client, monkeypatch):
+    conn = get_test_db()
+    event_id = conn.execute("INSERT INTO events (name, start_time) VALUES ('Meeting', datetime('now'))").lastrowid
+    conn.commit()
+    conn.close()
+
+    # Earlier tests' responses are never closed, so their slots are still counted
+    monkeypatch.setattr(app_module, 'roster_streams_open', 0)
+    app.config.update(ROSTER_STREAM_SECONDS=0, ROSTER_STREAM_MAX_PER_WORKER=1)
+    try:
+        # A stream holds a slot until the server closes it
+        rv = client.get(f'/events/{event_id}/stream?since=3')
+        assert rv.get_data(as_text=True).startswith('retry: 1000')
+        assert app_module.roster_streams_open == 1
+        rv.close()
+        assert app_module.roster_streams_open == 0
+
+        # With the worker's one slot taken the page is told to poll from where it was
+        monkeypatch.setattr(app_module, 'roster_streams_open', 1)
+        body = client.get(f'/events/{event_id}/stream?since=3').get_data(as_text=True)
+        assert body == 'event: poll\ndata: {"seq": 3}\n\n'
+        assert app_module.roster_streams_open == 1
+    finally:
+        app.config.pop('ROSTER_STREAM_SECONDS')
+        app.config.pop('ROSTER_STREAM_MAX_PER_WORKER')
+
+def test_checkin_selected_checks_in_family_in_one_batch(client):
+    conn = get_test_db()
+    event_id = conn.execute("INSERT INTO events (name, start_time) VALUES ('Meeting', datetime('now'))").lastrowid
+    family_id = conn.execute("INSERT INTO families (phone, troop) VALUES ('1234', 'Test')").lastrowid
+    adult_id = conn.execute("INSERT INTO adults (family_id, name) VALUES (?, 'Pat Adams')", (family_id,)).lastrowid
+    kid_ids = [conn.execute("INSERT INTO kids (family_id, name) VALUES (?, ?)", (family_id, name)).lastrowid
+               for name in ('Sam Adams', 'Alex Adams', 'Jo Adams')]
+    conn.execute("INSERT INTO checkins (kid_id, adult_id, event_id, checkin_time, checkout_code) VALUES (?, ?, ?, datetime('now'), '54321')",
+                 (kid_ids[0], adult_id, event_id))
+    conn.commit()
+
+    rv = client.post('/checkin_selected', data={
+        'family_id': family_id, 'adult_id': adult_id, 'event_id': event_id,
+        'kid_ids': [str(k) for k in kid_ids] + [str(kid_ids[1])]
+    })
+    data = rv.get_json()
+    assert data['success']
+    assert data['message'] == 'Checked in 2 kid(s)'
+    # Siblings share the code already handed out for this family
+    assert data['checkout_code'] == '54321'
+    assert [c['kid_name'] for c in data['checkins']] == ['Alex Adams', 'Jo Adams']
+
+    rows = conn.execute("SELECT id, kid_id, checkout_code FROM checkins WHERE event_id = ? AND kid_id != ? ORDER BY kid_id",
+                        (event_id, kid_ids[0])).fetchall()
+    conn.close()
+    assert [(r['id'], r['kid_id'], r['checkout_code']) for r in rows] == \
+        [(c['id'], c['kid_id'], '54321') for c in data['checkins']]
+
+def test_checkin_selected_reports_exhausted_code_pool(client, monkeypatch):
+    import checkout_codes
+    conn = get_test_db()
+    event_id = conn.execute("INSERT INTO events (name, start_time) VALUES ('Meeting', datetime('now'))").lastrowid
+    families = []
+    for phone in ('1234', '5678'):
+        family_id = conn.execute("INSERT INTO families (phone, troop) VALUES (?, 'Test')", (phone,)).lastrowid
+        adult_id = conn.execute("INSERT INTO adults (family_id, name) VALUES (?, 'Pat Adams')", (family_id,)).lastrowid
+        kid_id = conn.execute("INSERT INTO kids (family_id, name) VALUES (?, 'Sam Adams')", (family_id,)).lastrowid
+        families.append({'family_id': family_id, 'adult_id': adult_id, 'event_id': event_id, 'kid_ids': [kid_id]})
+    conn.commit()
+    monkeypatch.setattr(checkout_codes, 'CAPACITY', 1)
+
+    assert client.post('/checkin_selected', data=families[0]).get_json()['checkout_code'] == '10000'
+    # Resubmitting checks nobody in, so no code is drawn
+    assert client.post('/checkin_selected', data=families[0]).get_json()['message'] == 'Checked in 0 kid(s)'
+    assert conn.execute("SELECT issued FROM checkout_code_pools WHERE event_id = ?", (event_id,)).fetchone()[0] == 1
+
+    rv = client.post('/checkin_selected', data=families[1])
+    assert rv.status_code == 409
+    assert not rv.get_json()['success']
+    assert conn.execute("SELECT COUNT(*) FROM checkins WHERE event_id = ?", (event_id,)).fetchone()[0] == 1
+    conn.close()
+
+def test_share_token_used_once_all_its_kids_check_out(client):
+    conn = get_test_db()
+    event_id = conn.execute("INSERT INTO events (name, start_time) VALUES ('Meeting', datetime('now'))").lastrowid
+    family_id = conn.execute("INSERT INTO families (phone, troop) VALUES ('1234', 'Test')").lastrowid
+    adult_id = conn.execute("INSERT INTO adults (family_id, name) VALUES (?, 'Pat Adams')", (family_id,)).lastrowid
+    kid_ids = [conn.execute("INSERT INTO kids (family_id, name) VALUES (?, ?)", (family_id, name)).lastrowid
+               for name in ('Sam Adams', 'Alex Adams')]
+    conn.execute("INSERT INTO settings (key, value) VALUES ('require_checkout_code', 'false')")
+    conn.commit()
+
+    data = client.post('/checkin_selected', data={
+        'family_id': family_id, 'adult_id': adult_id, 'event_id': event_id, 'kid_ids': kid_ids
+    }).get_json()
+    token = data['share_token']
+    assert token
+
+    # The QR image is served separately (SVG), with an ETag for revalidation
+    assert data['qr_code'] == f'/share/{token}/qr.svg'
+    rv = client.get(data['qr_code'])
+    assert rv.mimetype == 'image/svg+xml'
+    assert rv.data.startswith(b'<svg')
+    assert client.get(data['qr_code'], headers={'If-None-Match': rv.headers['ETag']}).status_code == 304
+    assert client.get(f'/share/{token}/qr.png').data.startswith(b'\x89PNG')
+    assert b'Alex Adams' in client.get(f'/share/{token}').data
+
+    assert '✓' not in client.get(f'/share/{token}').get_data(as_text=True)
+
+    # Checkout invalidates the cached share page
+    client.post(f'/checkout/{kid_ids[0]}', data={'event_id': event_id})
+    assert conn.execute("SELECT used FROM share_tokens WHERE token = ?", (token,)).fetchone()[0] == 0
+    assert '✓' in client.get(f'/share/{token}').get_data(as_text=True)
+    client.post(f'/checkout/{kid_ids[1]}', data={'event_id': event_id})
+    assert conn.execute("SELECT used FROM share_tokens WHERE token = ?", (token,)).fetchone()[0] == 1
+    assert client.get(f'/share/{token}').status_code == 404
+    conn.close()
+
+    # Used and expired tokens are removed by the sweeper, not by the share page
+    with app.app_context():
+        assert cleanup_expired_tokens() == 1
+
+def test_checkout_codes_come_from_a_shuffled_pool(client, monkeypatch):
+    import checkout_codes
+    from checkout_codes import allocate_code, pool_stats, CodePoolExhausted
+
+    conn = get_test_db()
+    event_id, small_event_id = [
+        conn.execute("INSERT INTO events (name, start_time) VALUES (?, datetime('now'))", (name,)).lastrowid
+        for name in ('Camporee', 'Meeting')
+    ]
+    family_id = conn.execute("INSERT INTO families (phone, troop) VALUES ('1234', 'Test')").lastrowid
+    adult_id = conn.execute("INSERT INTO adults (family_id, name) VALUES (?, 'Pat Adams')", (family_id,)).lastrowid
+    kid_id = conn.execute("INSERT INTO kids (family_id, name) VALUES (?, 'Sam Adams')", (family_id,)).lastrowid
+
+    def check_in(event, code):
+        conn.execute("INSERT INTO checkins (kid_id, adult_id, event_id, checkin_time, checkout_code) VALUES (?, ?, ?, datetime('now'), ?)",
+                     (kid_id, adult_id, event, code))
+
+    codes = []
+    for _ in range(2000):
+        code = allocate_code(conn, event_id)
+        check_in(event_id, code)
+        codes.append(code)
+    conn.commit()
+    assert len(set(codes)) == 2000
+    assert all(len(code) == 5 and 10000 <= int(code) <= 99999 for code in codes)
+    # Not handed out in sequence
+    assert codes != sorted(codes)
+    # The permutation only stores the slots it has touched
+    assert conn.execute("SELECT COUNT(*) FROM checkout_code_slots WHERE event_id = ?", (event_id,)).fetchone()[0] <= 2000
+    stats = pool_stats(conn, event_id)
+    assert (stats['issued'], stats['in_use'], stats['free']) == (2000, 2000, 88000)
+
+    # Checking out the last holder puts the code back in the pool
+    conn.execute("UPDATE checkins SET checkout_time = datetime('now') WHERE checkout_code = ?", (codes[0],))
+    assert pool_stats(conn, event_id)['free'] == 88001
+
+    # A code an open check-in held before the pool existed is never handed out twice
+    monkeypatch.setattr(checkout_codes, 'CAPACITY', 3)
+    check_in(small_event_id, '10000')
+    last_codes = set()
+    for _ in range(2):
+        code = allocate_code(conn, small_event_id)
+        check_in(small_event_id, code)
+        last_codes.add(code)
+    assert last_codes == {'10001', '10002'}
+    with pytest.raises(CodePoolExhausted):
+        allocate_code(conn, small_event_id)
+
+    # ...and is released like any other once it is checked out
+    conn.execute("UPDATE checkins SET checkout_time = datetime('now') WHERE checkout_code = '10000'")
+    assert allocate_code(conn, small_event_id) == '10000'
+    conn.commit()
+    conn.close()
+    monkeypatch.undo()
+
+    assert client.get(f'/admin/events/{event_id}/code_pool').get_json()['capacity'] == 90000
+
 def test_checkin_last4(client):
     # Add a family
     conn = get_test_db()
-    cur = conn.execute("INSERT INTO families (phone, troop) VALUES ('1234', 'Test')")
+    # Writers keep phone_digits_rev (reversed digits) in sync with phone
+    cur = conn.execute("INSERT INTO families (phone, phone_digits_rev, troop) VALUES ('1234', '4321', 'Test')")
     family_id = cur.lastrowid
     conn.execute("INSERT INTO adults (family_id, name) VALUES (?, 'Test Adult')", (family_id,))
     conn.execute("INSERT INTO kids (family_id, name) VALUES (?, 'Test Kid')", (family_id,))
@@ -36,6 +297,49 @@ def test_checkin_last4(client):
     assert b'Test Adult' in rv.data
     assert b'Test Kid' in rv.data
 
+def test_checkin_last4_matches_formatted_phone_suffix(client):
+    rv = client.post('/admin/families/add', data={
+        'troop': 'Test',
+        'adults': ['Parent One', 'Parent Two'],
+        'adult_phones': ['(555) 010-1234', '555.010.9876'],
+        'kids': ['Kid One']
+    }, follow_redirects=True)
+    assert b'Family added' in rv.data
+
+    # Secondary adult's phone matches too, and that adult becomes the default
+    rv = client.post('/checkin_last4', data={'last4': '9876'})
+    data = rv.get_json()
+    assert data['adults'][1]['name'] == 'Parent Two'
+    assert data['default_adult_id'] == data['adults'][1]['id']
+
+    # Full number with formatting stripped also matches; a non-suffix does not
+    assert client.post('/checkin_last4', data={'last4': '5550101234'}).status_code == 200
+    assert client.post('/checkin_last4', data={'last4': '0101'}).status_code == 404
+
+def test_search_name_uses_token_index(client):
+    # More than the old 100-family scan window; the match is the last family added
+    conn = get_test_db()
+    for i in range(120):
+        cur = conn.execute("INSERT INTO families (phone, troop) VALUES (?, 'Test')", (f'555{i:04d}',))
+        conn.execute("INSERT INTO kids (family_id, name) VALUES (?, ?)", (cur.lastrowid, f'Filler {i}'))
+    conn.commit()
+    conn.close()
+    client.post('/admin/families/add', data={
+        'troop': 'Test', 'adults': ['Pat Quinby'], 'adult_phones': ['5550000'], 'kids': ['Robin Quinby']
+    })
+
+    families = client.post('/search_name', data={'name': 'quin'}).get_json()['families']
+    assert [kid['name'] for kid in families[0]['kids']] == ['Robin Quinby']
+
+    # Renaming re-indexes the person's tokens via the update trigger
+    conn = get_test_db()
+    kid_id = conn.execute("SELECT id FROM kids WHERE name = 'Robin Quinby'").fetchone()['id']
+    conn.execute("UPDATE kids SET name_token_hashes = '[]' WHERE id = ?", (kid_id,))
+    conn.execute("DELETE FROM adults WHERE name = 'Pat Quinby'")
+    conn.commit()
+    conn.close()
+    assert client.post('/search_name', data={'name': 'quin'}).get_json()['families'] == []
+
 def test_admin_families(client):
     rv = client.get('/admin/families')
     assert b'Families' in rv.data
@@ -45,6 +349,7 @@ def test_add_family(client):
         'phone': '5678',
         'troop': 'Test',
         'adults': ['Adult1', 'Adult2'],
+        'adult_phones': ['5678', ''],
         'kids': ['Kid1']
     }, follow_redirects=True)
     assert b'Family added' in rv.data
@@ -87,4 +392,733 @@ def test_edit_family(client):
     assert adults[0]['name'] == 'New Adult'
     kids = conn.execute("SELECT name FROM kids WHERE family_id = ?", (family_id,)).fetchall()
     assert len(kids) == 2
-    conn.close()
\ No newline at end of file
+    conn.close()
+
+def test_export_families_streams_one_row_per_family(client):
+    conn = get_test_db()
+    family_id = conn.execute("INSERT INTO families (phone, troop, authorized_adults) VALUES ('555-1234', '42', 'Grandma')").lastrowid
+    conn.execute("INSERT INTO adults (family_id, name) VALUES (?, 'Pat Adams'), (?, 'Lee Adams')", (family_id, family_id))
+    conn.execute("INSERT INTO kids (family_id, name, notes) VALUES (?, 'Sam Adams', NULL), (?, 'Jo Adams', 'Peanuts')", (family_id, family_id))
+    conn.execute("INSERT INTO families (phone, troop) VALUES ('555-9999', NULL)")
+    conn.commit()
+    conn.close()
+
+    rv = client.get('/admin/families/export')
+    assert rv.is_streamed
+    assert rv.get_data(as_text=True).splitlines() == [
+        'Phone,Troop,Authorized Adults,Adults,Kids,Kid Notes',
+        '555-1234,42,Grandma,Pat Adams; Lee Adams,Sam Adams; Jo Adams,; Peanuts',
+        '555-9999,,,,,',
+    ]
+
+def wait_for_import(client, location):
+    for _ in range(100):
+        state = client.get(location + '?format=json').get_json()
+        if state['status'] != 'running':
+            return state
+        time.sleep(0.05)
+    raise AssertionError('import did not finish')
+
+def test_family_import_dry_run_then_commit_is_searchable(client):
+    import io
+    conn = get_test_db()
+    conn.execute("INSERT INTO families (phone, phone_digits_rev, troop) VALUES ('555-0001', '1000555', 'Old')")
+    conn.commit()
+    conn.close()
+    csv_data = (
+        'Phone,Troop,Authorized Adults,Adults,Kids,Kid Notes\n'
+        '555-0100,,Grandma,Pat Quinby,Robin Quinby; Lee Quinby,; Peanuts\n'
+        '555-0001,,,Sam Old,Kid Old,\n'         # already in the database
+        '(555) 0100,,,Dup Person,Dup Kid,\n'    # same digits as line 2
+        ',,,No Phone,Kid,\n'
+        '555-0200,42,,Alex Smith,\n'
+        '555-0300,Too,Short\n'
+    )
+
+    rv = client.post('/admin/families/import', data={
+        'troop': 'Troop 7', 'dry_run': '1', 'file': (io.BytesIO(csv_data.encode()), 'families.csv')
+    })
+    location = rv.headers['Location']
+    state = wait_for_import(client, location)
+    assert (state['status'], state['families'], state['duplicates'], state['errors']) == ('done', 2, 2, 2)
+    assert [row['line'] for row in state['error_rows']] == [5, 7]
+    assert client.post('/search_name', data={'name': 'quin'}).get_json()['families'] == []
+
+    client.post(location + '/commit')
+    state = wait_for_import(client, location)
+    assert (state['status'], state['dry_run'], state['families'], state['adults'], state['kids']) == ('done', False, 2, 2, 2)
+
+    families = client.post('/search_name', data={'name': 'quin'}).get_json()['families']
+    assert sorted(kid['name'] for kid in families[0]['kids']) == ['Lee Quinby', 'Robin Quinby']
+    conn = get_test_db()
+    row = conn.execute("SELECT troop, phone_digits_rev FROM families WHERE phone = '555-0100'").fetchone()
+    notes = [r['notes'] for r in conn.execute("SELECT notes FROM kids WHERE name LIKE '%Quinby' ORDER BY id")]
+    conn.close()
+    assert (row['troop'], row['phone_digits_rev'], notes) == ('Troop 7', '0010555', ['', 'Peanuts'])
+
+ICS = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//Test//EN
+BEGIN:VEVENT
+UID:meeting-1
+SUMMARY:Troop Meeting
+DTSTART:20300105T180000Z
+DTEND:20300105T193000Z
+DESCRIPTION:{description}
+END:VEVENT
+BEGIN:VEVENT
+UID:campout-1
+SUMMARY:Campout
+DTSTART;VALUE=DATE:20300110
+END:VEVENT
+END:VCALENDAR
+"""
+
+def test_ical_sync_is_conditional_and_only_writes_changes(client, monkeypatch):
+
+    class FakeResponse:
+        def __init__(self, status_code, body=b'', headers=None):
+            self.status_code, self._body, self.headers = status_code, body, headers or {}
+        def raise_for_status(self):
+            pass
+        def iter_content(self, chunk_size):
+            yield self._body
+
+    responses, sent_headers = [], []
+    def fake_get(url, timeout, stream, headers):
+        sent_headers.append(dict(headers or {}))
+        return responses.pop(0)
+    monkeypatch.setattr(app_module.requests, 'get', fake_get)
+    conn = get_test_db()
+    conn.execute("INSERT INTO settings (key, value) VALUES ('ical_url', 'https://calendar.google.com/test.ics')")
+    conn.commit()
+    conn.close()
+
+    body = ICS.format(description='Bring books').encode()
+    responses.append(FakeResponse(200, body))
+    assert app_module.sync_ical_events() == (True, 'Synced 2 events (2 added, 0 updated, 0 removed)')
+    # Same bytes without validators: hashed, not parsed
+    responses.append(FakeResponse(200, body, {'ETag': '"v1"'}))
+    assert app_module.sync_ical_events() == (True, 'Calendar unchanged')
+    responses.append(FakeResponse(304))
+    assert app_module.sync_ical_events() == (True, 'Calendar not modified')
+    assert sent_headers[2] == {'If-None-Match': '"v1"'}
+
+    responses.append(FakeResponse(200, ICS.format(description='Bring tents').encode(), {'ETag': '"v2"'}))
+    assert app_module.sync_ical_events() == (True, 'Synced 2 events (0 added, 1 updated, 0 removed)')
+    assert sent_headers[3] == {'If-None-Match': '"v1"'}
+
+    # A wider date range moves the expansion window: fetch in full and expand again
+    conn = get_test_db()
+    conn.execute("INSERT INTO settings (key, value) VALUES ('event_date_range_months', '6')")
+    conn.commit()
+    conn.close()
+    responses.append(FakeResponse(200, ICS.format(description='Bring tents').encode(), {'ETag': '"v2"'}))
+    assert app_module.sync_ical_events() == (True, 'Synced 2 events (0 added, 0 updated, 0 removed)')
+    assert sent_headers[4] == {}
+
+    conn = get_test_db()
+    runs = conn.execute("SELECT outcome, fetched_bytes, parsed_events, updated FROM ical_sync_runs ORDER BY id").fetchall()
+    descriptions = [r['description'] for r in conn.execute("SELECT description FROM events ORDER BY start_time")]
+    conn.close()
+    assert [(r['outcome'], r['parsed_events'], r['updated']) for r in runs] == \
+        [('synced', 2, 0), ('unchanged', 0, 0), ('not_modified', 0, 0), ('synced', 2, 1), ('synced', 2, 0)]
+    assert runs[0]['fetched_bytes'] == len(body) and runs[2]['fetched_bytes'] == 0
+    assert descriptions == ['Bring tents', '']
+
+RECURRING_ICS = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//Test//EN
+BEGIN:VEVENT
+UID:weekly-1
+SUMMARY:Troop Meeting
+DTSTART;TZID=America/Chicago:20291204T190000
+DTEND;TZID=America/Chicago:20291204T203000
+RRULE:FREQ=WEEKLY
+EXDATE;TZID=America/Chicago:20300115T190000
+END:VEVENT
+BEGIN:VEVENT
+UID:weekly-1
+RECURRENCE-ID;TZID=America/Chicago:20300122T190000
+SUMMARY:Troop Meeting (moved)
+DTSTART;TZID=America/Chicago:20300123T190000
+DTEND;TZID=America/Chicago:20300123T203000
+END:VEVENT
+BEGIN:VEVENT
+UID:once-1
+SUMMARY:{once_name}
+DTSTART:20300110T180000Z
+END:VEVENT
+END:VCALENDAR
+"""
+
+def test_ical_sync_upserts_by_uid_and_expands_recurrences_in_window(client, monkeypatch):
+    from datetime import datetime
+
+    class FakeResponse:
+        status_code, headers = 200, {}
+        def __init__(self, body):
+            self.body = body
+        def raise_for_status(self):
+            pass
+        def iter_content(self, chunk_size):
+            yield self.body
+
+    bodies = [RECURRING_ICS.format(once_name='Court of Honor'), RECURRING_ICS.format(once_name='Court of Honor (Gym)')]
+    monkeypatch.setattr(app_module.requests, 'get', lambda url, **kwargs: FakeResponse(bodies.pop(0).encode()))
+    window = (datetime(2030, 1, 1, tzinfo=app_module.pytz.UTC), datetime(2030, 2, 1, tzinfo=app_module.pytz.UTC))
+    monkeypatch.setattr(app_module, 'ical_sync_window', lambda months: window)
+    legacy_start = datetime(2030, 1, 10, 18, tzinfo=app_module.pytz.UTC).astimezone(app_module.local_tz).isoformat()
+    conn = get_test_db()
+    conn.execute("INSERT INTO settings (key, value) VALUES ('ical_url', 'https://calendar.google.com/test.ics')")
+    # Synced before events had UIDs
+    legacy_id = conn.execute("INSERT INTO events (name, start_time) VALUES ('Court of Honor', ?)", (legacy_start,)).lastrowid
+    conn.commit()
+    conn.close()
+
+    assert app_module.sync_ical_events() == (True, 'Synced 5 events (4 added, 1 updated, 0 removed)')
+    assert app_module.sync_ical_events() == (True, 'Synced 5 events (0 added, 1 updated, 0 removed)')
+
+    conn = get_test_db()
+    rows = conn.execute("SELECT id, ical_uid, ical_recurrence_id, name, start_time FROM events ORDER BY start_time").fetchall()
+    conn.close()
+    assert [(r['ical_uid'], r['name'], r['start_time'][:16]) for r in rows] == [
+        ('weekly-1', 'Troop Meeting', '2030-01-01T19:00'),
+        ('weekly-1', 'Troop Meeting', '2030-01-08T19:00'),
+        ('once-1', 'Court of Honor (Gym)', legacy_start[:16]),
+        ('weekly-1', 'Troop Meeting (moved)', '2030-01-23T19:00'),
+        ('weekly-1', 'Troop Meeting', '2030-01-29T19:00'),
+    ]
+    assert rows[2]['id'] == legacy_id and rows[3]['ical_recurrence_id'] == '20300123T010000Z'
+
+def test_request_shares_pooled_connection(client):
+    with app.test_request_context('/'):
+        assert get_db() is get_db()
+
+    # Connections are reused across requests instead of reopened
+    pool = get_db_pool()
+    opened = pool.opened
+    client.get('/admin/families')
+    client.get('/admin/families')
+    assert pool.opened == opened
+
+def test_pools_in_other_workers_reconnect_after_restore(tmp_path):
+    from db_pool import ConnectionPool
+
+    db_path = tmp_path / 'restore.db'
+    # One pool per worker process
+    restoring, other = ConnectionPool(db_path), ConnectionPool(db_path)
+    conn = other.acquire()
+    conn.execute("CREATE TABLE t (x)")
+    conn.commit()
+    other.release(conn)
+    busy = other.acquire()
+    assert other.opened == 1
+
+    restoring.checkpoint()
+    restoring.mark_replaced()
+    # The idle connection is dropped and a new one opened...
+    conn = other.acquire()
+    assert conn is not busy and other.opened == 2
+    other.release(conn)
+    # ...and one borrowed before the restore isn't put back
+    other.release(busy)
+    assert other.acquire() is conn
+
+def test_settings_cache_invalidated_by_other_connections(client):
+    with app.app_context():
+        assert get_setting('organization_name') is None
+        loads = settings_cache.loads
+        get_setting('organization_name')
+        assert settings_cache.loads == loads
+
+    # A write from another connection (e.g. another worker) bumps the generation
+    conn = get_test_db()
+    conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('organization_name', 'Troop 1')")
+    conn.commit()
+    conn.close()
+
+    with app.app_context():
+        assert get_setting('organization_name') == 'Troop 1'
+
+def test_bootstrap_reports_each_stage(client):
+    report = bootstrap(force=True)
+    assert [r['stage'] for r in report] == ['encryption_migration', 'schema', 'name_hashes', 'password_migration', 'roster_log_prune']
+    assert all(r['seconds'] >= 0 for r in report)
+
+    # Already bootstrapped in this process - workers skip it
+    assert bootstrap() is None
+
+def test_migrations_upgrade_legacy_database(tmp_path):
+    from migrations import MIGRATIONS, apply_migrations, column_exists
+
+    # A database from an old release: no hash/phone/TLC columns, no login or version tables
+    conn = sqlite3.connect(str(tmp_path / 'legacy.db'))
+    conn.executescript("""
+        CREATE TABLE families (id INTEGER PRIMARY KEY AUTOINCREMENT, phone TEXT, troop TEXT,
+                               default_adult_id INTEGER, authorized_adults TEXT);
+        CREATE TABLE adults (id INTEGER PRIMARY KEY AUTOINCREMENT, family_id INTEGER NOT NULL, name TEXT NOT NULL);
+        CREATE TABLE kids (id INTEGER PRIMARY KEY AUTOINCREMENT, family_id INTEGER NOT NULL, name TEXT NOT NULL, notes TEXT);
+        CREATE TABLE events (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, start_time TEXT NOT NULL);
+        CREATE TABLE settings (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE checkins (id INTEGER PRIMARY KEY AUTOINCREMENT, kid_id INTEGER NOT NULL, adult_id INTEGER NOT NULL,
+                               event_id INTEGER NOT NULL, checkin_time TEXT NOT NULL, checkout_time TEXT, checkout_code TEXT);
+        CREATE TABLE share_tokens (id INTEGER PRIMARY KEY AUTOINCREMENT, token TEXT UNIQUE NOT NULL, family_id INTEGER NOT NULL,
+                                   event_id INTEGER NOT NULL, checkin_ids TEXT NOT NULL, created_at TEXT NOT NULL,
+                                   expires_at TEXT NOT NULL, used INTEGER DEFAULT 0);
+        INSERT INTO share_tokens (token, family_id, event_id, checkin_ids, created_at, expires_at)
+        VALUES ('tok', 1, 1, '3,5', '2024-01-01', '2024-01-02');
+    """)
+
+    assert apply_migrations(conn) == [version for version, _, _ in MIGRATIONS]
+    assert conn.execute("SELECT checkin_id FROM share_token_checkins ORDER BY checkin_id").fetchall() == [(3,), (5,)]
+    assert column_exists(conn, 'adults', 'phone')
+    assert column_exists(conn, 'kids', 'tlc_id')
+    assert column_exists(conn, 'checkins', 'tlc_synced')
+    conn.execute("SELECT 1 FROM login_lockout")
+
+    # Already applied - nothing to do
+    assert apply_migrations(conn) == []
+    conn.close()
+
+def test_migrations_are_idempotent_on_fresh_schema(client):
+    from migrations import MIGRATIONS, apply_migrations
+    conn = get_test_db()
+    assert len(apply_migrations(conn)) == len(MIGRATIONS)
+    conn.close()
+
+def test_history_pages_with_keyset_cursor_and_local_date_range(client):
+    conn = get_test_db()
+    event_id = conn.execute("INSERT INTO events (name, start_time) VALUES ('Meeting', '2024-01-05T18:00:00')").lastrowid
+    family_id = conn.execute("INSERT INTO families (phone, troop) VALUES ('1234', 'Test')").lastrowid
+    adult_id = conn.execute("INSERT INTO adults (family_id, name) VALUES (?, 'Pat Adams')", (family_id,)).lastrowid
+    kid_id = conn.execute("INSERT INTO kids (family_id, name) VALUES (?, 'Sam Adams')", (family_id,)).lastrowid
+    # Jan 5 local (America/Chicago) is 06:00 Jan 5 to 06:00 Jan 6 UTC; stored formats vary
+    times = ['2024-01-05T05:59:00', '2024-01-05 06:00:00'] + \
+            [f'2024-01-05T{h:02d}:{m:02d}:00.000001' for h in range(7, 24) for m in range(0, 60, 5)] + \
+            ['2024-01-06 05:59:59', '2024-01-06T06:00:00']
+    conn.executemany("INSERT INTO checkins (kid_id, adult_id, event_id, checkin_time) VALUES (?, ?, ?, ?)",
+                     [(kid_id, adult_id, event_id, t) for t in times])
+    conn.commit()
+    conn.close()
+
+    old_tz = app_module.local_tz
+    app_module.local_tz = app_module.pytz.timezone('America/Chicago')
+    try:
+        seen = []
+        url = f'/history?event_id={event_id}&start_date=2024-01-05&end_date=2024-01-05'
+        for _ in range(5):
+            html = client.get(url).data.decode()
+            seen += re.findall(r'class="history-card-id">#(\d+)<', html)
+            older = re.search(r'href="([^"]+)">Older', html)
+            if not older:
+                break
+            url = older.group(1).replace('&amp;', '&')
+    finally:
+        app_module.local_tz = old_tz
+
+    assert len(times) - 2 > app_module.HISTORY_PAGE_SIZE
+    assert len(seen) == len(times) - 2 == len(set(seen))
+    # Newest first, excluding the check-ins on either side of the local day
+    assert seen[0] == str(len(times) - 1) and seen[-1] == '2'
+
+def test_history_export_streams_filtered_rows_and_email_attaches_gzip(client, monkeypatch):
+    import gzip
+    import json
+    conn = get_test_db()
+    event_id = conn.execute("INSERT INTO events (name, start_time) VALUES ('Meeting', '2024-01-05T18:00:00')").lastrowid
+    other_id = conn.execute("INSERT INTO events (name, start_time) VALUES ('Campout', '2024-01-05T18:00:00')").lastrowid
+    family_id = conn.execute("INSERT INTO families (phone, troop) VALUES ('1234', 'Test')").lastrowid
+    adult_id = conn.execute("INSERT INTO adults (family_id, name) VALUES (?, 'Pat Adams')", (family_id,)).lastrowid
+    kid_id = conn.execute("INSERT INTO kids (family_id, name) VALUES (?, 'Sam Adams')", (family_id,)).lastrowid
+    conn.executemany("INSERT INTO checkins (kid_id, adult_id, event_id, checkin_time, checkout_time) VALUES (?, ?, ?, ?, ?)",
+                     [(kid_id, adult_id, event_id, f'2024-01-05T20:{m:02d}:00', None) for m in range(3)] +
+                     [(kid_id, adult_id, other_id, '2024-01-05T21:00:00', '2024-01-05T22:00:00')])
+    conn.commit()
+    conn.close()
+
+    rv = client.get(f'/admin/history/export?event_id={event_id}')
+    assert rv.mimetype == 'text/csv' and rv.is_streamed
+    lines = rv.get_data(as_text=True).splitlines()
+    assert lines[0] == ','.join(app_module.HISTORY_EXPORT_FIELDS) and len(lines) == 4
+
+    rv = client.get(f'/admin/history/export?format=ndjson&event_id={other_id}')
+    rows = [json.loads(line) for line in rv.get_data(as_text=True).splitlines()]
+    assert [(r['event_name'], r['kid_name']) for r in rows] == [('Campout', 'Sam Adams')]
+    assert client.get('/admin/history/export?format=xml').status_code == 400
+
+    sent = {}
+    def fake_send_email(to_address, subject, html_body, attachment_path=None, attachment_name=None, **kwargs):
+        with gzip.open(attachment_path, 'rt') as f:
+            sent.update(name=attachment_name, lines=f.read().splitlines(), body=html_body)
+        return True, 'sent'
+    monkeypatch.setattr(app_module, 'send_email', fake_send_email)
+    conn = get_test_db()
+    conn.executemany("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                     [(key, 'x') for key in app_module.SMTP_REQUIRED_SETTINGS])
+    conn.commit()
+    conn.close()
+
+    # The report is emailed from the task queue; the page polls the task
+    client.post('/admin/history/email', data={'email_address': 'leader@example.com', 'event_id': event_id})
+    with client.session_transaction() as sess:
+        task_id = sess['tasks'][-1]
+    for _ in range(50):
+        app_module.task_queue.run_pending()
+        task = client.get(f'/tasks/{task_id}').get_json()
+        if task['status'] == 'done':
+            break
+        time.sleep(0.1)
+    assert task['status'] == 'done' and 'leader@example.com' in task['result']
+    assert sent['name'].endswith('.csv.gz')
+    assert len(sent['lines']) == 4 and '<td' not in sent['body']
+    with client.session_transaction() as sess:
+        assert task_id not in sess['tasks']
+
+def test_password_reset_code_is_generated_by_the_email_task(client, monkeypatch):
+
+    sent = {}
+    def fake_send_email(to_address, subject, html_body, plain_text_body=None, **kwargs):
+        sent.update(to=to_address, text=plain_text_body)
+        return True, 'sent'
+    monkeypatch.setattr(app_module, 'send_email', fake_send_email)
+    conn = get_test_db()
+    conn.executemany("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                     [(key, 'x') for key in app_module.SMTP_REQUIRED_SETTINGS] + [('recovery_email', 'owner@example.com')])
+    conn.commit()
+
+    client.post('/forgot-password', data={'method': 'email', 'email': 'Owner@example.com'})
+    with client.session_transaction() as sess:
+        task_id = sess['tasks'][-1]
+    # Nothing secret is queued: the task makes the code when it sends the email
+    assert conn.execute("SELECT payload FROM tasks WHERE id = ?", (task_id,)).fetchone()[0] == '{}'
+    conn.close()
+    # The app's worker thread may already have it; otherwise run it here
+    for _ in range(50):
+        app_module.task_queue.run_pending()
+        task = client.get(f'/tasks/{task_id}').get_json()
+        if task['status'] == 'done':
+            break
+        time.sleep(0.1)
+    assert task['status'] == 'done'
+    assert sent['to'] == 'owner@example.com'
+
+    rv = client.post('/verify-reset-code', data={'reset_code': sent['text'].split(': ')[1]})
+    assert rv.status_code == 302 and rv.headers['Location'].endswith('/reset-password')
+
+# Hot queries run by the index, kiosk, checkout, history and TLC routes
+HOT_QUERIES = {
+    'roster': (live_roster.EVENT_ROSTER_QUERY, (1,)),
+    'events_in_range': (app_module.EVENTS_IN_RANGE_QUERY, ('-3 month', '+3 month')),
+    'default_event': (app_module.DEFAULT_EVENT_QUERY, ('-3 month', '+3 month')),
+    'already_checked_in': (app_module.OPEN_CHECKIN_QUERY, (1, 1)),
+    'family_code': (app_module.FAMILY_CHECKOUT_CODE_QUERY, (1, 1)),
+    'checkout_code': (app_module.CHECKOUT_CODE_QUERY, ('12345',)),
+    'phone_checkout': (app_module.PHONE_CHECKOUT_QUERY, (1, '4321', '4321', '4321:', '4321', '4321:')),
+    'siblings': (app_module.SIBLINGS_QUERY, (1, 1, 1)),
+    'family_members': (app_module.FAMILY_KIDS_QUERY, (1,)),
+    'search_name': (app_module.SEARCH_NAME_QUERY.format(placeholders='?,?'), ('x', 'y')),
+    'share_token_sweep': (share_tokens.SWEEP_QUERY, ('2024-01-01',)),
+    'share_token_completion': (share_tokens.COMPLETE_TOKENS_QUERY.format(placeholders='?,?'), (1, 2)),
+    'history': app_module.history_page_query(None, None, None),
+    'history_event': app_module.history_page_query(1, None, None),
+    'history_page': app_module.history_page_query(1, '2024-01-05', '2024-01-06', '2024-01-06 12:00:00', 50),
+    'tlc_checkins_by_date': (app_module.TLC_DAY_CHECKINS_QUERY, ('2024-01-04', '2024-01-07', '-5 hours', '2024-01-05')),
+    'tlc_member_by_name': (app_module.KID_FAMILY_BY_NAME_QUERY, ('Kid',)),
+    'tlc_family_by_phone': (app_module.FAMILY_BY_PHONE_QUERY, ('555',)),
+    'phone_suffix': (app_module.PHONE_FAMILY_QUERY, ('4321', '4321:') * 3),
+}
+
+@pytest.mark.parametrize('name', sorted(HOT_QUERIES))
+def test_hot_queries_use_indexes(client, name):
+    sql, params = HOT_QUERIES[name]
+    conn = get_test_db()
+    plan = [row['detail'] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+    conn.close()
+    # "SCAN c" (older SQLite: "SCAN TABLE checkins AS c") without "USING ... INDEX" is a full table scan
+    full_scans = [step for step in plan if re.match(r'SCAN (TABLE )?\w+( AS \w+)?$', step)]
+    assert not full_scans, plan
+
+def test_label_renderer_batches_1bit_labels_at_configured_size():
+    pytest.importorskip('PIL')
+    from label_printer import LABEL_SIZES, get_renderer, load_font
+
+    labels = [{'kid_name': f'Camper {i}', 'event_name': 'Spring Camporee', 'event_date': '2025-04-12',
+               'checkin_time': '08:30 AM', 'checkout_code': f'{10000 + i}'} for i in range(20)]
+    renderer = get_renderer('30252')
+    images = renderer.render_batch(labels)
+    width, height = LABEL_SIZES['30252']
+    assert len(images) == 20
+    assert {img.mode for img in images} == {'1'}
+    assert images[0].size == (int(width * 300), int(height * 300))
+    assert images[0].tobytes() != images[1].tobytes()
+
+    # Fonts are loaded once, not per label
+    misses = load_font.cache_info().misses
+    renderer.render_batch(labels)
+    assert load_font.cache_info().misses == misses
+
+def test_server_print_queue_prints_labels_in_background(client, tmp_path):
+    pytest.importorskip('PIL')
+    from app import print_queue
+
+    conn = get_test_db()
+    event_id = conn.execute("INSERT INTO events (name, start_time) VALUES ('Meeting', datetime('now'))").lastrowid
+    family_id = conn.execute("INSERT INTO families (phone, troop) VALUES ('1234', 'Test')").lastrowid
+    adult_id = conn.execute("INSERT INTO adults (family_id, name) VALUES (?, 'Pat Adams')", (family_id,)).lastrowid
+    kid_id = conn.execute("INSERT INTO kids (family_id, name) VALUES (?, 'Sam Adams')", (family_id,)).lastrowid
+    label_dir = tmp_path / 'labels'
+    conn.executemany("INSERT INTO settings (key, value) VALUES (?, ?)", [
+        ('checkout_code_method', 'label'), ('label_print_location', 'server'),
+        ('print_backend', 'file'), ('print_device', str(label_dir)),
+    ])
+    conn.commit()
+    conn.close()
+
+    data = client.post('/checkin_selected', data={
+        'family_id': family_id, 'adult_id': adult_id, 'event_id': event_id, 'kid_ids': [kid_id]
+    }).get_json()
+    # Nothing for the browser to print - the job is queued
+    assert data['labels'] == []
+    job_id = data['print_job_id']
+    assert client.get(f'/print_jobs/{job_id}').get_json()['status'] in ('queued', 'printing', 'done')
+
+    # The worker thread may already have it; otherwise process it here
+    for _ in range(50):
+        print_queue.run_pending()
+        if client.get(f'/print_jobs/{job_id}').get_json()['status'] == 'done':
+            break
+        time.sleep(0.1)
+    assert client.get(f'/print_jobs/{job_id}').get_json()['status'] == 'done'
+    assert [p.name for p in label_dir.iterdir()] == [f'job_{job_id}_1.png']
+
+def test_print_queue_retries_then_fails(tmp_path):
+    from print_queue import SCHEMA, PrintQueue, enqueue, job_status
+
+    class BrokenBackend:
+        def send(self, job_id, images):
+            raise OSError('printer offline')
+
+    # A separate database, so the app's own print worker can't take the job
+    def connect():
+        conn = sqlite3.connect(str(tmp_path / 'queue.db'))
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    queue = PrintQueue(connect, BrokenBackend, lambda labels, size: [])
+    conn = connect()
+    conn.executescript(SCHEMA)
+    job_id = enqueue(conn, [{'kid_name': 'Sam'}], '30336', max_attempts=2)
+    conn.commit()
+
+    assert queue.run_pending() == 1
+    status = job_status(conn, job_id)
+    assert (status['status'], status['attempts'], status['last_error']) == ('queued', 1, 'printer offline')
+
+    # Retry is due after a backoff; make it due now
+    conn.execute("UPDATE print_jobs SET next_attempt_at = '2000-01-01' WHERE id = ?", (job_id,))
+    conn.commit()
+    assert queue.run_pending() == 1
+    assert job_status(conn, job_id)['status'] == 'failed'
+    conn.close()
+
+def test_job_runner_runs_each_job_once_on_the_leader_only(tmp_path):
+    from datetime import datetime, timedelta
+    import pytz
+    from job_runner import SCHEMA, Job, JobRunner, every
+
+    # A separate database, so the app's own runner can't take the lease
+    def connect():
+        conn = sqlite3.connect(str(tmp_path / 'jobs.db'))
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    conn = connect()
+    conn.executescript(SCHEMA)
+    runs = []
+    runners = []
+    for _ in range(2):
+        runner = JobRunner(connect)
+        runner.add(Job('count', lambda: runs.append(1) or 'counted', every(60)))
+        runners.append(runner)
+    first, second = runners
+
+    now = datetime(2026, 1, 1, tzinfo=pytz.UTC)
+    # First sight of a job only schedules it
+    assert first.tick(now) == []
+    assert second.tick(now) == []
+    later = now + timedelta(minutes=2)
+    assert first.tick(later) == ['count']
+    assert second.tick(later) == []
+    assert first.tick(later) == []
+    assert len(runs) == 1
+    run = conn.execute("SELECT holder, status, message, duration_ms FROM job_runs").fetchone()
+    assert (run['holder'], run['status'], run['message']) == (first.holder, 'ok', 'counted')
+    assert run['duration_ms'] is not None
+
+    # The leader goes quiet; once its lease lapses the other worker takes over
+    conn.execute("UPDATE job_leases SET expires_at = 0")
+    conn.commit()
+    assert second.tick(later + timedelta(minutes=2)) == ['count']
+    assert first.tick(later + timedelta(minutes=4)) == []
+    assert second.status(conn)['leader'] == second.holder
+    conn.close()
+
+def test_task_queue_retries_with_backoff_then_fails(tmp_path):
+    from task_queue import SCHEMA, PermanentError, TaskQueue, enqueue, task_status
+
+    calls = []
+    def flaky(to):
+        calls.append(to)
+        raise OSError('connection timed out')
+    def rejected():
+        raise PermanentError('not configured')
+
+    # A separate database, so the app's own task workers can't take the tasks
+    def connect():
+        conn = sqlite3.connect(str(tmp_path / 'tasks.db'))
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    queue = TaskQueue(connect, {'flaky': flaky, 'rejected': rejected, 'ok': lambda: 'sent'})
+    conn = connect()
+    conn.executescript(SCHEMA)
+    flaky_id = enqueue(conn, 'flaky', 'Flaky', {'to': 'a@example.com'}, max_attempts=2)
+    rejected_id = enqueue(conn, 'rejected', 'Rejected', {})
+    ok_id = enqueue(conn, 'ok', 'OK', {})
+    conn.commit()
+
+    assert queue.run_pending() == 3
+    assert calls == ['a@example.com']
+    status = task_status(conn, flaky_id)
+    assert (status['status'], status['attempts'], status['last_error']) == ('queued', 1, 'connection timed out')
+    assert task_status(conn, rejected_id)['status'] == 'failed'
+    assert (task_status(conn, ok_id)['status'], task_status(conn, ok_id)['result']) == ('done', 'sent')
+
+    # The retry waits out its backoff; make it due now
+    assert queue.run_pending() == 0
+    conn.execute("UPDATE tasks SET next_attempt_at = '2000-01-01' WHERE id = ?", (flaky_id,))
+    conn.commit()
+    assert queue.run_pending() == 1
+    assert task_status(conn, flaky_id)['status'] == 'failed'
+    # Finished tasks drop their payload
+    assert conn.execute("SELECT COUNT(*) FROM tasks WHERE payload IS NOT NULL").fetchone()[0] == 0
+    conn.close()
+
+def test_tlc_clients_are_reused_and_log_in_again_when_the_session_lapses():
+    from types import SimpleNamespace
+    from tlc_client import TLCClientCache, TLCSessionExpired, TrailLifeConnectClient
+
+    logins = []
+    class FakeClient(TrailLifeConnectClient):
+        def login(self):
+            logins.append(self.email)
+            return self.password == 'right'
+
+    cache = TLCClientCache(client_class=FakeClient)
+    client = cache.get('leader@example.com', 'right')
+    assert cache.get('Leader@example.com', 'right') is client
+    assert cache.get('leader@example.com', 'wrong') is None
+    assert len(logins) == 2
+
+    # TLC redirects an expired session to its login page; the client logs in again and retries
+    responses = [SimpleNamespace(status_code=200, url='https://www.traillifeconnect.com/login'),
+                 SimpleNamespace(status_code=200, url='https://www.traillifeconnect.com/calendar/toggle-attendance')]
+    client.session = SimpleNamespace(request=lambda method, url, **kwargs: responses.pop(0))
+    assert client.mark_attendance('event1', 'user1') is True
+    assert len(logins) == 3 and responses == []
+
+    # If logging in again fails, the login page (a 200) is not taken for success
+    client.password = 'changed'
+    responses = [SimpleNamespace(status_code=200, url='https://www.traillifeconnect.com/login')]
+    with pytest.raises(TLCSessionExpired):
+        client.mark_attendance('event1', 'user1')
+    assert len(logins) == 4 and responses == []
+    responses = [SimpleNamespace(status_code=200, url='https://www.traillifeconnect.com/login')]
+    assert client.mark_attendance_many('event1', ['user1'], rate=0, attempts=1) == ([], ['user1'])
+    assert responses == []
+
+    # Idle clients are dropped
+    cache.idle_seconds = -1
+    assert cache.get('leader@example.com', 'right') is not client
+
+def test_tlc_roster_sync_adds_kids_that_name_search_finds(client, monkeypatch):
+    from tlc_client import TLCClientCache, TrailLifeConnectClient
+
+    class FakeClient(TrailLifeConnectClient):
+        def login(self):
+            return True
+        def get_upcoming_events(self):
+            return [{'id': 'evt1'}]
+        def get_event_roster(self, event_id):
+            return {'Robin Quinby': {'id': 'tlc-9', 'profile_url': None}}
+    monkeypatch.setattr(app_module, 'tlc_clients', TLCClientCache(client_class=FakeClient))
+
+    with client.session_transaction() as sess:
+        sess['tlc_email'], sess['tlc_password'] = 'leader@example.com', 'secret'
+    client.get('/admin/tlc/roster/sync')
+    with client.session_transaction() as sess:
+        task_id = sess['tasks'][-1]
+    for _ in range(50):
+        app_module.task_queue.run_pending()
+        task = client.get(f'/tasks/{task_id}').get_json()
+        if task['status'] == 'done':
+            break
+        time.sleep(0.1)
+    assert task['result'] == 'Added 1 new kids, linked 0 existing kids.'
+
+    families = client.post('/search_name', data={'name': 'quinby'}).get_json()['families']
+    assert [kid['name'] for kid in families[0]['kids']] == ['Robin Quinby']
+
+def test_tlc_attendance_push_retries_items_and_flags_synced_checkins_at_once(client, monkeypatch):
+    from types import SimpleNamespace
+    import tlc_client
+    from tlc_client import TLCClientCache, TrailLifeConnectClient
+
+    calls = []
+    class FakeClient(TrailLifeConnectClient):
+        def login(self):
+            return True
+        def mark_attendance(self, event_id, tlc_user_id, present=True):
+            calls.append(tlc_user_id)
+            # tlc-b succeeds on its second try; tlc-c never does
+            return tlc_user_id == 'tlc-a' or (tlc_user_id == 'tlc-b' and calls.count('tlc-b') > 1)
+    monkeypatch.setattr(app_module, 'tlc_clients', TLCClientCache(client_class=FakeClient))
+    monkeypatch.setattr(tlc_client, 'time', SimpleNamespace(sleep=lambda seconds: None, monotonic=time.monotonic))
+
+    conn = get_test_db()
+    family_id = conn.execute("INSERT INTO families (phone, troop) VALUES ('1234', 'Test')").lastrowid
+    adult_id = conn.execute("INSERT INTO adults (family_id, name) VALUES (?, 'Pat')", (family_id,)).lastrowid
+    kids = [conn.execute("INSERT INTO kids (family_id, name) VALUES (?, ?)", (family_id, name)).lastrowid
+            for name in ('Ann', 'Ben', 'Cal')]
+    event_id = conn.execute("INSERT INTO events (name, start_time) VALUES ('Meeting', '2024-03-02T18:00:00')").lastrowid
+    conn.executemany("INSERT INTO checkins (kid_id, adult_id, event_id, checkin_time) VALUES (?, ?, ?, '2024-03-02T18:00:00')",
+                     [(kid, adult_id, event_id) for kid in kids])
+    conn.commit()
+
+    with client.session_transaction() as sess:
+        sess['tlc_email'], sess['tlc_password'] = 'leader@example.com', 'secret'
+    form = {'target_date': '2024-03-02'}
+    for kid, tlc_id in zip(kids, ('tlc-a', 'tlc-b', 'tlc-c')):
+        form[f'sync_{kid}'] = 'on'
+        form[f'mapping_{kid}'] = tlc_id
+    client.post('/admin/tlc/sync/evt1/execute', data=form)
+    with client.session_transaction() as sess:
+        task_id = sess['tasks'][-1]
+    # The task refers to a stored login; the password is in neither table as written
+    payload = conn.execute("SELECT payload FROM tasks WHERE id = ?", (task_id,)).fetchone()[0]
+    assert 'secret' not in payload and 'tlc_login_id' in payload
+    assert conn.execute("SELECT COUNT(*) FROM tlc_logins WHERE password LIKE '%secret%'").fetchone()[0] == 0
+    for _ in range(50):
+        app_module.task_queue.run_pending()
+        task = client.get(f'/tasks/{task_id}').get_json()
+        if task['status'] == 'done':
+            break
+        time.sleep(0.1)
+
+    assert task['status'] == 'done' and task['result'] == 'Synced 2 records, but 1 failed.'
+    assert task['progress'] == {'done': 2, 'failed': 1, 'total': 3}
+    assert sorted(calls) == ['tlc-a', 'tlc-b', 'tlc-b', 'tlc-c', 'tlc-c', 'tlc-c']
+    synced = [row[0] for row in conn.execute("SELECT kid_id FROM checkins WHERE tlc_synced = 1 ORDER BY kid_id")]
+    assert synced == kids[:2]
+    conn.close()
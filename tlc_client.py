@@ -1,13 +1,24 @@
 import requests
 from bs4 import BeautifulSoup
+import hashlib
 import logging
-import json
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Seconds to wait on any one TLC request
+REQUEST_TIMEOUT = 30
+
+
+class TLCSessionExpired(Exception):
+    """TLC expired our session and logging in again didn't help"""
+
+
 class TrailLifeConnectClient:
     def __init__(self, email, password):
         self.email = email
@@ -15,6 +26,10 @@ class TrailLifeConnectClient:
         self.session = requests.Session()
         self.base_url = "https://www.traillifeconnect.com"
         self.csrf_token = None
+        # Successful logins so far; lets concurrent requests that all find the
+        # session expired log in again only once
+        self._login_generation = 0
+        self._login_lock = threading.Lock()
         
         # Common headers to mimic a real browser
         self.session.headers.update({
@@ -38,6 +53,36 @@ class TrailLifeConnectClient:
             
         return None
 
+    def _session_lapsed(self, response):
+        """Whether TLC answered with its login page (or refused) because our session expired."""
+        return response.status_code in (401, 403) or response.url.rstrip('/').endswith('/login')
+
+    def _request(self, method, url, **kwargs):
+        """
+        Make a request with the current session, logging in again once if
+        TLC has expired it, and retrying.
+
+        Raises:
+            TLCSessionExpired: The session lapsed and logging in again failed
+                (TLC would otherwise hand back its login page as a 200)
+        """
+        kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+        generation = self._login_generation
+        response = self.session.request(method, url, **kwargs)
+        if self._session_lapsed(response):
+            with self._login_lock:
+                if self._login_generation == generation:
+                    logger.info("TLC session expired, logging in again...")
+                    relogged = self.login()
+                else:
+                    relogged = True  # Another thread already did
+            if not relogged:
+                raise TLCSessionExpired("TLC session expired and logging in again failed")
+            response = self.session.request(method, url, **kwargs)
+            if self._session_lapsed(response):
+                raise TLCSessionExpired("TLC session expired again right after logging in")
+        return response
+
     def login(self):
         """
         Logs into Trail Life Connect.
@@ -46,7 +91,7 @@ class TrailLifeConnectClient:
         
         # 1. Get the login page to fetch cookies and CSRF token
         logger.info("Fetching login page...")
-        response = self.session.get(login_url)
+        response = self.session.get(login_url, timeout=REQUEST_TIMEOUT)
         if response.status_code != 200:
             logger.error("Failed to load login page")
             return False
@@ -88,11 +133,12 @@ class TrailLifeConnectClient:
 
         # 2. Post credentials
         logger.info(f"Posting credentials to {login_url}...")
-        post_response = self.session.post(login_url, data=payload)
+        post_response = self.session.post(login_url, data=payload, timeout=REQUEST_TIMEOUT)
         
         # Check for success
         if "dashboard" in post_response.url or "Logout" in post_response.text:
             logger.info("Login successful!")
+            self._login_generation += 1
             # Update CSRF token from dashboard if it changed
             soup = BeautifulSoup(post_response.text, 'html.parser')
             new_token = self._extract_csrf_token(soup)
@@ -111,7 +157,7 @@ class TrailLifeConnectClient:
         """
         url = f"{self.base_url}/calendar/view-events"
         logger.info(f"Fetching events from {url}...")
-        response = self.session.get(url)
+        response = self._request('GET', url)
         
         if response.status_code != 200:
             logger.error("Failed to fetch calendar events page")
@@ -170,7 +216,7 @@ class TrailLifeConnectClient:
         }
         
         logger.info(f"Fetching roster for event {event_id}...")
-        response = self.session.post(url, data=payload, headers=headers)
+        response = self._request('POST', url, data=payload, headers=headers)
         
         if response.status_code != 200:
             logger.error(f"Failed to fetch roster: {response.status_code}")
@@ -236,7 +282,7 @@ class TrailLifeConnectClient:
             
         logger.info(f"Fetching member details from {profile_url}...")
         try:
-            response = self.session.get(profile_url)
+            response = self._request('GET', profile_url)
             if response.status_code != 200:
                 return {}
                 
@@ -288,12 +334,108 @@ class TrailLifeConnectClient:
         }
         
         logger.info(f"Marking user {tlc_user_id} as {'present' if present else 'absent'} for event {event_id}...")
-        response = self.session.post(url, data=payload, headers=headers)
+        response = self._request('POST', url, data=payload, headers=headers)
         
-        if response.status_code == 200:
+        # A 200 only counts if it isn't TLC's login page
+        if response.status_code == 200 and not self._session_lapsed(response):
             logger.info("Success.")
             return True
         else:
             logger.error(f"Failed: {response.status_code} - {response.text}")
             return False
 
+    def mark_attendance_many(self, event_id, tlc_user_ids, workers=4, rate=5.0, attempts=3, on_progress=None):
+        """
+        Mark many users present, in parallel but no faster than ``rate``
+        requests a second. Each user is tried up to ``attempts`` times, with
+        backoff between tries.
+
+        Args:
+            on_progress: Optional callable (succeeded, failed) counts, called
+                from this thread as each user finishes
+
+        Returns:
+            (succeeded, failed) lists of user ids
+        """
+        limiter = RateLimiter(rate)
+
+        def mark(tlc_user_id):
+            for attempt in range(attempts):
+                if attempt:
+                    time.sleep(2 ** (attempt - 1))
+                limiter.wait()
+                try:
+                    if self.mark_attendance(event_id, tlc_user_id, present=True):
+                        return True
+                except (requests.RequestException, TLCSessionExpired) as e:
+                    logger.warning(f"Marking user {tlc_user_id} failed: {e}")
+            return False
+
+        succeeded, failed = [], []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(mark, tlc_user_id): tlc_user_id for tlc_user_id in tlc_user_ids}
+            for future in as_completed(futures):
+                (succeeded if future.result() else failed).append(futures[future])
+                if on_progress:
+                    on_progress(len(succeeded), len(failed))
+        return succeeded, failed
+
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart, across threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        time.sleep(start - now)
+
+
+class TLCClientCache:
+    """
+    Logged-in clients, kept per account so the requests.Session cookies and
+    CSRF token are reused across page loads and background tasks instead of
+    logging in every time. A client unused for ``idle_seconds`` is dropped;
+    one whose TLC session lapses logs in again on its next request.
+    """
+
+    def __init__(self, idle_seconds=1800, client_class=TrailLifeConnectClient):
+        self.idle_seconds = idle_seconds
+        self.client_class = client_class
+        self._clients = {}  # (email, password hash) -> [client, last used]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(email, password):
+        return (email.lower(), hashlib.sha256(password.encode()).hexdigest())
+
+    def get(self, email, password):
+        """Return a logged-in client for the account, or None if login fails."""
+        key = self._key(email, password)
+        now = time.monotonic()
+        with self._lock:
+            for stale in [k for k, (_, used) in self._clients.items() if now - used > self.idle_seconds]:
+                del self._clients[stale]
+            entry = self._clients.get(key)
+            if entry:
+                entry[1] = now
+                return entry[0]
+
+        client = self.client_class(email, password)
+        if not client.login():
+            return None
+        with self._lock:
+            # Another thread may have logged in meanwhile; either client works
+            self._clients.setdefault(key, [client, now])
+        return client
+
+    def discard(self, email, password):
+        """Forget an account's client (e.g. on logout)."""
+        with self._lock:
+            self._clients.pop(self._key(email, password), None)
@@ -0,0 +1,75 @@
+"""
+Trail Life Connect logins for background tasks.
+
+TLC imports, roster syncs and attendance pushes run on the task queue, in
+whichever worker process claims them, so they need the leader's TLC
+credentials - but a task's payload is plain JSON in ``tasks``. Instead the
+credentials are stored once per login in ``tlc_logins``, with the password
+encrypted under a key derived from the app's SECRET_KEY, and a task carries
+only the row id. Rows are removed when the TLC login is rejected and expire
+after ``MAX_AGE_HOURS``.
+"""
+
+import base64
+import hashlib
+from datetime import datetime, timedelta
+
+from cryptography.fernet import Fernet, InvalidToken
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tlc_logins (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    email TEXT NOT NULL,
+    password TEXT NOT NULL,  -- Fernet token (key derived from SECRET_KEY)
+    created_at TEXT NOT NULL
+);
+"""
+
+# How long a stored login stays usable by tasks
+MAX_AGE_HOURS = 24
+
+
+def _cipher(secret_key):
+    return Fernet(base64.urlsafe_b64encode(hashlib.sha256(f"tlc-logins:{secret_key}".encode()).digest()))
+
+
+def save(conn, secret_key, email, password):
+    """
+    Store a login (committed by the caller)
+
+    Returns:
+        The new login id
+    """
+    cur = conn.execute(
+        "INSERT INTO tlc_logins (email, password, created_at) VALUES (?, ?, ?)",
+        (email, _cipher(secret_key).encrypt(password.encode()).decode(), datetime.utcnow().isoformat())
+    )
+    return cur.lastrowid
+
+
+def load(conn, secret_key, login_id):
+    """Return (email, password) for a login id, or None if it is unknown, expired or unreadable"""
+    cutoff = (datetime.utcnow() - timedelta(hours=MAX_AGE_HOURS)).isoformat()
+    row = conn.execute(
+        "SELECT email, password FROM tlc_logins WHERE id = ? AND created_at >= ?", (login_id, cutoff)
+    ).fetchone()
+    if row is None:
+        return None
+    try:
+        return row[0], _cipher(secret_key).decrypt(row[1].encode()).decode()
+    except InvalidToken:
+        # SECRET_KEY changed since the login was stored
+        return None
+
+
+def delete(conn, login_id):
+    """Forget a login (committed by the caller)"""
+    conn.execute("DELETE FROM tlc_logins WHERE id = ?", (login_id,))
+
+
+def prune(conn):
+    """Delete expired logins. Returns the number removed."""
+    cutoff = (datetime.utcnow() - timedelta(hours=MAX_AGE_HOURS)).isoformat()
+    cur = conn.execute("DELETE FROM tlc_logins WHERE created_at < ?", (cutoff,))
+    conn.commit()
+    return cur.rowcount
@@ -1,10 +1,10 @@
 """
 WSGI entry point for production deployments
 """
-from app import app, ensure_db
+from app import app, bootstrap
 
-# Initialize database on startup
-ensure_db()
+# Initialize database on startup (no-op when the gunicorn master already did it)
+bootstrap()
 
 if __name__ == "__main__":
     app.run()